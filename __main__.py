@@ -81,6 +81,50 @@ OPTIONAL = [
             'help': 'fraction of TPM reads to be included in the heatmap (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--heatmap-linkage-method'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['average', 'complete', 'single', 'weighted', 'ward', 'centroid', 'median'],
+            'default': 'average',
+            'help': 'hierarchical clustering method of the heatmap, "ward", "centroid", "median" and "single" do not need the O(n^2) distance matrix if fastcluster is installed (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--heatmap-max-rows'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'if > 0, genes of the heatmap beyond this number are pre-aggregated into k-means clusters before hierarchical clustering (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--heatmap-formats'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'pdf,png',
+            'help': 'comma-separated file formats of the heatmap figures, raster formats (e.g. png, jpg, tif) are encoded from one render, and each vector format (e.g. pdf, svg) is rendered on its own (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--heatmap-rasterize'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'embed the heatmap cells as an image in vector formats (e.g. pdf), for small and fast pdf of many genes',
+        }
+    },
+    {
+        'keys': ['--top-variable-genes'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'if > 0, only this many highly variable genes (variance of log values) are used for PCA and heatmap clustering (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--sample-group-column'],
         'properties': {
@@ -124,6 +168,59 @@ OPTIONAL = [
             'help': 'completely skip differential analysis including DESeq2, GSEA, and pathway enrichment, i.e. no group contrast',
         }
     },
+    {
+        'keys': ['--parallel-comparisons'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'run pairwise group comparisons concurrently in a process pool bounded by --threads',
+        }
+    },
+    {
+        'keys': ['--tpm-chunk-rows'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'if > 0, compute TPM over chunks of this many genes of the loaded count matrix, with the TPM matrix written to disk and memory-mapped; the memory of the TPM stage is then bounded by the chunk size instead of a float copy of the whole matrix, but the count matrix itself is loaded in full for all stages (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--pca-n-components'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 4,
+            'help': 'number of principal components computed in one fit, PC1/2, PC2/3 and PC3/4 are plotted if available (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--pca-svd-solver'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['auto', 'full', 'randomized', 'arpack'],
+            'default': 'auto',
+            'help': 'SVD solver of PCA, "randomized" and "arpack" compute only the requested components (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--pca-block-rows'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 0,
+            'help': 'if > 0, compute PCA out of core over blocks of this many genes, memory bounded by the block size, the SVD solver is not used (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--sample-distance-metrics'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'pearson,spearman,euclidean,poisson',
+            'help': 'comma-separated sample-sample correlation and distance matrices of TPM and DESeq2-normalized counts, if None then skip (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--volcano-plot-label-genes'],
         'properties': {
@@ -206,6 +303,42 @@ OPTIONAL = [
             'help': 'pathway-level q-value threshold for enrichment analysis (default: %(default)s)',
         }
     },
+    {
+        'keys': ['--sweep-gene-p-thresholds'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'comma-separated gene-level p-value thresholds, for a threshold sweep of volcano plots, enrichment analysis and a summary of counts, from the same DESeq2 fit (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--sweep-gene-q-thresholds'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'comma-separated gene-level q-value thresholds of the threshold sweep (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--sweep-pathway-p-thresholds'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'comma-separated pathway-level p-value thresholds of the threshold sweep (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--sweep-pathway-q-thresholds'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'comma-separated pathway-level q-value thresholds of the threshold sweep (default: %(default)s)',
+        }
+    },
     {
         'keys': ['--organism'],
         'properties': {
@@ -257,6 +390,58 @@ OPTIONAL = [
             'help': 'plot figures in the form and quality for paper publication',
         }
     },
+    {
+        'keys': ['--r-engine'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['rscript', 'embedded'],
+            'default': 'rscript',
+            'help': 'how to run DESeq2 and ComBat-seq, "embedded" uses one in-process R session (rpy2) without CSV round trips (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--deseq2-engine'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'choices': ['r', 'native'],
+            'default': 'r',
+            'help': 'differential expression by the DESeq2 R package, or by its native numpy implementation without R (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--cache-dir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'None',
+            'help': 'directory to cache the results of TPM, ComBat-seq, DESeq2, GSEA and clusterProfiler enrichment across runs, if None then no caching (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--cache-max-gb'],
+        'properties': {
+            'type': float,
+            'required': False,
+            'default': 20.,
+            'help': 'maximum size of the cache directory in GB, least recently used results are evicted (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--profile'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'dump cProfile stats of each stage into "profile" folders in the output directory, and trace the peak Python memory of each stage with tracemalloc',
+        }
+    },
+    {
+        'keys': ['--float32'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'compute TPM in single precision to halve the memory of large count tables',
+        }
+    },
     {
         'keys': ['-o', '--outdir'],
         'properties': {
@@ -339,11 +524,22 @@ class EntryPoint:
             gene_name_column=args.gene_name_column,
             gene_description_column=args.gene_description_column,
             heatmap_read_fraction=args.heatmap_read_fraction,
+            heatmap_linkage_method=args.heatmap_linkage_method,
+            heatmap_max_rows=args.heatmap_max_rows,
+            heatmap_formats=args.heatmap_formats,
+            heatmap_rasterize=args.heatmap_rasterize,
+            top_variable_genes=args.top_variable_genes,
             sample_group_column=args.sample_group_column,
             control_group_name=args.control_group_name,
             experimental_group_name=args.experimental_group_name,
             sample_batch_column=args.sample_batch_column,
             skip_differential_analysis=args.skip_differential_analysis,
+            parallel_comparisons=args.parallel_comparisons,
+            tpm_chunk_rows=args.tpm_chunk_rows,
+            pca_n_components=args.pca_n_components,
+            pca_svd_solver=args.pca_svd_solver,
+            pca_block_rows=args.pca_block_rows,
+            sample_distance_metrics=args.sample_distance_metrics,
             volcano_plot_label_genes=args.volcano_plot_label_genes,
             gsea_input=args.gsea_input,
             gsea_gene_name_keywords=args.gsea_gene_name_keywords,
@@ -353,12 +549,22 @@ class EntryPoint:
             gene_q_threshold=args.gene_q_threshold,
             pathway_p_threshold=args.pathway_p_threshold,
             pathway_q_threshold=args.pathway_q_threshold,
+            sweep_gene_p_thresholds=args.sweep_gene_p_thresholds,
+            sweep_gene_q_thresholds=args.sweep_gene_q_thresholds,
+            sweep_pathway_p_thresholds=args.sweep_pathway_p_thresholds,
+            sweep_pathway_q_thresholds=args.sweep_pathway_q_thresholds,
             organism=args.organism,
             enrichment_pathway_keywords=args.enrichment_pathway_keywords,
             show_n_pathways=args.show_n_pathways,
             colormap=args.colormap,
             invert_colors=args.invert_colors,
             publication_figure=args.publication_figure,
+            r_engine=args.r_engine,
+            deseq2_engine=args.deseq2_engine,
+            cache_dir=args.cache_dir,
+            cache_max_gb=args.cache_max_gb,
+            profile=args.profile,
+            float32=args.float32,
             threads=args.threads,
             debug=args.debug,
             outdir=args.outdir)
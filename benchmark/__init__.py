@@ -0,0 +1,58 @@
+import os
+import shutil
+from typing import List, Tuple
+from .stand_ins import install_stand_ins
+
+
+def main(
+        scales: str,
+        n_groups: int,
+        n_batches: int,
+        stages: str,
+        repeats: int,
+        stand_ins: bool,
+        seed: int,
+        threads: int,
+        debug: bool,
+        outdir: str):
+
+    workdir = f'{outdir}/workdir'
+    for d in [workdir, outdir]:
+        os.makedirs(d, exist_ok=True)
+
+    if stand_ins:
+        install_stand_ins(bindir=f'{workdir}/bin')
+
+    # the pipeline imports rpy2 at module level, so it is imported only after the stand-ins are installed
+    from rna_seq_analysis.template import Settings
+    from .run import Benchmark, STAGES
+
+    settings = Settings(
+        workdir=workdir,
+        outdir=outdir,
+        threads=int(threads),
+        debug=debug,
+        mock=False,
+        for_publication=False)
+
+    Benchmark(settings).main(
+        scales=parse_scales(scales),
+        n_groups=n_groups,
+        n_batches=n_batches,
+        stages=STAGES if stages.lower() == 'all' else stages.split(','),
+        repeats=repeats,
+        seed=seed)
+
+    if not debug:
+        shutil.rmtree(workdir)
+
+
+def parse_scales(scales: str) -> List[Tuple[int, int]]:
+    """
+    e.g. '2000x12,20000x48' -> [(2000, 12), (20000, 48)]
+    """
+    ret = []
+    for scale in scales.split(','):
+        n_genes, n_samples = scale.lower().split('x')
+        ret.append((int(n_genes), int(n_samples)))
+    return ret
@@ -0,0 +1,143 @@
+import argparse
+import warnings
+import benchmark
+warnings.filterwarnings('ignore')
+
+
+PROG = 'python -m benchmark'
+DESCRIPTION = 'Benchmark the stages of RNA-seq analysis on simulated negative binomial counts'
+OPTIONAL = [
+    {
+        'keys': ['--scales'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': '2000x12,20000x48,60000x200',
+            'help': 'comma-separated scales of genes x samples (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--n-groups'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 2,
+            'help': 'number of sample groups (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--n-batches'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 2,
+            'help': 'number of sample batches (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--stages'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'all',
+            'help': 'comma-separated stages to be timed, or "all" (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--repeats'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 3,
+            'help': 'number of repeats of each stage at each scale (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['--stand-ins'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'replace R (rpy2, Rscript) and gsea-cli.sh with no-op stand-ins, to run on a box without them',
+        }
+    },
+    {
+        'keys': ['--seed'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 1,
+            'help': 'random seed of the simulation (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-t', '--threads'],
+        'properties': {
+            'type': int,
+            'required': False,
+            'default': 4,
+            'help': 'number of CPU threads (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-d', '--debug'],
+        'properties': {
+            'action': 'store_true',
+            'help': 'debug mode',
+        }
+    },
+    {
+        'keys': ['-o', '--outdir'],
+        'properties': {
+            'type': str,
+            'required': False,
+            'default': 'benchmark_outdir',
+            'help': 'path to the output directory (default: %(default)s)',
+        }
+    },
+    {
+        'keys': ['-h', '--help'],
+        'properties': {
+            'action': 'help',
+            'help': 'show this help message',
+        }
+    },
+]
+
+
+class EntryPoint:
+
+    parser: argparse.ArgumentParser
+
+    def main(self):
+        self.set_parser()
+        self.add_optional_arguments()
+        self.run()
+
+    def set_parser(self):
+        self.parser = argparse.ArgumentParser(
+            prog=PROG,
+            description=DESCRIPTION,
+            add_help=False,
+            formatter_class=argparse.RawTextHelpFormatter)
+
+    def add_optional_arguments(self):
+        group = self.parser.add_argument_group('optional arguments')
+        for item in OPTIONAL:
+            group.add_argument(*item['keys'], **item['properties'])
+
+    def run(self):
+        args = self.parser.parse_args()
+        benchmark.main(
+            scales=args.scales,
+            n_groups=args.n_groups,
+            n_batches=args.n_batches,
+            stages=args.stages,
+            repeats=args.repeats,
+            stand_ins=args.stand_ins,
+            seed=args.seed,
+            threads=args.threads,
+            debug=args.debug,
+            outdir=args.outdir)
+
+
+if __name__ == '__main__':
+    EntryPoint().main()
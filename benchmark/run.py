@@ -0,0 +1,233 @@
+import os
+import tracemalloc
+import pandas as pd
+import matplotlib.pyplot as plt
+from copy import copy
+from typing import Any, Callable, Dict, List, Tuple
+from rna_seq_analysis import metrics
+from rna_seq_analysis.tpm import TPM
+from rna_seq_analysis.pca import ComputePCA
+from rna_seq_analysis.gsea import BuildExpressionTxt, FilterGeneSets
+from rna_seq_analysis.deseq2 import volcano_plot
+from rna_seq_analysis.heatmap import FilterByCumulativeReads, CountNormalization, Clustermap
+from rna_seq_analysis.template import Processor, Settings
+from .simulate import simulate_dataset, simulate_statistics, write_gene_sets_gmt, \
+    GENE_LENGTH_COLUMN, GENE_NAME_COLUMN
+
+
+STAGES = [
+    'TPM',
+    'FilterByCumulativeReads',
+    'CountNormalization',
+    'ComputePCA',
+    'Clustermap',
+    'volcano_plot',
+    'BuildExpressionTxt',
+    'FilterGeneSets',
+]
+HEATMAP_READ_FRACTION = 0.8
+GENES_PER_GENE_SET = 10  # i.e. n_gene_sets = n_genes / 10
+
+
+class TimedStage(Processor):
+    """
+    Run a function as a stage, so that it is measured in the same way as the stages of the pipeline
+    """
+
+    def main(self, function: Callable[[], Any]) -> Any:
+        return function()
+
+
+class Benchmark(Processor):
+
+    scales: List[Tuple[int, int]]
+    n_groups: int
+    n_batches: int
+    stages: List[str]
+    repeats: int
+    seed: int
+
+    scale_settings: Settings
+    count_df: pd.DataFrame
+    sample_info_df: pd.DataFrame
+    gene_info_df: pd.DataFrame
+    tpm_df: pd.DataFrame
+    filtered_df: pd.DataFrame
+    normalized_df: pd.DataFrame
+    statistics_df: pd.DataFrame
+    gene_sets_gmt: str
+    rows: List[Dict[str, Any]]
+    result_df: pd.DataFrame
+
+    def main(
+            self,
+            scales: List[Tuple[int, int]],
+            n_groups: int,
+            n_batches: int,
+            stages: List[str],
+            repeats: int,
+            seed: int) -> pd.DataFrame:
+
+        self.scales = scales
+        self.n_groups = n_groups
+        self.n_batches = n_batches
+        self.stages = stages
+        self.repeats = repeats
+        self.seed = seed
+
+        for stage in self.stages:
+            assert stage in STAGES, f'Unknown stage "{stage}", choose from {STAGES}'
+
+        tracemalloc.start()  # for the Python peak memory of each stage, which is off in pipeline runs without --profile
+
+        self.rows = []
+        for n_genes, n_samples in self.scales:
+            self.simulate(n_genes=n_genes, n_samples=n_samples)
+            self.prepare_inputs()
+            for stage in self.stages:
+                for i in range(self.repeats):
+                    self.time_stage(stage=stage, n_genes=n_genes, n_samples=n_samples, repeat=i + 1)
+            metrics.pop_records()  # keep the records of this process small
+
+        self.result_df = pd.DataFrame(self.rows)
+        self.write_csv()
+        self.plot_scaling_curves()
+
+        return self.result_df
+
+    def simulate(self, n_genes: int, n_samples: int):
+        self.logger.info(f'Simulate {n_genes} genes x {n_samples} samples')
+
+        self.scale_settings = copy(self.settings)
+        self.scale_settings.outdir = f'{self.outdir}/{n_genes}x{n_samples}'
+        self.scale_settings.workdir = f'{self.workdir}/{n_genes}x{n_samples}'
+        for d in [self.scale_settings.workdir, self.scale_settings.outdir]:
+            os.makedirs(d, exist_ok=True)
+
+        self.count_df, self.sample_info_df, self.gene_info_df = simulate_dataset(
+            n_genes=n_genes,
+            n_samples=n_samples,
+            n_groups=self.n_groups,
+            n_batches=self.n_batches,
+            seed=self.seed)
+
+    def prepare_inputs(self):
+        """
+        Inputs of the downstream stages, which are not timed
+        """
+        self.tpm_df = TPM(self.scale_settings).main(
+            count_df=self.count_df,
+            gene_info_df=self.gene_info_df,
+            gene_length_column=GENE_LENGTH_COLUMN)
+        self.filtered_df = FilterByCumulativeReads(self.scale_settings).main(
+            df=self.tpm_df.copy(),
+            heatmap_read_fraction=HEATMAP_READ_FRACTION)
+        self.normalized_df = CountNormalization(self.scale_settings).main(
+            df=self.filtered_df,
+            log_pseudocount=True,
+            by_sample_reads=False)
+        self.statistics_df = simulate_statistics(
+            count_df=self.count_df,
+            gene_info_df=self.gene_info_df,
+            seed=self.seed)
+        self.gene_sets_gmt = f'{self.scale_settings.workdir}/gene-sets.gmt'
+        write_gene_sets_gmt(
+            gmt=self.gene_sets_gmt,
+            gene_info_df=self.gene_info_df,
+            n_gene_sets=max(1, len(self.count_df) // GENES_PER_GENE_SET),
+            seed=self.seed)
+
+    def time_stage(self, stage: str, n_genes: int, n_samples: int, repeat: int):
+        function = self.get_stage_function(stage)
+        metrics.pop_records()
+        TimedStage(self.scale_settings).main(function=function)
+        record = [r for r in metrics.pop_records() if r['stage'] == TimedStage.__name__][-1]
+
+        self.rows.append({
+            'Genes': n_genes,
+            'Samples': n_samples,
+            'Stage': stage,
+            'Repeat': repeat,
+            'Wall Time (s)': record['wall_seconds'],
+            'CPU Time (s)': record['cpu_seconds'],
+            'Python Peak Memory (MB)': record['python_peak_mb'],
+            'Max RSS (MB)': record['max_rss_mb'],
+            'Throughput (Values/s)': n_genes * n_samples / max(record['wall_seconds'], 1e-9),
+        })
+        self.logger.info(f'{stage} ({n_genes} x {n_samples}, repeat {repeat}): {record["wall_seconds"]:.3f} s')
+
+    def get_stage_function(self, stage: str) -> Callable[[], Any]:
+        """
+        Inputs that would be modified by the stage are copied here, outside the timed function
+        """
+        s = self.scale_settings
+        if stage == 'TPM':
+            return lambda: TPM(s).main(
+                count_df=self.count_df,
+                gene_info_df=self.gene_info_df,
+                gene_length_column=GENE_LENGTH_COLUMN)
+        if stage == 'FilterByCumulativeReads':
+            df = self.tpm_df.copy()
+            return lambda: FilterByCumulativeReads(s).main(
+                df=df,
+                heatmap_read_fraction=HEATMAP_READ_FRACTION)
+        if stage == 'CountNormalization':
+            return lambda: CountNormalization(s).main(
+                df=self.filtered_df,
+                log_pseudocount=True,
+                by_sample_reads=False)
+        if stage == 'ComputePCA':
+            return lambda: ComputePCA(s).main(
+                feature_by_sample_df=self.tpm_df)
+        if stage == 'Clustermap':
+            return lambda: Clustermap(s).main(
+                data=self.normalized_df,
+                fname='heatmap-benchmark')
+        if stage == 'volcano_plot':
+            return lambda: volcano_plot(
+                df=self.statistics_df,
+                fold_change_column='log2FoldChange',
+                p_value_column='padj',
+                p_value_threshold=0.05,
+                gene_name_column=GENE_NAME_COLUMN,
+                png=f'{s.outdir}/volcano-plot-benchmark.png',
+                genes_to_label=None,
+                up_color=(1., 0., 0., 1.),
+                down_color=(0., 0., 1., 1.))
+        if stage == 'BuildExpressionTxt':
+            return lambda: BuildExpressionTxt(s).main(
+                count_df=self.count_df,
+                gene_info_df=self.gene_info_df,
+                gene_name_column=GENE_NAME_COLUMN)
+        if stage == 'FilterGeneSets':
+            return lambda: FilterGeneSets(s).main(
+                gene_sets_gmt=self.gene_sets_gmt,
+                gene_name_keywords=['GENE1'],
+                gene_set_name_keywords=['GENE_SET_1'])
+
+    def write_csv(self):
+        self.result_df.to_csv(f'{self.outdir}/benchmark.csv', index=False)
+
+        summary_df = self.result_df.groupby(['Stage', 'Genes', 'Samples'], sort=False).median(numeric_only=True)
+        summary_df = summary_df.drop(columns='Repeat')
+        self.logger.info(f'Median of {self.repeats} repeats:\n{summary_df.to_string()}')
+
+    def plot_scaling_curves(self):
+        df = self.result_df.groupby(['Stage', 'Genes', 'Samples'], sort=False).median(numeric_only=True).reset_index()
+        df['Values'] = df['Genes'] * df['Samples']
+
+        fig, axes = plt.subplots(nrows=1, ncols=2, figsize=(12, 5))
+        for stage, stage_df in df.groupby('Stage', sort=False):
+            stage_df = stage_df.sort_values('Values')
+            axes[0].plot(stage_df['Values'], stage_df['Wall Time (s)'], marker='o', label=stage)
+            axes[1].plot(stage_df['Values'], stage_df['Python Peak Memory (MB)'], marker='o', label=stage)
+        for ax, ylabel in zip(axes, ['Wall Time (s)', 'Python Peak Memory (MB)']):
+            ax.set_xscale('log')
+            ax.set_yscale('log')
+            ax.set_xlabel('Genes x Samples')
+            ax.set_ylabel(ylabel)
+        axes[1].legend(loc='upper left', bbox_to_anchor=(1., 1.), frameon=False)
+        fig.tight_layout()
+        for ext in ['pdf', 'png']:
+            fig.savefig(f'{self.outdir}/benchmark.{ext}', dpi=150)
+        plt.close(fig)
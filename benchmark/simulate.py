@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from typing import Tuple
+
+
+GROUP_COLUMN = 'Group'
+BATCH_COLUMN = 'Batch'
+GENE_LENGTH_COLUMN = 'Gene Length'
+GENE_NAME_COLUMN = 'Gene Name'
+GENE_DESCRIPTION_COLUMN = 'Gene Description'
+
+
+def simulate_dataset(
+        n_genes: int,
+        n_samples: int,
+        n_groups: int,
+        n_batches: int,
+        dispersion: float = 0.2,
+        de_fraction: float = 0.1,
+        seed: int = 1) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Negative binomial counts with group (differential expression), batch and library size effects
+
+    Returns:
+        count_df: gene rows x sample columns, int32
+        sample_info_df: sample rows, with group and batch columns
+        gene_info_df: gene rows, with length, name and description columns
+    """
+    rng = np.random.default_rng(seed)
+
+    gene_ids = [f'ENSG{i:011d}' for i in range(n_genes)]
+    sample_ids = [f'sample_{i + 1}' for i in range(n_samples)]
+    groups = np.arange(n_samples) % n_groups
+    batches = (np.arange(n_samples) // max(1, n_samples // n_batches)).clip(max=n_batches - 1)
+
+    base_mean = rng.lognormal(mean=4., sigma=2., size=n_genes)
+
+    # log2 fold changes of a fraction of genes in each group relative to the first group
+    log2_fold_changes = np.zeros((n_genes, n_groups))
+    for g in range(1, n_groups):
+        de = rng.random(n_genes) < de_fraction
+        log2_fold_changes[de, g] = rng.normal(loc=0., scale=1.5, size=de.sum())
+
+    batch_factors = rng.lognormal(mean=0., sigma=0.2, size=(n_genes, n_batches))
+    library_sizes = rng.lognormal(mean=0., sigma=0.2, size=n_samples)
+
+    r = 1. / dispersion
+    counts = np.empty((n_genes, n_samples), dtype=np.int32)
+    for j in range(n_samples):  # column by column to keep the float64 intermediates small
+        mu = base_mean * 2 ** log2_fold_changes[:, groups[j]] * batch_factors[:, batches[j]] * library_sizes[j]
+        counts[:, j] = rng.negative_binomial(n=r, p=r / (r + mu)).clip(max=np.iinfo(np.int32).max)
+
+    count_df = pd.DataFrame(data=counts, index=gene_ids, columns=sample_ids)
+
+    sample_info_df = pd.DataFrame(
+        data={
+            GROUP_COLUMN: [f'group_{g + 1}' for g in groups],
+            BATCH_COLUMN: [f'batch_{b + 1}' for b in batches],
+        },
+        index=sample_ids)
+
+    gene_info_df = pd.DataFrame(
+        data={
+            GENE_LENGTH_COLUMN: rng.lognormal(mean=7.5, sigma=0.7, size=n_genes).round().clip(min=100),
+            GENE_NAME_COLUMN: [f'GENE{i}' for i in range(n_genes)],
+            GENE_DESCRIPTION_COLUMN: [f'simulated gene {i}' for i in range(n_genes)],
+        },
+        index=gene_ids)
+
+    return count_df, sample_info_df, gene_info_df
+
+
+def simulate_statistics(
+        count_df: pd.DataFrame,
+        gene_info_df: pd.DataFrame,
+        seed: int = 1) -> pd.DataFrame:
+    """
+    DESeq2-like statistics table, i.e. the input of volcano plots
+    """
+    rng = np.random.default_rng(seed)
+    n = len(count_df)
+    log2_fold_change = rng.normal(loc=0., scale=1., size=n)
+    pvalue = rng.random(n) ** (1 + 4 * np.abs(log2_fold_change))  # larger fold changes are more significant
+    padj = np.minimum(1., pvalue * n / (np.argsort(np.argsort(pvalue)) + 1))
+    return pd.DataFrame(
+        data={
+            'baseMean': count_df.to_numpy().mean(axis=1),
+            'log2FoldChange': log2_fold_change,
+            'lfcSE': rng.random(n),
+            'stat': log2_fold_change / 0.5,
+            'pvalue': pvalue,
+            'padj': padj,
+            GENE_NAME_COLUMN: gene_info_df[GENE_NAME_COLUMN].to_numpy(),
+        },
+        index=count_df.index)
+
+
+def write_gene_sets_gmt(
+        gmt: str,
+        gene_info_df: pd.DataFrame,
+        n_gene_sets: int,
+        gene_set_size: int = 50,
+        seed: int = 1):
+    rng = np.random.default_rng(seed)
+    names = gene_info_df[GENE_NAME_COLUMN].to_numpy()
+    with open(gmt, 'w') as fh:
+        for i in range(n_gene_sets):
+            genes = rng.choice(names, size=min(gene_set_size, len(names)), replace=False)
+            fh.write('\t'.join([f'GENE_SET_{i}', 'na'] + list(genes)) + '\n')
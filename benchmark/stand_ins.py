@@ -0,0 +1,71 @@
+import os
+import sys
+import stat
+import types
+from typing import Any
+
+
+# commands called by the pipeline that are replaced by no-op shell scripts
+SHIMS = ['Rscript', 'gsea-cli.sh']
+
+RPY2_MODULES = [
+    'rpy2',
+    'rpy2.robjects',
+    'rpy2.robjects.packages',
+    'rpy2.robjects.pandas2ri',
+    'rpy2.rinterface',
+    'rpy2.rinterface_lib',
+    'rpy2.rinterface_lib.sexp',
+    'rpy2.rinterface_lib.callbacks',
+]
+
+
+class Placeholder:
+    """
+    Stands in for any R object, function or library, e.g. importr('clusterProfiler')
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name: str) -> 'Placeholder':
+        return Placeholder()
+
+    def __call__(self, *args, **kwargs) -> 'Placeholder':
+        return Placeholder()
+
+    def __getitem__(self, key: Any) -> 'Placeholder':
+        return Placeholder()
+
+
+class PlaceholderModule(types.ModuleType):
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name[0].isupper():  # classes, e.g. NULLType
+            return Placeholder
+        return Placeholder()
+
+
+def install_stand_ins(bindir: str):
+    """
+    Make the pipeline importable and runnable on a bare Linux box without R or GSEA:
+    no-op executables are put in front of PATH, and rpy2 is replaced if it is not installed
+    """
+    os.makedirs(bindir, exist_ok=True)
+    for name in SHIMS:
+        path = f'{bindir}/{name}'
+        with open(path, 'w') as fh:
+            fh.write('#!/bin/sh\nexit 0\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ['PATH'] = bindir + os.pathsep + os.environ.get('PATH', '')
+
+    try:
+        import rpy2.robjects
+    except Exception:  # not installed, or R itself cannot be loaded
+        for name in RPY2_MODULES:
+            sys.modules[name] = PlaceholderModule(name)
+            parent, _, child = name.rpartition('.')
+            if parent:
+                setattr(sys.modules[parent], child, sys.modules[name])
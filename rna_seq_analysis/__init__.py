@@ -1,6 +1,8 @@
 import os
+from typing import List, Optional
 from .template import Settings
 from .tools import get_temp_path
+from .metrics import write_run_metrics, RUN_METRICS_JSON
 from .rna_seq_analysis import RNASeqAnalysis
 
 
@@ -13,11 +15,22 @@ def main(
         gene_name_column: str,
         gene_description_column: str,
         heatmap_read_fraction: float,
+        heatmap_linkage_method: str,
+        heatmap_max_rows: int,
+        heatmap_formats: str,
+        heatmap_rasterize: bool,
+        top_variable_genes: int,
         sample_group_column: str,
         control_group_name: str,
         experimental_group_name: str,
         sample_batch_column: str,
         skip_differential_analysis: bool,
+        parallel_comparisons: bool,
+        tpm_chunk_rows: int,
+        pca_n_components: int,
+        pca_svd_solver: str,
+        pca_block_rows: int,
+        sample_distance_metrics: str,
         volcano_plot_label_genes: str,
         gsea_input: str,
         gsea_gene_name_keywords: str,
@@ -27,12 +40,22 @@ def main(
         gene_q_threshold: float,
         pathway_p_threshold: float,
         pathway_q_threshold: float,
+        sweep_gene_p_thresholds: str,
+        sweep_gene_q_thresholds: str,
+        sweep_pathway_p_thresholds: str,
+        sweep_pathway_q_thresholds: str,
         organism: str,
         enrichment_pathway_keywords: str,
         show_n_pathways: int,
         colormap: str,
         invert_colors: bool,
         publication_figure: bool,
+        r_engine: str,
+        deseq2_engine: str,
+        cache_dir: str,
+        cache_max_gb: float,
+        profile: bool,
+        float32: bool,
         threads: int,
         debug: bool,
         outdir: str):
@@ -43,37 +66,67 @@ def main(
         threads=int(threads),
         debug=debug,
         mock=False,
-        for_publication=publication_figure)
+        for_publication=publication_figure,
+        r_engine=r_engine,
+        cache_dir=None if cache_dir.lower() == 'none' else cache_dir,
+        cache_max_gb=cache_max_gb,
+        profile=profile,
+        float32=float32,
+        deseq2_engine=deseq2_engine)
 
     for d in [settings.workdir, settings.outdir]:
         os.makedirs(d, exist_ok=True)
 
-    RNASeqAnalysis(settings).main(
-        count_table=count_table,
-        sample_info_table=sample_info_table,
-        gene_info_table=gene_info_table,
-        gene_sets_gmt=None if gene_sets_gmt.lower() == 'none' else gene_sets_gmt,
-        gene_length_column=gene_length_column,
-        gene_name_column=gene_name_column,
-        gene_description_column=None if gene_description_column.lower() == 'none' else gene_description_column,
-        heatmap_read_fraction=heatmap_read_fraction,
-        sample_group_column=sample_group_column,
-        control_group_name=None if control_group_name.lower() == 'none' else control_group_name,
-        experimental_group_name=None if experimental_group_name.lower() == 'none' else experimental_group_name,
-        sample_batch_column=None if sample_batch_column.lower() == 'none' else sample_batch_column,
-        skip_differential_analysis=skip_differential_analysis,
-        volcano_plot_label_genes=None if volcano_plot_label_genes.lower() == 'none' else volcano_plot_label_genes.split(','),
-        gsea_input=gsea_input,
-        gsea_gene_name_keywords=None if gsea_gene_name_keywords.lower() == 'none' else gsea_gene_name_keywords.split(','),
-        gsea_gene_set_name_keywords=None if gsea_gene_set_name_keywords.lower() == 'none' else gsea_gene_set_name_keywords.split(','),
-        gsea_top_n_plots=gsea_top_n_plots,
-        gene_p_threshold=gene_p_threshold,
-        gene_q_threshold=gene_q_threshold,
-        pathway_p_threshold=pathway_p_threshold,
-        pathway_q_threshold=pathway_q_threshold,
-        organism=organism,
-        enrichment_pathway_keywords=None if enrichment_pathway_keywords.lower() == 'none' else enrichment_pathway_keywords.split(','),
-        show_n_pathways=show_n_pathways,
-        colormap=colormap,
-        invert_colors=invert_colors
-    )
+    try:
+        RNASeqAnalysis(settings).main(
+            count_table=count_table,
+            sample_info_table=sample_info_table,
+            gene_info_table=gene_info_table,
+            gene_sets_gmt=None if gene_sets_gmt.lower() == 'none' else gene_sets_gmt,
+            gene_length_column=gene_length_column,
+            gene_name_column=gene_name_column,
+            gene_description_column=None if gene_description_column.lower() == 'none' else gene_description_column,
+            heatmap_read_fraction=heatmap_read_fraction,
+            heatmap_linkage_method=heatmap_linkage_method,
+            heatmap_max_rows=heatmap_max_rows,
+            heatmap_formats=heatmap_formats.split(','),
+            heatmap_rasterize=heatmap_rasterize,
+            top_variable_genes=top_variable_genes,
+            sample_group_column=sample_group_column,
+            control_group_name=None if control_group_name.lower() == 'none' else control_group_name,
+            experimental_group_name=None if experimental_group_name.lower() == 'none' else experimental_group_name,
+            sample_batch_column=None if sample_batch_column.lower() == 'none' else sample_batch_column,
+            skip_differential_analysis=skip_differential_analysis,
+            parallel_comparisons=parallel_comparisons,
+            tpm_chunk_rows=tpm_chunk_rows,
+            pca_n_components=pca_n_components,
+            pca_svd_solver=pca_svd_solver,
+            pca_block_rows=pca_block_rows,
+            sample_distance_metrics=None if sample_distance_metrics.lower() == 'none' else sample_distance_metrics.split(','),
+            volcano_plot_label_genes=None if volcano_plot_label_genes.lower() == 'none' else volcano_plot_label_genes.split(','),
+            gsea_input=gsea_input,
+            gsea_gene_name_keywords=None if gsea_gene_name_keywords.lower() == 'none' else gsea_gene_name_keywords.split(','),
+            gsea_gene_set_name_keywords=None if gsea_gene_set_name_keywords.lower() == 'none' else gsea_gene_set_name_keywords.split(','),
+            gsea_top_n_plots=gsea_top_n_plots,
+            gene_p_threshold=gene_p_threshold,
+            gene_q_threshold=gene_q_threshold,
+            pathway_p_threshold=pathway_p_threshold,
+            pathway_q_threshold=pathway_q_threshold,
+            sweep_gene_p_thresholds=parse_thresholds(sweep_gene_p_thresholds),
+            sweep_gene_q_thresholds=parse_thresholds(sweep_gene_q_thresholds),
+            sweep_pathway_p_thresholds=parse_thresholds(sweep_pathway_p_thresholds),
+            sweep_pathway_q_thresholds=parse_thresholds(sweep_pathway_q_thresholds),
+            organism=organism,
+            enrichment_pathway_keywords=None if enrichment_pathway_keywords.lower() == 'none' else enrichment_pathway_keywords.split(','),
+            show_n_pathways=show_n_pathways,
+            colormap=colormap,
+            invert_colors=invert_colors
+        )
+    finally:  # also for failed runs, to see where it failed and how much it used
+        write_run_metrics(f'{settings.outdir}/{RUN_METRICS_JSON}')
+
+
+def parse_thresholds(thresholds: str) -> Optional[List[float]]:
+    if thresholds.lower() == 'none':
+        return None
+    return [float(t) for t in thresholds.split(',')]
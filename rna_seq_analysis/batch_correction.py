@@ -1,7 +1,13 @@
 import pandas as pd
+import rpy2.robjects as ro
 from typing import List, Any
-from .template import Processor
-from.tools import get_temp_path
+from .tools import get_temp_path
+from .template import Processor, Settings, EMBEDDED_R
+from .r_threads import get_blas_threads_env, get_blas_threads_r_code
+from .r_bridge import attach_libraries, redirect_r_console, limit_blas_threads, df_to_r_integer_matrix, r_matrix_to_df
+
+
+BATCH_CORRECTED_CSV = 'batch-corrected-count.csv'
 
 
 class BatchCorrection(Processor):
@@ -24,15 +30,18 @@ class BatchCorrection(Processor):
         self.sample_batch_column = sample_batch_column
 
         self.set_batch_list()
+
+        if self.settings.r_engine == Settings.EMBEDDED:
+            return ComBatSeqEmbedded(self.settings).main(
+                count_df=self.count_df,
+                batch_list=self.batch_list)
+
         self.combat_seq()
 
         return pd.read_csv(self.corrected_csv, index_col=0)
 
     def set_batch_list(self):
-        self.batch_list = []
-        for sample_id in self.count_df.columns:
-            batch = self.sample_info_df.loc[sample_id, self.sample_batch_column]
-            self.batch_list.append(batch)
+        self.batch_list = self.sample_info_df.loc[self.count_df.columns, self.sample_batch_column].tolist()
 
     def combat_seq(self):
         csv = get_temp_path(
@@ -61,7 +70,7 @@ class ComBatSeq(Processor):
         self.count_csv = count_csv
         self.batch_list = batch_list
 
-        self.corrected_csv = f'{self.outdir}/batch-corrected-count.csv'
+        self.corrected_csv = f'{self.outdir}/{BATCH_CORRECTED_CSV}'
         self.write_r_script()
         self.run_r_script()
 
@@ -73,6 +82,8 @@ class ComBatSeq(Processor):
         text = f'''\
 library(sva)
 
+{get_blas_threads_r_code(threads=self.threads)}
+
 count_df <- read.csv(
     file='{self.count_csv}',
     header=TRUE,
@@ -97,10 +108,49 @@ write.csv(
 
     def run_r_script(self):
         log = f'{self.outdir}/combat-seq.log'
-        cmd = self.CMD_LINEBREAK.join([
+        cmd = self.CMD_LINEBREAK.join(get_blas_threads_env(threads=self.threads) + [
             'Rscript',
             self.r_script,
             f'1> {log}',
             f'2> {log}'
         ])
         self.call(cmd)
+
+
+class ComBatSeqEmbedded(Processor):
+
+    LOCKS = [EMBEDDED_R]
+
+    count_df: pd.DataFrame
+    batch_list: List[Any]
+
+    corrected_df: pd.DataFrame
+
+    def main(
+            self,
+            count_df: pd.DataFrame,
+            batch_list: List[Any]) -> pd.DataFrame:
+
+        self.count_df = count_df
+        self.batch_list = batch_list
+
+        self.combat_seq()
+        self.write_corrected_csv()
+
+        return self.corrected_df
+
+    def combat_seq(self):
+        log = f'{self.outdir}/combat-seq.log'
+        self.logger.info(f'Running ComBat-seq in the embedded R session, log: {log}')
+        with redirect_r_console(log=log), limit_blas_threads(threads=self.threads):
+            attach_libraries('sva')
+            adjusted = ro.r['ComBat_seq'](
+                df_to_r_integer_matrix(self.count_df),
+                batch=ro.StrVector([str(b) for b in self.batch_list]),
+                group=ro.NULL)
+        self.corrected_df = r_matrix_to_df(adjusted)
+        self.corrected_df.index = self.count_df.index  # R row names are strings, e.g. of numeric gene IDs
+
+    def write_corrected_csv(self):
+        # the same output file as the Rscript engine, but the matrix is not read back from it
+        self.corrected_df.to_csv(f'{self.outdir}/{BATCH_CORRECTED_CSV}', index=True)
@@ -0,0 +1,195 @@
+import os
+import json
+import pickle
+import shutil
+import threading
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Dict, List, Optional
+from .tools import get_temp_path
+from .template import Processor
+
+
+class StageCache(Processor):
+    """
+    On-disk cache of stage results under settings.cache_dir,
+    each entry is keyed by the hash of the input frames and the parameters that affect the result
+    """
+
+    VERSION = 1  # bump to invalidate all existing entries when stage outputs change
+    RESULT_PKL = 'result.pkl'
+    OUTPUTS_DIRNAME = 'outputs'
+
+    cache_dir: Optional[str]
+    max_bytes: float
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.cache_dir = settings.cache_dir
+        self.max_bytes = settings.cache_max_gb * 1e9
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache_dir is not None
+
+    def run(
+            self,
+            processor: Processor,
+            outputs: List[str],
+            key_files: Optional[List[str]] = None,
+            key_settings: Optional[List[str]] = None,
+            **kwargs) -> Any:
+        """
+        Run processor.main(**kwargs), or reuse the cached result of the same inputs
+
+        outputs: files or directories, relative to processor.outdir, that are written by the stage
+            and need to be restored on a cache hit
+        key_files: names of kwargs that are file paths, which are keyed by the file content rather than the path
+        key_settings: names of settings that change the result of the stage, e.g. ['float32']
+        """
+        if not self.enabled:
+            return processor.main(**kwargs)
+
+        stage = processor.__class__.__name__
+        params = {}
+        for name, value in kwargs.items():
+            if key_files is not None and name in key_files and value is not None:
+                value = FileContent(value)
+            params[name] = value
+        for name in key_settings or []:
+            params[f'settings.{name}'] = getattr(self.settings, name)
+        key = self.get_key(stage=stage, params=params)
+
+        entry = self.lookup(key=key)
+        if entry is not None:
+            self.logger.info(f'Reuse cached result of {stage} ({key[:12]})')
+            restore_outputs(src=f'{entry}/{self.OUTPUTS_DIRNAME}', dst=processor.outdir)
+            with open(f'{entry}/{self.RESULT_PKL}', 'rb') as fh:
+                return pickle.load(fh)
+
+        result = processor.main(**kwargs)
+
+        def write(d: str):
+            with open(f'{d}/{self.RESULT_PKL}', 'wb') as fh:
+                pickle.dump(result, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            save_outputs(src=processor.outdir, dst=f'{d}/{self.OUTPUTS_DIRNAME}', outputs=outputs)
+
+        self.store(key=key, write=write)
+        return result
+
+    def get_key(self, stage: str, params: Dict[str, Any]) -> str:
+        h = hashlib.sha256()
+        update_hash(h, [self.VERSION, stage, params])
+        return h.hexdigest()
+
+    def lookup(self, key: str) -> Optional[str]:
+        entry = f'{self.cache_dir}/{key}'
+        if not os.path.exists(entry):
+            return None
+        os.utime(entry)  # mark as recently used
+        return entry
+
+    def store(self, key: str, write: Callable[[str], None]):
+        """
+        write: a function that writes the files of the entry into the given directory
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = get_temp_path(prefix=f'{self.cache_dir}/tmp-{os.getpid()}-{threading.get_ident()}-')
+        os.makedirs(tmp)
+        entry = f'{self.cache_dir}/{key}'
+        try:
+            write(tmp)
+            os.rename(tmp, entry)  # atomic, concurrent runs never see a partial entry
+        except OSError as e:
+            if not os.path.isdir(entry):  # not just the same entry stored by another process, e.g. disk full
+                self.logger.warning(f'Failed to store cache entry "{entry}": {e}')
+                return
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep: str):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = f'{self.cache_dir}/{name}'
+            if name.startswith('tmp-') or name == keep or not os.path.isdir(path):
+                continue
+            entries.append((os.path.getmtime(path), get_size(path), path))
+
+        total = get_size(f'{self.cache_dir}/{keep}') + sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):  # least recently used first
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.logger.debug(f'Evict cache entry "{path}"')
+
+
+class FileContent:
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+
+def update_hash(h: Any, obj: Any):
+    if isinstance(obj, pd.DataFrame):
+        h.update(b'DataFrame')
+        update_hash(h, [list(obj.columns), [str(t) for t in obj.dtypes]])
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        h.update(b'Series')
+        update_hash(h, [obj.name, str(obj.dtype)])
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(b'ndarray')
+        update_hash(h, [obj.shape, str(obj.dtype)])
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, FileContent):
+        h.update(b'FileContent')
+        with open(obj.path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(2**20), b''):
+                h.update(chunk)
+    elif isinstance(obj, dict):
+        h.update(b'dict')
+        for k in sorted(obj.keys(), key=str):
+            update_hash(h, k)
+            update_hash(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for item in obj:
+            update_hash(h, item)
+    else:
+        h.update(json.dumps(obj, default=repr).encode())
+
+
+def hash_frame(df: pd.DataFrame) -> str:
+    h = hashlib.sha256()
+    update_hash(h, df)
+    return h.hexdigest()
+
+
+def save_outputs(src: str, dst: str, outputs: List[str]):
+    os.makedirs(dst, exist_ok=True)
+    for output in outputs:
+        path = f'{src}/{output}'
+        if os.path.isdir(path):
+            shutil.copytree(path, f'{dst}/{output}')
+        elif os.path.isfile(path):
+            os.makedirs(os.path.dirname(f'{dst}/{output}'), exist_ok=True)
+            shutil.copy2(path, f'{dst}/{output}')
+
+
+def restore_outputs(src: str, dst: str):
+    os.makedirs(dst, exist_ok=True)
+    shutil.copytree(src, dst, dirs_exist_ok=True)
+
+
+def get_size(path: str) -> int:
+    size = 0
+    for dirpath, _, files in os.walk(path):
+        for f in files:
+            size += os.path.getsize(os.path.join(dirpath, f))
+    return size
@@ -5,7 +5,8 @@ from rpy2.robjects import pandas2ri
 from rpy2.robjects.packages import importr
 from rpy2.rinterface_lib.sexp import NULLType
 from typing import List, Dict, Optional
-from .template import Processor
+from .cache import StageCache
+from .template import Processor, EMBEDDED_R
 
 
 # import R packages
@@ -24,10 +25,24 @@ ORGANISM_TO_KEGG_CODE = {
     'mouse': 'mmu',
     'rat':   'rno',
 }
+GO_ONTOLOGY_TO_NAME = {
+    'BP': 'GO Biological Process',
+    'MF': 'GO Molecular Function',
+    'CC': 'GO Cellular Component',
+}
+KEGG_NAME = 'KEGG'
+
+
+def get_enrichment_names(group_name: str) -> List[str]:
+    """
+    Names of the enrichment results of the genes upregulated in the group, i.e. the CSV file names without ".csv"
+    """
+    return [f'{group_name} - {n}' for n in list(GO_ONTOLOGY_TO_NAME.values()) + [KEGG_NAME]]
 
 
 class ClusterProfiler(Processor):
 
+    LOCKS = [EMBEDDED_R]
     DSTDIR_NAME = 'clusterProfiler'
 
     statistics_df: pd.DataFrame
@@ -114,13 +129,9 @@ class ClusterProfiler(Processor):
 
     def go_enrichment(self, group_name: str):
         gene_vector = ro.StrVector(self.group_name_to_entrez_ids[group_name])
-        shot_to_long = {
-            'BP': 'GO Biological Process',
-            'MF': 'GO Molecular Function',
-            'CC': 'GO Cellular Component',
-        }
         for ontology in ['BP', 'MF', 'CC']:
-            result = r_cluster_profiler.enrichGO(
+            result = self.__enrich(
+                function_name = 'enrichGO',
                 gene          = gene_vector,
                 OrgDb         = ORGANISM_TO_DB[self.organism],
                 keyType       = 'ENTREZID',
@@ -129,7 +140,7 @@ class ClusterProfiler(Processor):
                 pvalueCutoff  = self.pathway_p_threshold,
                 qvalueCutoff  = self.pathway_q_threshold,
             )
-            enrichment_name = f'{group_name} - {shot_to_long[ontology]}'
+            enrichment_name = f'{group_name} - {GO_ONTOLOGY_TO_NAME[ontology]}'
             
             if result is None or isinstance(result, NULLType):
                 self.logger.info(f'GO enrichment returned NULL for "{enrichment_name}"')
@@ -139,7 +150,8 @@ class ClusterProfiler(Processor):
 
     def kegg_enrichment(self, group_name: str):
         gene_vector = ro.StrVector(self.group_name_to_entrez_ids[group_name])
-        result = r_cluster_profiler.enrichKEGG(
+        result = self.__enrich(
+            function_name = 'enrichKEGG',
             gene          = gene_vector,
             organism      = ORGANISM_TO_KEGG_CODE[self.organism],
             keyType       = 'ncbi-geneid',  # this is Entrez ID
@@ -152,9 +164,28 @@ class ClusterProfiler(Processor):
             self.logger.info(f'KEGG enrichment returned NULL for "{group_name}"')
             return
 
-        enrichment_name = f'{group_name} - KEGG'
+        enrichment_name = f'{group_name} - {KEGG_NAME}'
         self.enrichment_name_to_result[enrichment_name] = result
 
+    def __enrich(self, function_name: str, gene: ro.StrVector, **kwargs) -> ro.methods.RS4:
+        function = getattr(r_cluster_profiler, function_name)
+
+        cache = StageCache(self.settings)
+        if not cache.enabled:
+            return function(gene=gene, **kwargs)
+
+        key = cache.get_key(
+            stage=f'clusterProfiler::{function_name}',
+            params=dict(gene=list(gene), **kwargs))
+        entry = cache.lookup(key=key)
+        if entry is not None:
+            self.logger.info(f'Reuse cached result of {function_name} ({key[:12]})')
+            return ro.r['readRDS'](f'{entry}/result.rds')
+
+        result = function(gene=gene, **kwargs)
+        cache.store(key=key, write=lambda d: ro.r['saveRDS'](result, f'{d}/result.rds'))
+        return result
+
     def filter_pathways_by_keywords(self, enrichment_name: str):
         if self.enrichment_pathway_keywords is None:
             return
@@ -0,0 +1,125 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Optional, Tuple
+from scipy.cluster import hierarchy
+from sklearn.cluster import MiniBatchKMeans
+from concurrent.futures import ThreadPoolExecutor
+from .cache import hash_frame
+try:
+    import fastcluster
+except ImportError:  # fall back to scipy
+    fastcluster = None
+
+
+LINKAGE_METHODS = ['average', 'complete', 'single', 'weighted', 'ward', 'centroid', 'median']
+EUCLIDEAN_VECTOR_METHODS = ['ward', 'centroid', 'median']  # methods of fastcluster.linkage_vector for euclidean only
+RANDOM_STATE = 1  # to ensure reproducible result
+
+
+def compute_linkage(data: np.ndarray, method: str, metric: str) -> np.ndarray:
+    """
+    Linkage of the rows of data, with the memory-efficient fastcluster.linkage_vector if applicable,
+    which does not allocate the O(n^2) distance matrix
+    """
+    assert method in LINKAGE_METHODS, f'Unknown linkage method "{method}", choose from {LINKAGE_METHODS}'
+    if fastcluster is not None:
+        if method == 'single' or (method in EUCLIDEAN_VECTOR_METHODS and metric == 'euclidean'):
+            return fastcluster.linkage_vector(data, method=method, metric=metric)
+        return fastcluster.linkage(data, method=method, metric=metric)
+    return hierarchy.linkage(data, method=method, metric=metric)
+
+
+def compute_row_and_column_linkages(
+        df: pd.DataFrame,
+        method: str,
+        metric: str,
+        cluster_columns: bool,
+        threads: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Row and column linkages are independent, so they are computed concurrently if threads > 1
+    """
+    data = df.to_numpy(dtype=np.float64)
+    with ThreadPoolExecutor(max_workers=2 if threads > 1 else 1) as executor:
+        row_future = executor.submit(compute_linkage, data, method, metric)
+        col_future = executor.submit(compute_linkage, data.T, method, metric) if cluster_columns else None
+        row_linkage = row_future.result()
+        col_linkage = None if col_future is None else col_future.result()
+    return row_linkage, col_linkage
+
+
+def aggregate_rows(df: pd.DataFrame, max_rows: int) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Pre-aggregate rows into at most max_rows k-means centroids
+
+    Returns:
+        centroid_df: cluster rows x the same columns, with row labels like "Cluster 1 (25 genes)"
+        row_cluster_series: cluster label of each row of df
+    """
+    kmeans = MiniBatchKMeans(
+        n_clusters=max_rows,
+        random_state=RANDOM_STATE,
+        batch_size=max(1024, 4 * max_rows),
+        n_init=3)
+    labels = kmeans.fit_predict(df.to_numpy(dtype=np.float64))
+
+    sizes = np.bincount(labels, minlength=max_rows)
+    non_empty = np.flatnonzero(sizes)  # mini-batch k-means may leave clusters empty
+    names = pd.Series(
+        [f'Cluster {i + 1} ({sizes[c]} genes)' for i, c in enumerate(non_empty)],
+        index=non_empty)
+
+    centroid_df = pd.DataFrame(
+        data=kmeans.cluster_centers_[non_empty],
+        index=names.to_numpy(),
+        columns=df.columns)
+    row_cluster_series = pd.Series(names.loc[labels].to_numpy(), index=df.index, name='Cluster')
+
+    return centroid_df, row_cluster_series
+
+
+def get_linkage_key(
+        df: pd.DataFrame,
+        method: str,
+        metric: str,
+        cluster_columns: bool) -> str:
+    h = hashlib.sha256()
+    h.update(hash_frame(df).encode())
+    h.update(f'{method}|{metric}|{cluster_columns}'.encode())
+    return h.hexdigest()
+
+
+def save_linkages(
+        npz: str,
+        key: str,
+        row_linkage: np.ndarray,
+        col_linkage: Optional[np.ndarray]):
+    """
+    Linkage matrices, written atomically so that a broken file is never loaded
+    """
+    tmp = f'{npz}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        np.savez(
+            fh,
+            key=np.array(key),
+            row_linkage=row_linkage,
+            col_linkage=np.empty((0, 4)) if col_linkage is None else col_linkage)
+    os.replace(tmp, npz)
+
+
+def load_linkages(npz: str, key: str) -> Optional[Tuple[np.ndarray, Optional[np.ndarray]]]:
+    """
+    Returns None if there is no cached linkage of the same key
+    """
+    if not os.path.exists(npz):
+        return None
+    try:
+        with np.load(npz) as data:
+            if str(data['key']) != key:
+                return None
+            row_linkage = data['row_linkage']
+            col_linkage = data['col_linkage'] if len(data['col_linkage']) > 0 else None
+    except (OSError, ValueError, KeyError):  # not a valid cache file
+        return None
+    return row_linkage, col_linkage
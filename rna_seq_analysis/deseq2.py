@@ -2,9 +2,15 @@ import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from typing import Optional, List, Tuple
-from .template import Processor
+import rpy2.robjects as ro
+from typing import Optional, List, Tuple, Dict
 from .tools import get_temp_path
+from .cache import StageCache
+from .template import Processor, Settings, get_comparison_settings, hold_locks, PYPLOT, EMBEDDED_R
+from .native_deseq2 import NativeDESeq2
+from .r_threads import get_blas_threads_env, get_deseq2_parallel_r_code, get_embedded_bpparam_r_code
+from .r_bridge import attach_libraries, redirect_r_console, limit_blas_threads, df_to_r_integer_matrix, r_matrix_to_df, \
+    r_numeric_data_frame_to_df, to_r_factor
 
 
 class DESeq2(Processor):
@@ -24,12 +30,6 @@ class DESeq2(Processor):
     gene_q_threshold: float
     colors: List[Tuple[float, float, float, float]]
 
-    count_csv: str
-    sample_info_csv: str
-
-    r_script: str
-    statistics_csv: str
-    normalized_count_csv: str
     statistics_df: pd.DataFrame
     normalized_count_df: pd.DataFrame
 
@@ -60,26 +60,197 @@ class DESeq2(Processor):
         self.gene_p_threshold = gene_p_threshold
         self.gene_q_threshold = gene_q_threshold
         self.colors = colors
-        
-        self.check_group_name()
-        self.write_input_csvs()
-        self.set_output_csvs()
-        self.set_r_script()
-        self.run_r_script()
-        self.read_deseq2_output_csvs()
-        self.add_gene_name_and_description_to_statistics_df()
-        self.sort_statistics_df()
-        self.rewrite_output_csvs()
-        self.volcano_plot()
+
+        self.run_deseq2()
+        self.process_statistics()
+        self.write_normalized_count_csv()
 
         return self.normalized_count_df, self.statistics_df
 
-    def check_group_name(self):
+    def run_deseq2(self):
+        self.normalized_count_df, statistics_dfs = StageCache(self.settings).run(
+            processor=get_deseq2_processor(self.settings),
+            outputs=[f'{RunDESeq2.DSTDIR_NAME}/deseq2.R', f'{RunDESeq2.DSTDIR_NAME}/deseq2.log'],
+            key_settings=['deseq2_engine'],
+            count_df=self.count_df,
+            sample_info_df=self.sample_info_df,
+            sample_group_column=self.sample_group_column,
+            contrasts=[(self.control_group_name, self.experimental_group_name)])
+        self.statistics_df = statistics_dfs[0]
+
+    def process_statistics(self):
+        self.statistics_df = ProcessDESeq2Statistics(self.settings).main(
+            statistics_df=self.statistics_df,
+            sample_info_df=self.sample_info_df,
+            sample_group_column=self.sample_group_column,
+            control_group_name=self.control_group_name,
+            experimental_group_name=self.experimental_group_name,
+            gene_info_df=self.gene_info_df,
+            gene_name_column=self.gene_name_column,
+            gene_description_column=self.gene_description_column,
+            volcano_plot_label_genes=self.volcano_plot_label_genes,
+            gene_p_threshold=self.gene_p_threshold,
+            gene_q_threshold=self.gene_q_threshold,
+            colors=self.colors)
+
+    def write_normalized_count_csv(self):
+        os.makedirs(f'{self.outdir}/{self.DSTDIR_NAME}', exist_ok=True)  # not made by NativeDESeq2
+        self.normalized_count_df.to_csv(f'{self.outdir}/{self.DSTDIR_NAME}/deseq2-normalized-count.csv', index=True)
+
+
+class DESeq2MultiContrast(Processor):
+
+    DSTDIR_NAME = 'deseq2'
+
+    count_df: pd.DataFrame
+    sample_info_df: pd.DataFrame
+    sample_group_column: str
+    comparisons: List[Tuple[str, str]]
+    gene_info_df: pd.DataFrame
+    gene_name_column: str
+    gene_description_column: Optional[str]
+    volcano_plot_label_genes: Optional[List[str]]
+    gene_p_threshold: float
+    gene_q_threshold: float
+    colors: List[Tuple[float, float, float, float]]
+
+    normalized_count_df: pd.DataFrame
+    statistics_dfs: List[pd.DataFrame]
+
+    def main(
+            self,
+            count_df: pd.DataFrame,
+            sample_info_df: pd.DataFrame,
+            sample_group_column: str,
+            comparisons: List[Tuple[str, str]],
+            gene_info_df: pd.DataFrame,
+            gene_name_column: str,
+            gene_description_column: Optional[str],
+            volcano_plot_label_genes: Optional[List[str]],
+            gene_p_threshold: float,
+            gene_q_threshold: float,
+            colors: List[Tuple[float, float, float, float]]) -> Tuple[pd.DataFrame, Dict[Tuple[str, str], pd.DataFrame]]:
+        """
+        Fit the DESeq2 model once, then extract the statistics of each (control, experimental) comparison
+        into "{outdir}/{control}__vs__{experimental}/deseq2/". The normalized count, which is the same
+        for all comparisons, is written only once into "{outdir}/deseq2/".
+        """
+
+        self.count_df = count_df
+        self.sample_info_df = sample_info_df
+        self.sample_group_column = sample_group_column
+        self.comparisons = comparisons
+        self.gene_info_df = gene_info_df
+        self.gene_name_column = gene_name_column
+        self.gene_description_column = gene_description_column
+        self.volcano_plot_label_genes = volcano_plot_label_genes
+        self.gene_p_threshold = gene_p_threshold
+        self.gene_q_threshold = gene_q_threshold
+        self.colors = colors
+
+        self.run_deseq2()
+        self.process_statistics()
+        self.write_normalized_count_csv()
+
+        return self.normalized_count_df, dict(zip(self.comparisons, self.statistics_dfs))
+
+    def run_deseq2(self):
+        self.normalized_count_df, self.statistics_dfs = StageCache(self.settings).run(
+            processor=get_deseq2_processor(self.settings),
+            outputs=[f'{RunDESeq2.DSTDIR_NAME}/deseq2.R', f'{RunDESeq2.DSTDIR_NAME}/deseq2.log'],
+            key_settings=['deseq2_engine'],
+            count_df=self.count_df,
+            sample_info_df=self.sample_info_df,
+            sample_group_column=self.sample_group_column,
+            contrasts=self.comparisons)
+
+    def process_statistics(self):
+        for i, (control, experimental) in enumerate(self.comparisons):
+            self.statistics_dfs[i] = ProcessDESeq2Statistics(get_comparison_settings(
+                settings=self.settings,
+                control_group_name=control,
+                experimental_group_name=experimental
+            )).main(
+                statistics_df=self.statistics_dfs[i],
+                sample_info_df=self.sample_info_df,
+                sample_group_column=self.sample_group_column,
+                control_group_name=control,
+                experimental_group_name=experimental,
+                gene_info_df=self.gene_info_df,
+                gene_name_column=self.gene_name_column,
+                gene_description_column=self.gene_description_column,
+                volcano_plot_label_genes=self.volcano_plot_label_genes,
+                gene_p_threshold=self.gene_p_threshold,
+                gene_q_threshold=self.gene_q_threshold,
+                colors=self.colors)
+
+    def write_normalized_count_csv(self):
+        os.makedirs(f'{self.outdir}/{self.DSTDIR_NAME}', exist_ok=True)  # not made by NativeDESeq2
+        self.normalized_count_df.to_csv(f'{self.outdir}/{self.DSTDIR_NAME}/deseq2-normalized-count.csv', index=True)
+
+
+def get_deseq2_processor(settings: Settings) -> Processor:
+    """
+    RunDESeq2 or NativeDESeq2 by settings.deseq2_engine, both main() take and return the same arguments
+    """
+    if settings.deseq2_engine == Settings.NATIVE_DESEQ2:
+        return NativeDESeq2(settings)
+    return RunDESeq2(settings)
+
+
+class RunDESeq2(Processor):
+    """
+    EMBEDDED_R is held only by the embedded engine, Rscript subprocesses run concurrently
+    """
+
+    DSTDIR_NAME = 'deseq2'
+
+    count_df: pd.DataFrame
+    sample_info_df: pd.DataFrame
+    sample_group_column: str
+    contrasts: List[Tuple[str, str]]  # (control, experimental)
+
+    count_csv: str
+    sample_info_csv: str
+
+    r_script: str
+    statistics_csvs: List[str]
+    normalized_count_csv: str
+    statistics_dfs: List[pd.DataFrame]
+    normalized_count_df: pd.DataFrame
+
+    def main(
+            self,
+            count_df: pd.DataFrame,
+            sample_info_df: pd.DataFrame,
+            sample_group_column: str,
+            contrasts: List[Tuple[str, str]]) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
+
+        self.count_df = count_df
+        self.sample_info_df = sample_info_df
+        self.sample_group_column = sample_group_column
+        self.contrasts = contrasts
+
+        self.check_group_names()
+        if self.settings.r_engine == Settings.EMBEDDED:
+            with hold_locks([EMBEDDED_R]):
+                self.run_embedded_r()
+        else:
+            self.write_input_csvs()
+            self.set_output_csvs()
+            self.set_r_script()
+            self.run_r_script()
+            self.read_deseq2_output_csvs()
+
+        return self.normalized_count_df, self.statistics_dfs
+
+    def check_group_names(self):
         valid_group_names = set(self.sample_info_df[self.sample_group_column])
-        for name in [self.control_group_name, self.experimental_group_name]:
-            if name not in valid_group_names:
-                msg = f'"{name}" does not exists in the "{self.sample_group_column}" column of the sample info table'
-                raise AssertionError(msg)
+        for contrast in self.contrasts:
+            for name in contrast:
+                if name not in valid_group_names:
+                    msg = f'"{name}" does not exists in the "{self.sample_group_column}" column of the sample info table'
+                    raise AssertionError(msg)
 
     def write_input_csvs(self):
         self.count_csv = get_temp_path(
@@ -94,13 +265,23 @@ class DESeq2(Processor):
 
     def set_output_csvs(self):
         os.makedirs(f'{self.outdir}/{self.DSTDIR_NAME}', exist_ok=True)
-        self.statistics_csv = f'{self.outdir}/{self.DSTDIR_NAME}/deseq2-statistics.csv'
-        self.normalized_count_csv = f'{self.outdir}/{self.DSTDIR_NAME}/deseq2-normalized-count.csv'
+        d = get_temp_path(prefix=f'{self.workdir}/deseq2-output-')
+        os.makedirs(d)
+        self.statistics_csvs = [f'{d}/statistics-{i + 1}.csv' for i in range(len(self.contrasts))]
+        self.normalized_count_csv = f'{d}/normalized-count.csv'
 
     def set_r_script(self):
+        contrasts = ',\n    '.join(
+            f'c("{self.sample_group_column}", "{experimental}", "{control}")'
+            for control, experimental in self.contrasts
+        )
+        statistics_csvs = ',\n    '.join(f"'{csv}'" for csv in self.statistics_csvs)
+
         self.r_script = f'''\
 library(DESeq2)
 
+{get_deseq2_parallel_r_code(threads=self.threads)}
+
 count_df <- read.table(
     file='{self.count_csv}',
     header=TRUE,
@@ -124,26 +305,39 @@ dataset <- DESeqDataSetFromMatrix(
     design=~{self.sample_group_column}
 )
 
-# run deseq2
-dataset <- DESeq(dataset)
+# run deseq2, the model is fitted only once for all contrasts
+dataset <- DESeq(dataset, parallel=parallel, BPPARAM=bpparam)
 
-# get deseq2 results
-res <- results(
-    dataset,
-    contrast=c("{self.sample_group_column}", "{self.experimental_group_name}", "{self.control_group_name}")
+contrasts <- list(
+    {contrasts}
 )
 
-# differential gene expression statistics
-statistics_df <- data.frame(
-    res,
-    stringsAsFactors=FALSE,
-    check.names=FALSE
+statistics_csvs <- c(
+    {statistics_csvs}
 )
 
-write.csv(
-    statistics_df, 
-    file = '{self.statistics_csv}'
-)
+for (i in seq_along(contrasts)) {{
+
+    # get deseq2 results
+    res <- results(
+        dataset,
+        contrast=contrasts[[i]],
+        parallel=parallel,
+        BPPARAM=bpparam
+    )
+
+    # differential gene expression statistics
+    statistics_df <- data.frame(
+        res,
+        stringsAsFactors=FALSE,
+        check.names=FALSE
+    )
+
+    write.csv(
+        statistics_df,
+        file = statistics_csvs[i]
+    )
+}}
 
 # normalized count
 count_df <- counts(dataset, normalized=TRUE)
@@ -160,7 +354,7 @@ write.csv(
             fh.write(self.r_script)
 
         log = f'{self.outdir}/{self.DSTDIR_NAME}/deseq2.log'
-        cmd = self.CMD_LINEBREAK.join([
+        cmd = self.CMD_LINEBREAK.join(get_blas_threads_env(threads=1) + [
             'Rscript',
             r_file,
             f'1> {log}',
@@ -169,9 +363,104 @@ write.csv(
         self.call(cmd)
 
     def read_deseq2_output_csvs(self):
-        self.statistics_df = pd.read_csv(self.statistics_csv, index_col=0)
+        self.statistics_dfs = [pd.read_csv(csv, index_col=0) for csv in self.statistics_csvs]
         self.normalized_count_df = pd.read_csv(self.normalized_count_csv, index_col=0)
 
+    def run_embedded_r(self):
+        os.makedirs(f'{self.outdir}/{self.DSTDIR_NAME}', exist_ok=True)
+        log = f'{self.outdir}/{self.DSTDIR_NAME}/deseq2.log'
+        self.logger.info(f'Running DESeq2 in the embedded R session, log: {log}')
+
+        # one BLAS thread, as for each BiocParallel worker
+        with redirect_r_console(log=log), limit_blas_threads(threads=1):
+            attach_libraries('DESeq2', 'BiocParallel')
+            parallel = self.threads > 1
+            bpparam = ro.r(get_embedded_bpparam_r_code(threads=self.threads))
+
+            col_data = ro.r['data.frame'](**{
+                self.sample_group_column: to_r_factor(self.sample_info_df.loc[self.count_df.columns, self.sample_group_column]),
+                'row.names': ro.StrVector(self.count_df.columns.astype(str)),
+                'check.names': False,
+            })
+
+            dataset = ro.r['DESeqDataSetFromMatrix'](
+                countData=df_to_r_integer_matrix(self.count_df),
+                colData=col_data,
+                design=ro.Formula(f'~{self.sample_group_column}'))
+
+            dataset = ro.r['DESeq'](dataset, parallel=parallel, BPPARAM=bpparam)  # the model is fitted only once for all contrasts
+
+            self.statistics_dfs = []
+            for control, experimental in self.contrasts:
+                res = ro.r['results'](
+                    dataset,
+                    contrast=ro.StrVector([self.sample_group_column, str(experimental), str(control)]),
+                    parallel=parallel,
+                    BPPARAM=bpparam)
+                self.statistics_dfs.append(r_numeric_data_frame_to_df(ro.r['as.data.frame'](res)))
+
+            self.normalized_count_df = r_matrix_to_df(ro.r['counts'](dataset, normalized=True))
+
+        # R row names are strings, the genes are in the same order as count_df, e.g. of numeric gene IDs
+        for df in self.statistics_dfs + [self.normalized_count_df]:
+            df.index = self.count_df.index
+
+
+class ProcessDESeq2Statistics(Processor):
+
+    LOCKS = [PYPLOT]
+    DSTDIR_NAME = 'deseq2'
+
+    statistics_df: pd.DataFrame
+    sample_info_df: pd.DataFrame
+    sample_group_column: str
+    control_group_name: str
+    experimental_group_name: str
+    gene_info_df: pd.DataFrame
+    gene_name_column: str
+    gene_description_column: Optional[str]
+    volcano_plot_label_genes: Optional[List[str]]
+    gene_p_threshold: float
+    gene_q_threshold: float
+    colors: List[Tuple[float, float, float, float]]
+
+    statistics_csv: str
+
+    def main(
+            self,
+            statistics_df: pd.DataFrame,
+            sample_info_df: pd.DataFrame,
+            sample_group_column: str,
+            control_group_name: str,
+            experimental_group_name: str,
+            gene_info_df: pd.DataFrame,
+            gene_name_column: str,
+            gene_description_column: Optional[str],
+            volcano_plot_label_genes: Optional[List[str]],
+            gene_p_threshold: float,
+            gene_q_threshold: float,
+            colors: List[Tuple[float, float, float, float]]) -> pd.DataFrame:
+
+        self.statistics_df = statistics_df
+        self.sample_info_df = sample_info_df
+        self.sample_group_column = sample_group_column
+        self.control_group_name = control_group_name
+        self.experimental_group_name = experimental_group_name
+        self.gene_info_df = gene_info_df
+        self.gene_name_column = gene_name_column
+        self.gene_description_column = gene_description_column
+        self.volcano_plot_label_genes = volcano_plot_label_genes
+        self.gene_p_threshold = gene_p_threshold
+        self.gene_q_threshold = gene_q_threshold
+        self.colors = colors
+
+        self.add_gene_name_and_description_to_statistics_df()
+        self.sort_statistics_df()
+        self.write_statistics_csv()
+        self.volcano_plot()
+
+        return self.statistics_df
+
     def add_gene_name_and_description_to_statistics_df(self):
         cols = [self.gene_name_column]
         if self.gene_description_column is not None:
@@ -197,9 +486,10 @@ write.csv(
             ascending=[True, True]
         )
 
-    def rewrite_output_csvs(self):
+    def write_statistics_csv(self):
+        os.makedirs(f'{self.outdir}/{self.DSTDIR_NAME}', exist_ok=True)
+        self.statistics_csv = f'{self.outdir}/{self.DSTDIR_NAME}/deseq2-statistics.csv'
         self.statistics_df.to_csv(self.statistics_csv, index=True)
-        self.normalized_count_df.to_csv(self.normalized_count_csv, index=True)
 
     def volcano_plot(self):
         # the order of group names should be the same as the order of colors
@@ -207,33 +497,30 @@ write.csv(
         up_color_index = all_group_names.index(self.experimental_group_name)
         down_color_index = all_group_names.index(self.control_group_name)
 
-        for column, threshold in [
-            ('pvalue', self.gene_p_threshold),
-            ('padj', self.gene_q_threshold),
-        ]:
-            volcano_plot(
+        thresholds = {
+            'pvalue': self.gene_p_threshold,
+            'padj': self.gene_q_threshold,
+        }
+        data = prepare_volcano_data(
             df=self.statistics_df,
             fold_change_column='log2FoldChange',
-            p_value_column=column,
-            p_value_threshold=threshold,
+            p_value_columns=list(thresholds.keys()),
             gene_name_column=self.gene_name_column,
-            png=f'{self.outdir}/{self.DSTDIR_NAME}/{column}-volcano-plot.png',
-            genes_to_label=self.volcano_plot_label_genes,
-            up_color=self.colors[up_color_index],
-            down_color=self.colors[down_color_index],
-        )
+            genes_to_label=self.volcano_plot_label_genes)
+
+        for column, threshold in thresholds.items():
+            render_volcano_plot(
+                data=data,
+                p_value_column=column,
+                p_value_threshold=threshold,
+                png=f'{self.outdir}/{self.DSTDIR_NAME}/{column}-volcano-plot.png',
+                up_color=self.colors[up_color_index],
+                down_color=self.colors[down_color_index])
 
 
 def left_join(left: pd.DataFrame, right: pd.DataFrame) -> pd.DataFrame:
-    n = len(left)
-    merged = left.merge(
-        right=right,
-        right_index=True,
-        left_index=True,
-        how='left'
-    )
-    assert len(merged) == n
-    return merged
+    assert right.index.is_unique
+    return pd.concat([left, right.reindex(left.index)], axis=1)
 
 
 FOLD_CHANGE_THRESHOLD = 1.0
@@ -247,6 +534,8 @@ FIGSIZE = (10 / 2.54, 8 / 2.54)
 DPI = 600
 FONT_SIZE = 8
 GENE_LABEL_FONT_SIZE = 6
+DENSITY_MIN_POINTS = 5000
+DENSITY_BINS = (80, 64)  # x, y bins of about the size of a non-significant point at DPI
 
 
 def volcano_plot(
@@ -260,57 +549,148 @@ def volcano_plot(
         up_color: Tuple[float, float, float, float],
         down_color: Tuple[float, float, float, float]):
 
-    df = df.copy()
-    df = df.replace([np.inf, -np.inf], np.nan).dropna(subset=[fold_change_column, p_value_column])
-    df['neglog10p'] = -np.log10(df[p_value_column].clip(lower=np.finfo(float).tiny))
+    data = prepare_volcano_data(
+        df=df,
+        fold_change_column=fold_change_column,
+        p_value_columns=[p_value_column],
+        gene_name_column=gene_name_column,
+        genes_to_label=genes_to_label)
 
-    x = df[fold_change_column].values
-    y = df['neglog10p'].values
+    render_volcano_plot(
+        data=data,
+        p_value_column=p_value_column,
+        p_value_threshold=p_value_threshold,
+        png=png,
+        up_color=up_color,
+        down_color=down_color)
 
-    significant = (np.abs(x) >= FOLD_CHANGE_THRESHOLD) & (df[p_value_column].values <= p_value_threshold)
-    up = significant & (x > 0)
-    down = significant & (x < 0)
-
-    plt.rcParams.update({'font.size': FONT_SIZE})
 
-    fig, ax = plt.subplots(figsize=FIGSIZE, dpi=DPI)
+def prepare_volcano_data(
+        df: pd.DataFrame,
+        fold_change_column: str,
+        p_value_columns: List[str],
+        gene_name_column: str,
+        genes_to_label: Optional[List[str]]) -> Dict[str, np.ndarray]:
+    """
+    Arrays shared by the volcano plots of several p value columns, the statistics table is not copied
+
+    Returns:
+        'x': fold changes
+        '<p value column>': p values of each column
+        'label_index': positions of the genes to label, matched case-insensitively
+        'label_names': names of the genes to label
+    """
+    data = {'x': df[fold_change_column].to_numpy(dtype=np.float64)}
+    for column in p_value_columns:
+        data[column] = df[column].to_numpy(dtype=np.float64)
+
+    if genes_to_label is None:
+        label_index = np.empty(0, dtype=np.int64)
+    else:
+        gset = set([g.lower() for g in genes_to_label])
+        label_index = np.flatnonzero(df[gene_name_column].str.lower().isin(gset).to_numpy())
+    data['label_index'] = label_index
+    data['label_names'] = df[gene_name_column].to_numpy()[label_index].astype(str)
 
-    ax.scatter(x[~significant], y[~significant], color=NON_SIGNIFICANT_COLOR, s=NON_SIGNIFICANT_POINT_SIZE, alpha=ALPHA, edgecolor='none')
-    ax.scatter(x[down], y[down], color=down_color, s=SIGNIFICANT_POINT_SIZE, alpha=ALPHA, edgecolor='none')
-    ax.scatter(x[up],   y[up],   color=up_color,   s=SIGNIFICANT_POINT_SIZE, alpha=ALPHA, edgecolor='none')
+    return data
 
-    ax.set_xlabel('Log2 Fold Change')
-    ax.set_ylabel(f'-Log10({p_value_column})')
 
-    # make the x axis symmetric
-    right, left = ax.get_xlim()
-    abs_max = max(abs(right), abs(left))
-    ax.set_xlim(-abs_max, abs_max)
+def render_volcano_plot(
+        data: Dict[str, np.ndarray],
+        p_value_column: str,
+        p_value_threshold: float,
+        png: str,
+        up_color: Tuple[float, float, float, float],
+        down_color: Tuple[float, float, float, float]):
+    """
+    data: from prepare_volcano_data()
+
+    Non-significant genes beyond DENSITY_MIN_POINTS are drawn as one binned density image rather than as markers
+    """
+    x = data['x']
+    p = data[p_value_column]
+    valid = np.isfinite(x) & np.isfinite(p)
+    y = -np.log10(np.clip(p, np.finfo(float).tiny, None))
+
+    significant = valid & (np.abs(x) >= FOLD_CHANGE_THRESHOLD) & (p <= p_value_threshold)
+    non_significant = valid & ~significant
+    up = significant & (x > 0)
+    down = significant & (x < 0)
 
-    if genes_to_label is not None:
-        # small vertical offsets to reduce collisions
-        v_offsets = np.linspace(1, 10, num=max(3, len(genes_to_label))) * GENE_LABEL_VERTICAL_OFFSET_SCALE
-        i = 0
-        gset = set([g.lower() for g in genes_to_label])
-        subdf = df[df[gene_name_column].str.lower().isin(gset)]
-
-        for _, r in subdf.iterrows():
-            gx, gy, name = float(r[fold_change_column]), float(r['neglog10p']), str(r[gene_name_column])
-            dx = GENE_LABEL_HORIZONTAL_OFFSET if gx >= 0 else -GENE_LABEL_HORIZONTAL_OFFSET  # text horizontal offset (points)
-            ha = 'left' if gx >= 0 else 'right'
-            dy = v_offsets[i % len(v_offsets)] * (1 if (i % 2 == 0) else -1)  # alternate up/down
-            i += 1
-
-            ax.annotate(
-                name,
-                xy=(gx, gy),
-                xytext=(dx, dy),
-                textcoords='offset points',
-                ha=ha,
-                va='center',
-                fontsize=GENE_LABEL_FONT_SIZE,
-                arrowprops=dict(arrowstyle='-', lw=0.5, shrinkA=0, shrinkB=0)
-            )
-
-    plt.tight_layout()
-    plt.savefig(png, dpi=DPI)
+    with plt.rc_context({'font.size': FONT_SIZE}):
+        fig, ax = plt.subplots(figsize=FIGSIZE, dpi=DPI)
+        try:
+            if non_significant.sum() > DENSITY_MIN_POINTS:
+                density_image(ax=ax, x=x[non_significant], y=y[non_significant], color=NON_SIGNIFICANT_COLOR)
+            else:
+                ax.scatter(x[non_significant], y[non_significant], color=NON_SIGNIFICANT_COLOR, s=NON_SIGNIFICANT_POINT_SIZE, alpha=ALPHA, edgecolor='none', rasterized=True)
+            ax.scatter(x[down], y[down], color=down_color, s=SIGNIFICANT_POINT_SIZE, alpha=ALPHA, edgecolor='none')
+            ax.scatter(x[up],   y[up],   color=up_color,   s=SIGNIFICANT_POINT_SIZE, alpha=ALPHA, edgecolor='none')
+
+            ax.set_xlabel('Log2 Fold Change')
+            ax.set_ylabel(f'-Log10({p_value_column})')
+
+            # make the x axis symmetric
+            right, left = ax.get_xlim()
+            abs_max = max(abs(right), abs(left))
+            ax.set_xlim(-abs_max, abs_max)
+
+            label_index = data['label_index']
+            labeled = valid[label_index]
+            label_genes(
+                ax=ax,
+                x=x[label_index][labeled],
+                y=y[label_index][labeled],
+                names=data['label_names'][labeled],
+                n_genes_to_label=len(label_index))
+
+            fig.tight_layout()
+            fig.savefig(png, dpi=DPI)
+        finally:
+            plt.close(fig)
+
+
+def density_image(
+        ax: plt.Axes,
+        x: np.ndarray,
+        y: np.ndarray,
+        color: Tuple[float, float, float, float]):
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=DENSITY_BINS)
+    rgba = np.empty(counts.T.shape + (4,))
+    rgba[..., :3] = color[:3]
+    rgba[..., 3] = 1. - (1. - ALPHA) ** counts.T  # the opacity of overlapping semi-transparent markers
+    image = ax.imshow(
+        rgba,
+        extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]),
+        origin='lower',
+        aspect='auto',
+        interpolation='nearest',
+        rasterized=True)
+    image.sticky_edges.x.clear()  # autoscale with margins as for scatter points
+    image.sticky_edges.y.clear()
+
+
+def label_genes(
+        ax: plt.Axes,
+        x: np.ndarray,
+        y: np.ndarray,
+        names: np.ndarray,
+        n_genes_to_label: int):
+    # small vertical offsets to reduce collisions
+    v_offsets = np.linspace(1, 10, num=max(3, n_genes_to_label)) * GENE_LABEL_VERTICAL_OFFSET_SCALE
+    i = np.arange(len(names))
+    dxs = np.where(x >= 0, GENE_LABEL_HORIZONTAL_OFFSET, -GENE_LABEL_HORIZONTAL_OFFSET)  # text horizontal offset (points)
+    has = np.where(x >= 0, 'left', 'right')
+    dys = v_offsets[i % len(v_offsets)] * np.where(i % 2 == 0, 1, -1)  # alternate up/down
+
+    for gx, gy, name, dx, dy, ha in zip(x, y, names, dxs, dys, has):
+        ax.annotate(
+            name,
+            xy=(gx, gy),
+            xytext=(dx, dy),
+            textcoords='offset points',
+            ha=ha,
+            va='center',
+            fontsize=GENE_LABEL_FONT_SIZE,
+            arrowprops=dict(arrowstyle='-', lw=0.5, shrinkA=0, shrinkB=0)
+        )
@@ -0,0 +1,83 @@
+import weakref
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+
+
+SUM = 'Sum'
+MEAN = 'Mean'
+VARIANCE = 'Variance'
+DETECTION_RATE = 'Detection Rate'
+LOG_MEAN = 'Log Mean'
+LOG_VARIANCE = 'Log Variance'
+COLUMNS = [SUM, MEAN, VARIANCE, DETECTION_RATE, LOG_MEAN, LOG_VARIANCE]
+BLOCK_ROWS = 10000  # bounds the temporary float64 and log-transformed buffers
+
+cache: Dict[int, pd.DataFrame] = {}  # id of matrix -> its gene stats, dropped when the matrix is garbage-collected
+matrix_locks: Dict[int, threading.Lock] = {}
+lock = threading.Lock()
+
+
+def get_gene_stats(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-gene statistics of a gene x sample matrix, computed once for each matrix object,
+    so that stages reading the same matrix concurrently, e.g. the heatmap and PCA of TPM, share a single pass
+
+    Returns:
+        gene x COLUMNS, the log values are log(1 + x)
+    """
+    key = id(df)
+    with lock:
+        matrix_lock = matrix_locks.setdefault(key, threading.Lock())
+
+    with matrix_lock:  # the other stages wait for the one computing
+        if key not in cache:
+            cache[key] = compute_gene_stats(df)
+            weakref.finalize(df, drop, key)
+        return cache[key]
+
+
+def drop(key: int):
+    with lock:
+        cache.pop(key, None)
+        matrix_locks.pop(key, None)
+
+
+def compute_gene_stats(df: pd.DataFrame) -> pd.DataFrame:
+    values = df.to_numpy()
+    n = len(values)
+    stats = {c: np.empty(n, dtype=np.float64) for c in COLUMNS}
+
+    for i in range(0, n, BLOCK_ROWS):
+        block = values[i:i + BLOCK_ROWS].astype(np.float64, copy=False)
+        rows = slice(i, i + len(block))
+        stats[SUM][rows] = block.sum(axis=1)
+        stats[MEAN][rows] = block.mean(axis=1)
+        stats[VARIANCE][rows] = block.var(axis=1, ddof=1)
+        stats[DETECTION_RATE][rows] = (block > 0).mean(axis=1)
+        log_block = np.log1p(block)
+        stats[LOG_MEAN][rows] = log_block.mean(axis=1)
+        stats[LOG_VARIANCE][rows] = log_block.var(axis=1, ddof=1)
+
+    return pd.DataFrame(data=stats, index=df.index)
+
+
+def select_top_variable_genes(
+        df: pd.DataFrame,
+        n: int,
+        gene_stats_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    The n genes of the highest variance of log values, in the original order of df
+
+    gene_stats_df: stats of df or of a superset of df, default get_gene_stats(df)
+    """
+    if n <= 0 or n >= len(df):
+        return df
+    if gene_stats_df is None:
+        gene_stats_df = get_gene_stats(df)
+
+    variances = gene_stats_df[LOG_VARIANCE].reindex(df.index).to_numpy()
+    variances = np.nan_to_num(variances, nan=-np.inf)
+    top = np.argpartition(-variances, n - 1)[:n]
+    return df.iloc[np.sort(top)]
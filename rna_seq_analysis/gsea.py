@@ -108,6 +108,7 @@ class BuildExpressionTxt(Processor):
     gene_info_df: pd.DataFrame
     gene_name_column: str
 
+    gene_names: pd.Series
     output_txt: str
 
     def main(
@@ -116,11 +117,11 @@ class BuildExpressionTxt(Processor):
             gene_info_df: pd.DataFrame,
             gene_name_column: str) -> str:
 
-        self.count_df = count_df.copy()
-        self.gene_info_df = gene_info_df.copy()
+        self.count_df = count_df
+        self.gene_info_df = gene_info_df
         self.gene_name_column = gene_name_column
 
-        self.merge_gene_info()
+        self.set_gene_names()
         self.drop_genes_without_name()
         self.set_gene_name_as_index()
         self.add_empty_description_column()
@@ -128,23 +129,19 @@ class BuildExpressionTxt(Processor):
 
         return self.output_txt
 
-    def merge_gene_info(self):
-        self.count_df = self.count_df.merge(
-            right=self.gene_info_df[[self.gene_name_column]],
-            right_index=True,
-            left_index=True,
-            how='left'
-        )
+    def set_gene_names(self):
+        self.gene_names = self.gene_info_df[self.gene_name_column].reindex(self.count_df.index)
 
     def drop_genes_without_name(self):
         n = len(self.count_df)
-        self.count_df = self.count_df[self.count_df[self.gene_name_column].notna()]
+        has_name = self.gene_names.notna().to_numpy()
+        self.count_df = self.count_df[has_name]  # the only copy of the count matrix
+        self.gene_names = self.gene_names[has_name]
         msg = f'For GSEA, drop genes without name (i.e. symbol), {n} -> {len(self.count_df)}'
         self.logger.info(msg)
 
     def set_gene_name_as_index(self):
-        self.count_df = self.count_df.set_index(self.gene_name_column, drop=True)
-        self.count_df.index.name = 'Name'
+        self.count_df.index = pd.Index(self.gene_names.to_numpy(), name='Name')
 
     def add_empty_description_column(self):
         self.count_df['Description'] = 'na'
@@ -197,10 +194,7 @@ class BuildGroupsCls(Processor):
         self.n_unique_groups = len(self.sample_info_df[self.sample_group_column].unique())
 
     def set_sample_group_names(self):
-        self.sample_group_names = []
-        for sample in self.count_df.columns:
-            group = self.sample_info_df.loc[sample, self.sample_group_column]
-            self.sample_group_names.append(group)
+        self.sample_group_names = self.sample_info_df.loc[self.count_df.columns, self.sample_group_column].tolist()
 
     def set_cls_text(self):
         a = ' '.join(unique(self.sample_group_names))
@@ -375,7 +369,6 @@ class RunGSEA(Processor):
         ]
 
     def run_gsea(self):
-        cwd = os.getcwd()
-        os.chdir(self.workdir)  # to make the gsea temp directory appear in workdir
-        self.call(self.CMD_LINEBREAK.join(self.args))
-        os.chdir(cwd)  # change back to the original directory
+        # run in workdir to make the gsea temp directory appear in workdir,
+        # without os.chdir() which would change the directory of all threads
+        self.call(self.CMD_LINEBREAK.join(self.args), cwd=self.workdir)
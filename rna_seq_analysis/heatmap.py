@@ -1,10 +1,15 @@
 import os
+import io
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-from typing import Tuple, Optional
-from .template import Processor
+from PIL import Image
+from typing import List, Tuple, Optional
+from .template import Processor, PYPLOT, hold_locks
+from .gene_stats import get_gene_stats, select_top_variable_genes, SUM
+from .clustering import compute_row_and_column_linkages, aggregate_rows, get_linkage_key, save_linkages, \
+    load_linkages
 
 
 class Heatmap(Processor):
@@ -12,21 +17,41 @@ class Heatmap(Processor):
     LOG_PSEUDOCOUNT = True
     NORMALIZE_BY_SAMPLE_READS = False
 
+    feature_by_sample_df: pd.DataFrame
     df: pd.DataFrame
     heatmap_read_fraction: float
     fname: str
+    linkage_method: str
+    max_rows: int
+    formats: Optional[List[str]]
+    rasterize: bool
+    top_variable_genes: int
 
     def main(
             self,
             feature_by_sample_df: pd.DataFrame,
             heatmap_read_fraction: float,
-            fname: str):
-
-        self.df = feature_by_sample_df.copy()
+            fname: str,
+            linkage_method: str = 'average',
+            max_rows: int = 0,
+            formats: Optional[List[str]] = None,
+            rasterize: bool = False,
+            top_variable_genes: int = 0):
+        """
+        top_variable_genes: if > 0, cluster only this many highly variable genes among the abundant ones
+        """
+        self.feature_by_sample_df = feature_by_sample_df
+        self.df = feature_by_sample_df  # none of the steps modifies the input
         self.heatmap_read_fraction = heatmap_read_fraction
         self.fname = fname
+        self.linkage_method = linkage_method
+        self.max_rows = max_rows
+        self.formats = formats
+        self.rasterize = rasterize
+        self.top_variable_genes = top_variable_genes
 
         self.filter_by_cumulative_reads()
+        self.select_variable_genes()
         self.count_normalization()
         self.clustermap()
 
@@ -36,6 +61,15 @@ class Heatmap(Processor):
             df=self.df,
             heatmap_read_fraction=self.heatmap_read_fraction)
 
+    def select_variable_genes(self):
+        n = len(self.df)
+        self.df = select_top_variable_genes(
+            df=self.df,
+            n=self.top_variable_genes,
+            gene_stats_df=get_gene_stats(self.feature_by_sample_df))  # shared with other stages of the same matrix
+        if len(self.df) < n:
+            self.logger.info(f'For heatmap "{self.fname}", keep {len(self.df)} highly variable genes out of {n}')
+
     def count_normalization(self):
         self.df = CountNormalization(self.settings).main(
             df=self.df,
@@ -45,17 +79,22 @@ class Heatmap(Processor):
     def clustermap(self):
         Clustermap(self.settings).main(
             data=self.df,
-            fname=self.fname)
+            fname=self.fname,
+            linkage_method=self.linkage_method,
+            max_rows=self.max_rows,
+            formats=self.formats,
+            rasterize=self.rasterize)
 
 
 class FilterByCumulativeReads(Processor):
 
-    ROW_SUM = 'Row Sum'
-    CUMULATIVE_SUM = 'Cumulative Sum'
-
     df: pd.DataFrame
     heatmap_read_fraction: float
 
+    row_sums: np.ndarray
+    order: np.ndarray
+    n_rows: int
+
     def main(
             self,
             df: pd.DataFrame,
@@ -68,54 +107,38 @@ class FilterByCumulativeReads(Processor):
 
         self.sum_each_row()
         self.sort_by_sum()
-        self.cumulate_sum()
-        self.divide_by_total()
+        self.set_n_rows()
         self.filter()
-        self.clean_up()
 
         return self.df
 
     def sum_each_row(self):
-        self.df[self.ROW_SUM] = np.sum(self.df.to_numpy(), axis=1)
+        self.row_sums = get_gene_stats(self.df)[SUM].to_numpy()
 
     def sort_by_sum(self):
-        self.df = self.df.sort_values(
-            by=self.ROW_SUM,
-            ascending=False)
-
-    def cumulate_sum(self):
-        l = []
-        c = 0
-        for s in self.df[self.ROW_SUM]:
-            c += s
-            l.append(c)
-        self.df[self.CUMULATIVE_SUM] = l
-
-    def divide_by_total(self):
-        total = self.df[self.CUMULATIVE_SUM][-1]
-        self.df[self.CUMULATIVE_SUM] = self.df[self.CUMULATIVE_SUM] / total
+        # only the row positions are sorted, neither the input frame is sorted nor modified
+        self.order = np.argsort(-self.row_sums, kind='stable')
+
+    def set_n_rows(self):
+        cumulative_fractions = np.cumsum(self.row_sums[self.order])
+        cumulative_fractions /= cumulative_fractions[-1]
+        # keep the rows before the first one whose cumulative fraction exceeds heatmap_read_fraction
+        self.n_rows = int(np.searchsorted(cumulative_fractions, self.heatmap_read_fraction, side='right'))
 
     def filter(self):
         total_rows = len(self.df)
-        n_rows = total_rows
-        for i, v in enumerate(self.df[self.CUMULATIVE_SUM]):
-            if v > self.heatmap_read_fraction:
-                n_rows = i
-                break
-        self.df = self.df.iloc[:n_rows, ]
+        self.df = self.df.iloc[self.order[:self.n_rows]]
 
         msg = f'''\
 Total genes: {total_rows}
-For heatmap, keep the most abundant genes covering {self.heatmap_read_fraction * 100:.2f}% of counts: {n_rows} genes'''
+For heatmap, keep the most abundant genes covering {self.heatmap_read_fraction * 100:.2f}% of counts: {self.n_rows} genes'''
         self.logger.info(msg)
 
-    def clean_up(self):
-        self.df = self.df.drop(
-            columns=[self.ROW_SUM, self.CUMULATIVE_SUM]
-        )
-
 
 class CountNormalization(Processor):
+    """
+    Computed on one float buffer, the only full-size allocation, the input df is never modified
+    """
 
     PSEUDOCOUNT_FACTOR = 0.1  # the factor between min count and pseudocount
 
@@ -124,6 +147,8 @@ class CountNormalization(Processor):
     by_sample_reads: bool
     sample_reads_unit: int
 
+    values: np.ndarray
+
     def main(
             self,
             df: pd.DataFrame,
@@ -136,24 +161,46 @@ class CountNormalization(Processor):
         self.by_sample_reads = by_sample_reads
         self.sample_reads_unit = sample_reads_unit
 
+        if not (self.by_sample_reads or self.log_pseudocount):
+            return self.df
+
+        self.set_values()
         self.normalize_by_sample_reads()
         self.pseudocount_then_log10()
+        self.set_df()
 
         return self.df
 
+    def set_values(self):
+        dtype = np.result_type(np.float32, *self.df.dtypes)  # float32 stays float32, otherwise float64
+        self.values = self.df.to_numpy(dtype=dtype, copy=True)
+
     def normalize_by_sample_reads(self):
         if self.by_sample_reads:
-            sum_per_column = np.sum(self.df, axis=0) / self.sample_reads_unit
-            self.df = np.divide(self.df, sum_per_column)
+            sum_per_column = np.nansum(self.values, axis=0, dtype=np.float64) / self.sample_reads_unit
+            self.values /= sum_per_column.astype(self.values.dtype)
 
     def pseudocount_then_log10(self):
-        non_zero_min = np.nanmin(self.df.replace({0: np.nan}))
-        pseudocount = non_zero_min * self.PSEUDOCOUNT_FACTOR
         if self.log_pseudocount:
-            self.df = np.log10(self.df + pseudocount)
+            # fmin ignores nan, and the mask excludes zeros without copying the matrix
+            non_zero_min = np.fmin.reduce(self.values, axis=None, where=self.values != 0, initial=np.inf)
+            pseudocount = non_zero_min * self.PSEUDOCOUNT_FACTOR if np.isfinite(non_zero_min) else np.nan
+            self.values += self.values.dtype.type(pseudocount)
+            np.log10(self.values, out=self.values)
+
+    def set_df(self):
+        self.df = pd.DataFrame(
+            data=self.values,
+            index=self.df.index,
+            columns=self.df.columns,
+            copy=False)
 
 
 class Clustermap(Processor):
+    """
+    PYPLOT is held only while the figure is drawn and saved, not while rows are aggregated and clustered,
+    so that other heatmaps and plots are not blocked by clustering
+    """
 
     CLUSTER_COLUMNS = True
     COLORMAP = 'PuBu'
@@ -168,27 +215,68 @@ class Clustermap(Processor):
     COLORBAR_WIDTH = 0.01
     COLORBAR_HORIZONTAL_POSITION = 1.
     DPI = 600
+    MAX_PIXELS_PER_SIDE = 2**16 - 1  # limit of the Agg renderer
+    PIXEL_BUDGET = 10**8  # ~400 MB of RGBA canvas
+    FORMATS = ['pdf', 'png']
+    RASTER_FORMATS = ['png', 'jpg', 'jpeg', 'tif', 'tiff', 'webp']  # drawn once by Agg and encoded for each format
     DSTDIR_NAME = 'heatmap'
+    LINKAGE_METRIC = 'euclidean'
 
     data: pd.DataFrame
     fname: str
-
+    linkage_method: str
+    max_rows: int
+    formats: List[str]
+    rasterize: bool
+
+    row_cluster_series: Optional[pd.Series]
+    row_linkage: np.ndarray
+    col_linkage: Optional[np.ndarray]
     x_label_padding: float
     y_label_padding: float
     figsize: Tuple[float, float]
     grid: sns.matrix.ClusterGrid
 
-    def main(self, data: pd.DataFrame, fname: str):
+    def main(
+            self,
+            data: pd.DataFrame,
+            fname: str,
+            linkage_method: str = 'average',
+            max_rows: int = 0,
+            formats: Optional[List[str]] = None,
+            rasterize: bool = False):
+        """
+        max_rows: if > 0 and there are more rows, rows are pre-aggregated into this many k-means centroids
+
+        formats: file extensions of the figure, default FORMATS
+
+        rasterize: embed the heatmap cells as an image in vector formats, e.g. pdf,
+            rather than one vector rectangle per cell
+        """
         self.data = data
         self.fname = fname
+        self.linkage_method = linkage_method
+        self.max_rows = max_rows
+        self.formats = self.FORMATS if formats is None else formats
+        self.rasterize = rasterize
 
+        self.aggregate_rows()
         self.set_figsize()
-        self.clustermap()
-        self.config_clustermap()
         self.make_dstdir()
-        self.save_fig()
+        self.compute_linkages()
+        with hold_locks([PYPLOT]):
+            self.clustermap()
+            self.config_clustermap()
+            self.save_fig()
         self.save_csv()
 
+    def aggregate_rows(self):
+        self.row_cluster_series = None
+        if 0 < self.max_rows < len(self.data):
+            n = len(self.data)
+            self.data, self.row_cluster_series = aggregate_rows(df=self.data, max_rows=self.max_rows)
+            self.logger.info(f'For heatmap "{self.fname}", aggregate {n} genes into {len(self.data)} k-means clusters')
+
     def set_figsize(self):
         self.__set_x_y_label_padding()
         w = (len(self.data.columns) * self.CELL_WIDTH) + self.y_label_padding
@@ -202,6 +290,30 @@ class Clustermap(Processor):
         max_y_label_length = pd.Series(self.data.index).apply(len).max()
         self.y_label_padding = max_y_label_length * self.Y_LABEL_CHAR_WIDTH
 
+    def compute_linkages(self):
+        # computed here, rather than by seaborn, to use the memory-efficient linkage and both threads,
+        # and cached next to the heatmap for later renders of the same matrix
+        npz = f'{self.outdir}/{self.DSTDIR_NAME}/{self.fname}-linkage.npz'
+        key = get_linkage_key(
+            df=self.data,
+            method=self.linkage_method,
+            metric=self.LINKAGE_METRIC,
+            cluster_columns=self.CLUSTER_COLUMNS)
+
+        cached = load_linkages(npz=npz, key=key)
+        if cached is not None:
+            self.logger.info(f'Load cached linkage of heatmap "{self.fname}"')
+            self.row_linkage, self.col_linkage = cached
+            return
+
+        self.row_linkage, self.col_linkage = compute_row_and_column_linkages(
+            df=self.data,
+            method=self.linkage_method,
+            metric=self.LINKAGE_METRIC,
+            cluster_columns=self.CLUSTER_COLUMNS,
+            threads=self.threads)
+        save_linkages(npz=npz, key=key, row_linkage=self.row_linkage, col_linkage=self.col_linkage)
+
     def clustermap(self):
         self.grid = sns.clustermap(
             data=self.data,
@@ -209,9 +321,12 @@ class Clustermap(Processor):
             figsize=self.figsize,
             xticklabels=self.XTICKLABELS,
             yticklabels=self.YTICKLABELS,
+            row_linkage=self.row_linkage,
+            col_linkage=self.col_linkage,
             col_cluster=self.CLUSTER_COLUMNS,
             dendrogram_ratio=self.DENDROGRAM_RATIO,
-            linewidth=self.LINEWIDTH)
+            linewidth=self.LINEWIDTH,
+            rasterized=self.rasterize)
         self.__set_plotted_data()
 
     def __set_plotted_data(self):
@@ -261,17 +376,43 @@ class Clustermap(Processor):
         # must use grid.savefig(), but not plt.savefig()
         # plt.savefig() crops out the colorbar
 
-        dpi = self.__downsize_dpi_if_too_large()
-        for ext in ['pdf', 'png']:
-            self.grid.savefig(f'{self.outdir}/{self.DSTDIR_NAME}/{self.fname}.{ext}', dpi=dpi)
-        plt.close()
-
-    def __downsize_dpi_if_too_large(self) -> int:
-        longer_side = max(self.figsize)
-        dpi = self.DPI
-        while longer_side * dpi >= 2**16:  # 2^16 is the limit
-            dpi = int(dpi/2)  # downsize
+        dpi = self.__get_dpi()
+        raster_formats = [ext for ext in self.formats if ext.lower() in self.RASTER_FORMATS]
+        for ext in self.formats:
+            if ext not in raster_formats:  # each vector format is drawn by its own backend
+                self.grid.savefig(f'{self.outdir}/{self.DSTDIR_NAME}/{self.fname}.{ext}', dpi=dpi)
+        if raster_formats:
+            self.__save_raster_formats(raster_formats=raster_formats, dpi=dpi)
+        plt.close(self.grid.fig)
+
+    def __save_raster_formats(self, raster_formats: List[str], dpi: int):
+        buffer = io.BytesIO()
+        self.grid.savefig(buffer, format='png', dpi=dpi)  # the only raster render of the figure
+        for ext in raster_formats:
+            path = f'{self.outdir}/{self.DSTDIR_NAME}/{self.fname}.{ext}'
+            if ext.lower() == 'png':
+                with open(path, 'wb') as fh:
+                    fh.write(buffer.getvalue())
+                continue
+            buffer.seek(0)
+            with Image.open(buffer) as image:
+                if ext.lower() in ['jpg', 'jpeg']:  # no alpha channel
+                    image = image.convert('RGB')
+                image.save(path, dpi=(dpi, dpi))
+
+    def __get_dpi(self) -> int:
+        # the highest dpi, up to DPI, of which the canvas is within both the side limit and the pixel budget
+        w, h = self.figsize
+        dpi = min(
+            self.DPI,
+            self.MAX_PIXELS_PER_SIDE / max(w, h),
+            (self.PIXEL_BUDGET / (w * h)) ** 0.5)
+        dpi = max(1, int(dpi))
+        if dpi < self.DPI:
+            self.logger.info(f'Downsize dpi of heatmap "{self.fname}" to {dpi} for {w:.1f} x {h:.1f} inches')
         return dpi
 
     def save_csv(self):
         self.data.to_csv(f'{self.outdir}/{self.DSTDIR_NAME}/{self.fname}.csv', index=True)
+        if self.row_cluster_series is not None:
+            self.row_cluster_series.to_csv(f'{self.outdir}/{self.DSTDIR_NAME}/{self.fname}-row-clusters.csv', index=True)
@@ -0,0 +1,218 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+import functools
+import threading
+import subprocess
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, TextIO
+
+
+MB = 2**20
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 2**10  # ru_maxrss is in bytes on macOS, kilobytes on Linux
+RUN_METRICS_JSON = 'run-metrics.json'
+PROFILE_DIRNAME = 'profile'
+
+
+# all stage records of this process, in the order the stages started
+records: List[Dict[str, Any]] = []
+
+# the stages currently running in any thread, whose peak memory is updated whenever the tracemalloc peak is reset
+open_records: List[Dict[str, Any]] = []
+lock = threading.Lock()
+process_peak = 0  # bytes, the tracemalloc peak of the whole run, only while tracemalloc is tracing
+
+# each thread has its own stack of nested stages and active profilers
+local = threading.local()
+
+
+def get_stack() -> List[Dict[str, Any]]:
+    if not hasattr(local, 'stack'):
+        local.stack = []
+    return local.stack
+
+
+def inherit_stack(stack: List[Dict[str, Any]]):
+    """
+    Make the stages running in a worker thread nested in the stage that started the thread
+    """
+    local.stack = list(stack)
+
+
+def get_profilers() -> List[Optional[cProfile.Profile]]:
+    if not hasattr(local, 'profilers'):
+        local.profilers = []
+    return local.profilers
+
+
+def fold_peak():
+    """
+    tracemalloc only keeps one process-wide peak,
+    so fold it into every open stage before it is reset for the next stage
+    """
+    global process_peak
+    _, peak = tracemalloc.get_traced_memory()
+    process_peak = max(process_peak, peak)
+    for record in open_records:
+        if '_peak' in record:  # stages started before tracing have no Python peak
+            record['_peak'] = max(record['_peak'], peak)
+    tracemalloc.reset_peak()
+
+
+def measure_stage(main: Callable) -> Callable:
+    """
+    Decorate Processor.main to record wall time, CPU time and the max RSS of the process
+
+    tracemalloc slows down every allocation, so the peak of Python memory of each stage is only recorded
+    with settings.profile, or if tracemalloc is started by the caller, e.g. the benchmark suite
+    """
+    @functools.wraps(main)
+    def wrapper(self, *args, **kwargs):
+        stack = get_stack()
+        record = {
+            'stage': self.__class__.__name__,
+            'parent': stack[-1]['stage'] if stack else None,
+            'depth': len(stack),
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            'start': time.time(),
+            'commands': [],
+        }
+
+        profiling = getattr(self.settings, 'profile', False)
+        with lock:
+            records.append(record)
+            if profiling and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if tracemalloc.is_tracing():
+                fold_peak()
+                record['_start_traced'] = tracemalloc.get_traced_memory()[0]
+                record['_peak'] = record['_start_traced']
+            open_records.append(record)
+
+        stack.append(record)
+        profiler = start_profiler() if profiling else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            return main(self, *args, **kwargs)
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu  # of all threads of the process
+            if profiling:
+                stop_profiler(profiler=profiler, dstdir=f'{self.outdir}/{PROFILE_DIRNAME}', record=record)
+            stack.pop()
+            with lock:
+                if tracemalloc.is_tracing():
+                    fold_peak()
+                open_records.remove(record)
+            if '_peak' in record:
+                record['python_peak_mb'] = (record.pop('_peak') - record.pop('_start_traced')) / MB
+            record['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT / MB  # of the process so far
+
+    return wrapper
+
+
+def start_profiler() -> Optional[cProfile.Profile]:
+    """
+    cProfile cannot be nested, so the profiler of the enclosing stage is paused,
+    i.e. each stage profile only covers the time not spent in its sub-stages
+    """
+    profilers = get_profilers()
+    if profilers and profilers[-1] is not None:
+        profilers[-1].disable()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiling tool is active, e.g. a profiler in another thread
+        profiler = None
+    profilers.append(profiler)
+    return profiler
+
+
+def stop_profiler(profiler: Optional[cProfile.Profile], dstdir: str, record: Dict[str, Any]):
+    profilers = get_profilers()
+    profilers.pop()
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(dstdir, exist_ok=True)
+        prof = f'{dstdir}/{records.index(record):03d}-{record["stage"]}.prof'
+        profiler.dump_stats(prof)
+        record['profile'] = prof
+    if profilers and profilers[-1] is not None:
+        try:
+            profilers[-1].enable()
+        except ValueError:
+            pass
+
+
+def check_call(cmd: str, cwd: Optional[str] = None, stdout: Optional[TextIO] = None):
+    """
+    subprocess.check_call(cmd, shell=True) with the resource usage of the child process (and its descendants)
+    recorded to the current stage
+
+    stdout: file of both stdout and stderr of the child process, inherited from this process if None
+    """
+    wall = time.perf_counter()
+    p = subprocess.Popen(cmd, shell=True, cwd=cwd, stdout=stdout, stderr=stdout)
+    _, status, rusage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+
+    stack = get_stack()
+    if stack:
+        stack[-1]['commands'].append({
+            'cmd': cmd,
+            'returncode': p.returncode,
+            'wall_seconds': time.perf_counter() - wall,
+            'user_seconds': rusage.ru_utime,
+            'sys_seconds': rusage.ru_stime,
+            'max_rss_mb': rusage.ru_maxrss * MAXRSS_UNIT / MB,
+        })
+
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(returncode=p.returncode, cmd=cmd)
+
+
+def pop_records() -> List[Dict[str, Any]]:
+    """
+    Take the finished records, e.g. to send them from a worker process back to the parent process
+    """
+    with lock:
+        running = set(id(r) for r in open_records)
+        finished = [r for r in records if id(r) not in running]
+        for r in finished:
+            records.remove(r)
+    return finished
+
+
+def add_records(worker_records: List[Dict[str, Any]]):
+    stack = get_stack()
+    with lock:
+        for r in worker_records:
+            if r['parent'] is None and stack:
+                r['parent'] = stack[-1]['stage']
+            r['depth'] += len(stack)
+            records.append(r)
+
+
+def write_run_metrics(json_path: str):
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        with lock:
+            fold_peak()
+    finished = [r for r in records if 'wall_seconds' in r]
+    data = {
+        'stages': sorted(finished, key=lambda r: r['start']),
+        'process': {
+            'python_peak_mb': process_peak / MB if tracing else None,
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT / MB,
+            'children_user_seconds': children.ru_utime,
+            'children_sys_seconds': children.ru_stime,
+            'children_max_rss_mb': children.ru_maxrss * MAXRSS_UNIT / MB,
+        },
+    }
+    with open(json_path, 'w') as fh:
+        json.dump(data, fh, indent=2, default=str)
@@ -0,0 +1,708 @@
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+from .template import Processor
+
+
+INV_PHI = (np.sqrt(5.) - 1.) / 2.
+
+
+class NativeDESeq2(Processor):
+    """
+    DESeq2 in numpy, without R, for the design ~group with the defaults of DESeq() and results():
+        1. median-of-ratios size factors
+        2. gene-wise dispersions maximizing the Cox-Reid adjusted likelihood
+        3. parametric dispersion trend, alpha = a0 + a1 / mean
+        4. maximum a posteriori dispersions, shrunk towards the trend, except for dispersion outliers
+        5. negative binomial GLM and Wald test of each contrast
+        6. Cook's distance filtering and independent filtering of p values by the mean count
+
+    Gene-wise steps are vectorized over blocks of genes, which run in a thread pool of settings.threads
+
+    Differences from DESeq2: dispersions are maximized by a grid and golden-section search rather than a line search,
+    the dispersion trend falls back to the mean rather than a local fit if the parametric fit fails,
+    the rare GLMs that do not converge are not refitted by optim(),
+    and outliers of >= 7 replicates are filtered but not replaced
+    """
+
+    BLOCK_GENES = 2000
+    MIN_DISP = 1e-8
+    MIN_MU = 0.5
+    RIDGE_LAMBDA = 1e-6  # on the log2 scale
+    BETA_TOL = 1e-8
+    MAX_ITER = 100
+    LARGE_BETA = 30.
+    DISP_OUTLIER_SD = 2.
+    COOKS_QUANTILE = 0.99
+    FDR_ALPHA = 0.1
+    GRID_POINTS = 15
+    GOLDEN_ITERATIONS = 30
+    RANDOM_STATE = 1  # to ensure reproducible result
+
+    count_df: pd.DataFrame
+    sample_info_df: pd.DataFrame
+    sample_group_column: str
+    contrasts: List[Tuple[str, str]]  # (control, experimental)
+
+    levels: List[str]
+    sample_levels: np.ndarray
+    design: np.ndarray
+    cells: np.ndarray
+    counts: np.ndarray
+    non_zero: np.ndarray
+    size_factors: np.ndarray
+    base_means: np.ndarray
+    max_disp: float
+    mu: np.ndarray
+    gene_wise_dispersions: np.ndarray
+    fitted_dispersions: np.ndarray
+    var_log_disp: float
+    dispersions: np.ndarray
+    betas: np.ndarray
+    sigmas: np.ndarray
+    hat_diagonals: np.ndarray
+    fit_mu: np.ndarray
+    max_cooks: np.ndarray
+    max_cooks_counts: np.ndarray
+    statistics_dfs: List[pd.DataFrame]
+    normalized_count_df: pd.DataFrame
+
+    def main(
+            self,
+            count_df: pd.DataFrame,
+            sample_info_df: pd.DataFrame,
+            sample_group_column: str,
+            contrasts: List[Tuple[str, str]]) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
+
+        self.count_df = count_df
+        self.sample_info_df = sample_info_df
+        self.sample_group_column = sample_group_column
+        self.contrasts = contrasts
+
+        self.check_group_names()
+        self.set_design()
+        self.set_counts()
+        self.estimate_size_factors()
+        self.estimate_gene_wise_dispersions()
+        self.fit_dispersion_trend()
+        self.estimate_map_dispersions()
+        self.fit_glm()
+        self.compute_max_cooks()
+        self.set_statistics_dfs()
+        self.set_normalized_count_df()
+
+        return self.normalized_count_df, self.statistics_dfs
+
+    def check_group_names(self):
+        valid_group_names = set(self.sample_info_df[self.sample_group_column])
+        for contrast in self.contrasts:
+            for name in contrast:
+                if name not in valid_group_names:
+                    msg = f'"{name}" does not exists in the "{self.sample_group_column}" column of the sample info table'
+                    raise AssertionError(msg)
+
+    def set_design(self):
+        groups = self.sample_info_df.loc[self.count_df.columns, self.sample_group_column].astype(str).to_numpy()
+        self.levels = sorted(set(groups))  # as factor() in R, the first level is the reference
+        self.sample_levels = np.array([self.levels.index(g) for g in groups])
+
+        m, p = len(groups), len(self.levels)
+        assert m > p, 'The number of samples must be larger than the number of groups, i.e. there must be replicates'
+
+        self.cells = np.eye(p)[self.sample_levels]  # samples x groups, one-hot
+        self.design = np.ones((m, p))  # intercept and an indicator of each non-reference level
+        self.design[:, 1:] = self.cells[:, 1:]
+
+    def set_counts(self):
+        self.counts = self.count_df.to_numpy(dtype=np.float64)
+        self.non_zero = self.counts.sum(axis=1) > 0
+
+    def estimate_size_factors(self):
+        with np.errstate(divide='ignore'):
+            log_counts = np.log(self.counts)
+        log_geo_means = log_counts.mean(axis=1)
+        use = np.isfinite(log_geo_means)
+        assert use.any(), 'Every gene contains at least one zero, cannot compute log geometric means'
+
+        self.size_factors = np.exp(np.median(log_counts[use] - log_geo_means[use, np.newaxis], axis=0))
+        self.base_means = (self.counts / self.size_factors).mean(axis=1)
+        self.max_disp = max(10., self.counts.shape[1])
+        self.logger.info(f'DESeq2 size factors: {np.round(self.size_factors, 4).tolist()}')
+
+    def estimate_gene_wise_dispersions(self):
+        self.gene_wise_dispersions = np.full(len(self.counts), np.nan)
+        counts = self.counts[self.non_zero]
+        normalized = counts / self.size_factors
+
+        # group means of normalized counts, i.e. the linear model fit of the design of groups
+        group_means = (normalized @ self.cells) / self.cells.sum(axis=0)
+        self.mu = np.full(self.counts.shape, np.nan)
+        self.mu[self.non_zero] = np.maximum(group_means[:, self.sample_levels] * self.size_factors, self.MIN_MU)
+
+        alpha_init = np.minimum(
+            rough_dispersions(normalized=normalized, group_means=group_means, sample_levels=self.sample_levels),
+            moments_dispersions(normalized=normalized, size_factors=self.size_factors))
+        alpha_init = np.clip(alpha_init, self.MIN_DISP, self.max_disp)
+
+        def fit(rows: slice) -> np.ndarray:
+            y, mu, init = counts[rows], self.mu[self.non_zero][rows], alpha_init[rows]
+            log_posterior = partial_log_posterior(y=y, mu=mu, cells=self.cells)
+            log_alpha = self.maximize(log_posterior, n=len(y))
+            # as DESeq2, keep the initial estimate if the likelihood is not increased
+            initial = log_posterior(np.log(init))
+            no_increase = log_posterior(log_alpha) < initial + np.abs(initial) / 1e6
+            return np.where(no_increase, init, np.exp(log_alpha))
+
+        alpha = np.concatenate(self.map_blocks(fit, n=len(counts)))
+        self.gene_wise_dispersions[self.non_zero] = np.clip(alpha, self.MIN_DISP, self.max_disp)
+
+    def fit_dispersion_trend(self):
+        disps = self.gene_wise_dispersions[self.non_zero]
+        means = self.base_means[self.non_zero]
+        use = disps > 100 * self.MIN_DISP
+        assert use.any(), 'All gene-wise dispersion estimates are within 2 orders of magnitude of the minimum value'
+
+        coefficients = parametric_dispersion_fit(means=means[use], disps=disps[use])
+        if coefficients is None:
+            self.logger.info('The parametric fit of dispersions over the mean count failed, use the mean dispersion')
+            fitted = np.full(len(means), stats.trim_mean(disps[use], 0.001))
+        else:
+            a0, a1 = coefficients
+            self.logger.info(f'DESeq2 dispersion trend: {a0:.4g} + {a1:.4g} / mean')
+            fitted = a0 + a1 / means
+
+        self.fitted_dispersions = np.full(len(self.counts), np.nan)
+        self.fitted_dispersions[self.non_zero] = fitted
+
+        residuals = np.log(disps[use]) - np.log(fitted[use])
+        self.var_log_disp = stats.median_abs_deviation(residuals, scale='normal') ** 2
+
+    def estimate_map_dispersions(self):
+        counts = self.counts[self.non_zero]
+        gene_wise = self.gene_wise_dispersions[self.non_zero]
+        fitted = self.fitted_dispersions[self.non_zero]
+        prior_var = self.get_dispersion_prior_var(
+            residuals=np.log(gene_wise) - np.log(fitted),
+            above_min=gene_wise >= 100 * self.MIN_DISP)
+
+        def fit(rows: slice) -> np.ndarray:
+            y, mu = counts[rows], self.mu[self.non_zero][rows]
+            log_posterior = partial_log_posterior(
+                y=y, mu=mu, cells=self.cells, prior_mean=np.log(fitted[rows]), prior_var=prior_var)
+            return np.exp(self.maximize(log_posterior, n=len(y)))
+
+        alpha = np.clip(np.concatenate(self.map_blocks(fit, n=len(counts))), self.MIN_DISP, self.max_disp)
+        outlier = np.log(gene_wise) > np.log(fitted) + self.DISP_OUTLIER_SD * np.sqrt(self.var_log_disp)
+
+        self.dispersions = np.full(len(self.counts), np.nan)
+        self.dispersions[self.non_zero] = np.where(outlier, gene_wise, alpha)
+
+    def get_dispersion_prior_var(self, residuals: np.ndarray, above_min: np.ndarray) -> float:
+        m, p = self.design.shape
+        if m - p <= 3:
+            # the distribution of log dispersions is too asymmetric for the MAD, match it by simulation
+            prior_var = simulate_dispersion_prior_var(
+                residuals=residuals[above_min], df=m - p, random_state=self.RANDOM_STATE)
+        else:
+            prior_var = self.var_log_disp - special.polygamma(1, (m - p) / 2)
+        return max(prior_var, 0.25)
+
+    def fit_glm(self):
+        m, p = self.design.shape
+        n = len(self.counts)
+        self.betas = np.full((n, p), np.nan)
+        self.sigmas = np.full((n, p, p), np.nan)
+        self.hat_diagonals = np.full((n, m), np.nan)
+        self.fit_mu = np.full((n, m), np.nan)
+
+        counts = self.counts[self.non_zero]
+        dispersions = self.dispersions[self.non_zero]
+        ridge = np.diag(np.full(p, self.RIDGE_LAMBDA / np.log(2) ** 2))  # on the natural log scale
+
+        def fit(rows: slice) -> Tuple[np.ndarray, ...]:
+            return fit_nbinom_glm(
+                y=counts[rows],
+                size_factors=self.size_factors,
+                design=self.design,
+                alpha=dispersions[rows],
+                ridge=ridge,
+                min_mu=self.MIN_MU,
+                tol=self.BETA_TOL,
+                max_iter=self.MAX_ITER,
+                large=self.LARGE_BETA)
+
+        results = self.map_blocks(fit, n=len(counts))
+        for array, i in [(self.betas, 0), (self.sigmas, 1), (self.hat_diagonals, 2), (self.fit_mu, 3)]:
+            array[self.non_zero] = np.concatenate([r[i] for r in results])
+
+    def compute_max_cooks(self):
+        m, p = self.design.shape
+        self.max_cooks = np.full(len(self.counts), np.nan)
+        self.max_cooks_counts = np.full(len(self.counts), np.nan)
+
+        replicates = self.cells.sum(axis=0)
+        samples_for_cooks = replicates[self.sample_levels] >= 3
+        if not samples_for_cooks.any():
+            return
+
+        counts = self.counts[self.non_zero]
+        mu = self.fit_mu[self.non_zero]
+        h = self.hat_diagonals[self.non_zero]
+        alpha = robust_moments_dispersions(
+            normalized=counts / self.size_factors, sample_levels=self.sample_levels, replicates=replicates)
+        pearson_residual_squares = (counts - mu) ** 2 / (mu + alpha[:, np.newaxis] * mu ** 2)
+        cooks = pearson_residual_squares / p * h / (1 - h) ** 2
+
+        self.max_cooks[self.non_zero] = cooks[:, samples_for_cooks].max(axis=1)
+        self.max_cooks_counts[self.non_zero] = counts[np.arange(len(counts)), cooks.argmax(axis=1)]
+
+    def set_statistics_dfs(self):
+        self.statistics_dfs = [self.get_statistics_df(control=c, experimental=e) for c, e in self.contrasts]
+
+    def get_statistics_df(self, control: str, experimental: str) -> pd.DataFrame:
+        m, p = self.design.shape
+        contrast = np.zeros(p)
+        for name, sign in [(str(experimental), 1.), (str(control), -1.)]:
+            i = self.levels.index(name)
+            if i > 0:  # the reference level has no coefficient
+                contrast[i] += sign
+
+        lfc = self.betas @ contrast / np.log(2)
+        se = np.sqrt(np.maximum(np.einsum('p,gpq,q->g', contrast, self.sigmas, contrast), 0)) / np.log(2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stat = lfc / se
+        pvalue = 2 * stats.norm.sf(np.abs(stat))
+
+        in_contrast = np.isin(self.sample_levels, [self.levels.index(str(control)), self.levels.index(str(experimental))])
+        all_zero = self.non_zero & (self.counts[:, in_contrast].sum(axis=1) == 0)
+        lfc[all_zero], stat[all_zero], pvalue[all_zero] = 0., 0., 1.
+
+        pvalue[self.get_cooks_outliers()] = np.nan
+        padj = independent_filtering(pvalue=pvalue, base_means=self.base_means, alpha=self.FDR_ALPHA)
+
+        return pd.DataFrame(
+            data={
+                'baseMean': self.base_means,
+                'log2FoldChange': lfc,
+                'lfcSE': se,
+                'stat': stat,
+                'pvalue': pvalue,
+                'padj': padj,
+            },
+            index=self.count_df.index)
+
+    def get_cooks_outliers(self) -> np.ndarray:
+        m, p = self.design.shape
+        cutoff = stats.f.ppf(self.COOKS_QUANTILE, p, m - p)
+        with np.errstate(invalid='ignore'):
+            outliers = self.max_cooks > cutoff
+        if p == 2:
+            # as DESeq2 for two groups, do not filter low count outliers, i.e. with 3 or more larger counts
+            larger = (self.counts > self.max_cooks_counts[:, np.newaxis]).sum(axis=1)
+            outliers &= larger < 3
+        return outliers
+
+    def set_normalized_count_df(self):
+        self.normalized_count_df = pd.DataFrame(
+            data=self.counts / self.size_factors,
+            index=self.count_df.index,
+            columns=self.count_df.columns)
+
+    def maximize(self, function: Callable[[np.ndarray], np.ndarray], n: int) -> np.ndarray:
+        """
+        Maximize function of log dispersions of n genes, first on a grid, then by golden-section search
+        """
+        grid = np.linspace(np.log(self.MIN_DISP / 10), np.log(self.max_disp), self.GRID_POINTS)
+        values = np.stack([function(np.full(n, x)) for x in grid])
+        best = np.argmax(values, axis=0)
+        return golden_section_search(
+            function=function,
+            a=grid[np.maximum(best - 1, 0)],
+            b=grid[np.minimum(best + 1, len(grid) - 1)],
+            iterations=self.GOLDEN_ITERATIONS)
+
+    def map_blocks(self, function: Callable[[slice], Any], n: int) -> List[Any]:
+        blocks = [slice(i, i + self.BLOCK_GENES) for i in range(0, n, self.BLOCK_GENES)]
+        with ThreadPoolExecutor(max_workers=max(1, self.threads)) as executor:
+            return list(executor.map(function, blocks))
+
+
+def rough_dispersions(normalized: np.ndarray, group_means: np.ndarray, sample_levels: np.ndarray) -> np.ndarray:
+    m, p = normalized.shape[1], group_means.shape[1]
+    mu = np.maximum(group_means[:, sample_levels], 1.)
+    estimates = (((normalized - mu) ** 2 - mu) / mu ** 2).sum(axis=1) / (m - p)
+    return np.maximum(estimates, 0.)
+
+
+def moments_dispersions(normalized: np.ndarray, size_factors: np.ndarray) -> np.ndarray:
+    xim = np.mean(1. / size_factors)
+    means = normalized.mean(axis=1)
+    variances = normalized.var(axis=1, ddof=1)
+    return (variances - xim * means) / means ** 2
+
+
+def partial_log_posterior(
+        y: np.ndarray,
+        mu: np.ndarray,
+        cells: np.ndarray,
+        prior_mean: Optional[np.ndarray] = None,
+        prior_var: Optional[float] = None) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Returns the Cox-Reid adjusted log likelihood (plus the log prior, if given) as a function of log dispersions
+    """
+    def log_posterior(log_alpha: np.ndarray) -> np.ndarray:
+        alpha = np.exp(log_alpha)[:, np.newaxis]
+        r = 1. / alpha
+        alpha_mu = alpha * mu
+        log1p_alpha_mu = np.log1p(alpha_mu)
+        # lgamma(y + r) - lgamma(r) - lgamma(y + 1), which is accurate for the large r of small dispersions
+        ll = -special.betaln(y + 1., r) - np.log(y + r) - r * log1p_alpha_mu + y * (np.log(alpha_mu) - log1p_alpha_mu)
+        w = mu / (1. + alpha_mu)
+        # log det(X^T W X), which is the same for the cell-means parameterization of the design
+        cr_term = -0.5 * np.log(w @ cells).sum(axis=1)
+        lp = ll.sum(axis=1) + cr_term
+        if prior_mean is not None:
+            lp -= (log_alpha - prior_mean) ** 2 / (2. * prior_var)
+        return lp
+
+    return log_posterior
+
+
+def golden_section_search(
+        function: Callable[[np.ndarray], np.ndarray],
+        a: np.ndarray,
+        b: np.ndarray,
+        iterations: int) -> np.ndarray:
+    """
+    Vectorized maximization, each element in its own bracket [a, b], with a single function evaluation per iteration
+    """
+    c = b - INV_PHI * (b - a)
+    d = a + INV_PHI * (b - a)
+    fc, fd = function(c), function(d)
+    for _ in range(iterations):
+        left = fc >= fd  # the maximum is in [a, d]
+        a = np.where(left, a, c)
+        b = np.where(left, d, b)
+        new_c = np.where(left, b - INV_PHI * (b - a), d)
+        new_d = np.where(left, c, a + INV_PHI * (b - a))
+        fx = function(np.where(left, new_c, new_d))
+        fc, fd = np.where(left, fx, fd), np.where(left, fc, fx)
+        c, d = new_c, new_d
+    return (a + b) / 2.
+
+
+def parametric_dispersion_fit(means: np.ndarray, disps: np.ndarray) -> Optional[Tuple[float, float]]:
+    """
+    The iterative gamma-family GLM fit of DESeq2, returns None if it fails
+    """
+    coefficients = np.array([0.1, 1.])
+    for _ in range(11):
+        residuals = disps / (coefficients[0] + coefficients[1] / means)
+        good = (residuals > 1e-4) & (residuals < 15)
+        old = coefficients
+        coefficients, converged = gamma_identity_glm(y=disps[good], x=1. / means[good], start=coefficients)
+        if coefficients is None or not np.all(coefficients > 0):
+            return None
+        if np.sum(np.log(coefficients / old) ** 2) < 1e-6 and converged:
+            return float(coefficients[0]), float(coefficients[1])
+    return None
+
+
+def gamma_identity_glm(
+        y: np.ndarray,
+        x: np.ndarray,
+        start: np.ndarray,
+        tol: float = 1e-8,
+        max_iter: int = 25) -> Tuple[Optional[np.ndarray], bool]:
+    """
+    IRLS of glm(y ~ x, family=Gamma(link='identity')), as glm.fit() in R
+    """
+    design = np.column_stack([np.ones(len(x)), x])
+    beta = start
+    mu = design @ beta
+    if np.any(mu <= 0):
+        return None, False
+    deviance = gamma_deviance(y, mu)
+    for _ in range(max_iter):
+        w = 1. / mu ** 2
+        beta = np.linalg.solve(design.T @ (design * w[:, np.newaxis]), design.T @ (w * y))
+        mu = design @ beta
+        if np.any(mu <= 0):
+            return None, False
+        old, deviance = deviance, gamma_deviance(y, mu)
+        if abs(deviance - old) / (abs(deviance) + 0.1) < tol:
+            return beta, True
+    return beta, False
+
+
+def gamma_deviance(y: np.ndarray, mu: np.ndarray) -> float:
+    return 2. * np.sum(-np.log(y / mu) + (y - mu) / mu)
+
+
+def simulate_dispersion_prior_var(residuals: np.ndarray, df: int, random_state: int) -> float:
+    """
+    For 1 to 3 residual degrees of freedom, as DESeq2, the prior variance of which the simulated distribution
+    of log dispersion residuals is the closest (Kullback-Leibler divergence) to the observed one
+    """
+    rng = np.random.default_rng(random_state)
+    breaks = np.arange(-20, 11) / 2.
+    observed = residuals[(residuals > breaks[0]) & (residuals < breaks[-1])]
+    observed_density, _ = np.histogram(observed, bins=breaks, density=True)
+
+    grid = np.linspace(0, 8, 200)
+    kl_divergences = []
+    for var in grid:
+        simulated = np.log(rng.chisquare(df, size=10000)) + rng.normal(0, np.sqrt(var), size=10000) - np.log(df)
+        simulated = simulated[(simulated > breaks[0]) & (simulated < breaks[-1])]
+        simulated_density, _ = np.histogram(simulated, bins=breaks, density=True)
+        z = np.concatenate([observed_density, simulated_density])
+        small = z[z > 0].min()
+        kl_divergences.append(np.sum(observed_density * (np.log(observed_density + small) - np.log(simulated_density + small))))
+
+    smoothed = lowess(x=grid, y=np.array(kl_divergences), f=0.2)
+    return float(grid[np.argmin(smoothed)])
+
+
+def fit_nbinom_glm(
+        y: np.ndarray,
+        size_factors: np.ndarray,
+        design: np.ndarray,
+        alpha: np.ndarray,
+        ridge: np.ndarray,
+        min_mu: float,
+        tol: float,
+        max_iter: int,
+        large: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Ridge-penalized IRLS of the negative binomial GLM with log link, for all genes (rows of y) at once
+
+    Returns:
+        beta: genes x coefficients, on the natural log scale
+        sigma: genes x coefficients x coefficients, the covariance of beta
+        hat_diagonal: genes x samples
+        mu: genes x samples
+    """
+    n = len(y)
+    alpha = alpha[:, np.newaxis]
+
+    # initial estimate from the least squares fit of log normalized counts
+    beta = (np.linalg.pinv(design) @ np.log(y / size_factors + 0.1).T).T
+    mu = np.maximum(size_factors * np.exp(beta @ design.T), min_mu)
+
+    active = np.ones(n, dtype=bool)
+    deviance = np.zeros(n)
+    for t in range(max_iter):
+        i = np.flatnonzero(active)
+        if len(i) == 0:
+            break
+        w = mu[i] / (1. + alpha[i] * mu[i])
+        z = np.log(mu[i] / size_factors) + (y[i] - mu[i]) / mu[i]
+        xtwx = np.einsum('gj,jp,jq->gpq', w, design, design) + ridge
+        beta[i] = np.linalg.solve(xtwx, ((w * z) @ design)[:, :, np.newaxis])[:, :, 0]
+
+        too_large = np.abs(beta[i]).max(axis=1) > large
+        mu[i] = np.maximum(size_factors * np.exp(beta[i] @ design.T), min_mu)
+        old, deviance[i] = deviance[i], -2. * nbinom_log_pmf(y[i], mu[i], alpha[i]).sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            converged = np.abs(deviance[i] - old) / (np.abs(deviance[i]) + 0.1) < tol
+        done = too_large | np.isnan(deviance[i]) | (converged & (t > 0))
+        active[i[done]] = False
+
+    mu = np.maximum(size_factors * np.exp(beta @ design.T), min_mu)
+    w = mu / (1. + alpha * mu)
+    xtwx = np.einsum('gj,jp,jq->gpq', w, design, design)
+    xtwx_ridge_inv = np.linalg.inv(xtwx + ridge)
+    sigma = xtwx_ridge_inv @ xtwx @ xtwx_ridge_inv
+    hat_diagonal = w * np.einsum('jp,gpq,jq->gj', design, xtwx_ridge_inv, design)
+    fit_mu = size_factors * np.exp(beta @ design.T)
+
+    return beta, sigma, hat_diagonal, fit_mu
+
+
+def nbinom_log_pmf(y: np.ndarray, mu: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    r = 1. / alpha
+    log1p_alpha_mu = np.log1p(alpha * mu)
+    return -special.betaln(y + 1., r) - np.log(y + r) - r * log1p_alpha_mu + y * (np.log(alpha * mu) - log1p_alpha_mu)
+
+
+def robust_moments_dispersions(normalized: np.ndarray, sample_levels: np.ndarray, replicates: np.ndarray) -> np.ndarray:
+    """
+    Dispersions from trimmed variances, for Cook's distances, as robustMethodOfMomentsDisp() of DESeq2
+    """
+    levels = np.flatnonzero(replicates >= 3)
+    if len(levels) > 0:
+        variances = []
+        for level in levels:
+            cell = normalized[:, sample_levels == level]
+            trim, scale = get_trim_ratio_and_scale(cell.shape[1])
+            cell_means = trimmed_mean(cell, trim)
+            variances.append(scale * trimmed_mean((cell - cell_means[:, np.newaxis]) ** 2, trim))
+        variance = np.max(variances, axis=0)
+    else:
+        row_means = trimmed_mean(normalized, 1 / 8)
+        variance = 1.51 * trimmed_mean((normalized - row_means[:, np.newaxis]) ** 2, 1 / 8)
+
+    means = normalized.mean(axis=1)
+    return np.maximum((variance - means) / means ** 2, 0.04)
+
+
+def get_trim_ratio_and_scale(n: int) -> Tuple[float, float]:
+    if n <= 3:
+        return 1 / 3, 2.04
+    if n <= 23.5:
+        return 1 / 4, 1.86
+    return 1 / 8, 1.51
+
+
+def trimmed_mean(x: np.ndarray, trim: float) -> np.ndarray:
+    """
+    Row means as mean(x, trim=trim) in R
+    """
+    n = x.shape[1]
+    lo = int(np.floor(n * trim))
+    return np.sort(x, axis=1)[:, lo:n - lo].mean(axis=1)
+
+
+def independent_filtering(pvalue: np.ndarray, base_means: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    As results(independentFiltering=TRUE) of DESeq2, adjusted p values after removing the genes of low mean counts,
+    at the quantile of mean counts that maximizes the number of rejections
+    """
+    lower = np.mean(base_means == 0)
+    upper = 0.95 if lower < 0.95 else 1.
+    theta = np.linspace(lower, upper, 50)
+    cutoffs = np.quantile(base_means, theta)
+
+    filtered_padj = np.full((len(pvalue), len(theta)), np.nan)
+    for i, cutoff in enumerate(cutoffs):
+        use = base_means >= cutoff
+        filtered_padj[use, i] = benjamini_hochberg(pvalue[use])
+
+    with np.errstate(invalid='ignore'):
+        n_rejections = (filtered_padj < alpha).sum(axis=0)
+    fitted = lowess(x=theta, y=n_rejections.astype(np.float64), f=1 / 5)
+    if n_rejections.max() <= 10:
+        j = 0
+    else:
+        positive = n_rejections > 0
+        residuals = n_rejections[positive] - fitted[positive]
+        threshold = fitted.max() - np.sqrt(np.mean(residuals ** 2))
+        above = np.flatnonzero(n_rejections > threshold)
+        j = above[0] if len(above) > 0 else 0
+
+    return filtered_padj[:, j]
+
+
+def benjamini_hochberg(p: np.ndarray) -> np.ndarray:
+    """
+    As p.adjust(method='BH') in R, NaN p values are kept and not counted
+    """
+    adjusted = np.full(len(p), np.nan)
+    valid = np.flatnonzero(~np.isnan(p))
+    n = len(valid)
+    if n == 0:
+        return adjusted
+    order = np.argsort(p[valid])[::-1]
+    ranks = np.arange(n, 0, -1)
+    q = np.minimum.accumulate(n / ranks * p[valid][order])
+    adjusted[valid[order]] = np.minimum(q, 1.)
+    return adjusted
+
+
+def lowess(x: np.ndarray, y: np.ndarray, f: float, iterations: int = 3) -> np.ndarray:
+    """
+    Port of lowess() in R (clowess), for x sorted in ascending order, with delta = 0.01 * range(x)
+    """
+    n = len(x)
+    if n < 2:
+        return y.astype(np.float64)
+
+    delta = 0.01 * (x[-1] - x[0])
+    ns = max(2, min(n, int(f * n + 1e-7)))
+    ys = np.zeros(n)
+    robustness_weights = np.ones(n)
+
+    for iteration in range(iterations + 1):
+        nleft, nright, last, i = 0, ns - 1, -1, 0
+        while True:
+            if nright < n - 1:
+                if x[i] - x[nleft] > x[nright + 1] - x[i]:
+                    nleft += 1
+                    nright += 1
+                    continue
+
+            fitted = lowest(x, y, x[i], nleft, nright, robustness_weights if iteration > 0 else None)
+            ys[i] = y[i] if fitted is None else fitted
+
+            if last < i - 1:  # interpolate the skipped points
+                denominator = x[i] - x[last]
+                for j in range(last + 1, i):
+                    a = (x[j] - x[last]) / denominator
+                    ys[j] = a * ys[i] + (1. - a) * ys[last]
+
+            last = i
+            cut = x[last] + delta
+            i = last + 1
+            while i < n:
+                if x[i] > cut:
+                    break
+                if x[i] == x[last]:
+                    ys[i] = ys[last]
+                    last = i
+                i += 1
+            i = max(last + 1, i - 1)
+            if last >= n - 1:
+                break
+
+        residuals = y - ys
+        scale = np.mean(np.abs(residuals))
+        if iteration == iterations:
+            break
+        cmad = 6. * np.median(np.abs(residuals))
+        if cmad < 1e-7 * scale:
+            break
+        r = np.abs(residuals)
+        robustness_weights = np.where(
+            r <= 0.001 * cmad, 1., np.where(r <= 0.999 * cmad, (1. - (r / cmad) ** 2) ** 2, 0.))
+
+    return ys
+
+
+def lowest(
+        x: np.ndarray,
+        y: np.ndarray,
+        xs: float,
+        nleft: int,
+        nright: int,
+        robustness_weights: Optional[np.ndarray]) -> Optional[float]:
+    """
+    The locally weighted linear fit at xs of lowess(), None if all weights are zero
+    """
+    n = len(x)
+    h = max(xs - x[nleft], x[nright] - xs)
+    w = np.zeros(n)
+    j = nleft
+    while j < n:
+        r = abs(x[j] - xs)
+        if r <= 0.999 * h:
+            w[j] = 1. if r <= 0.001 * h else (1. - (r / h) ** 3) ** 3
+            if robustness_weights is not None:
+                w[j] *= robustness_weights[j]
+        elif x[j] > xs:
+            break
+        j += 1
+    nrt = j - 1
+
+    window = slice(nleft, nrt + 1)
+    total = w[window].sum()
+    if total <= 0.:
+        return None
+    w[window] /= total
+    if h > 0.:
+        center = np.sum(w[window] * x[window])
+        c = np.sum(w[window] * (x[window] - center) ** 2)
+        if np.sqrt(c) > 0.001 * (x[-1] - x[0]):
+            w[window] *= (xs - center) / c * (x[window] - center) + 1.
+    return float(np.sum(w[window] * y[window]))
@@ -1,11 +1,15 @@
 import os
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-from typing import Tuple, Optional, List
+from functools import partial
+from typing import Callable, Iterator, Tuple, Optional, List
 from matplotlib.axes import Axes
 from sklearn import decomposition
-from .template import Processor
+from .template import Processor, PYPLOT
+from .tpm import iter_row_chunks
+from .gene_stats import select_top_variable_genes
 
 
 DSTDIR_NAME = 'pca'
@@ -13,16 +17,21 @@ DSTDIR_NAME = 'pca'
 
 class PCA(Processor):
 
-    XY_COLUMNS = ('PC 1', 'PC 2')
+    PLOTTED_COMPONENT_PAIRS = [(1, 2), (2, 3), (3, 4)]
 
     feature_by_sample_df: pd.DataFrame  # row features x column samples
     sample_info_df: pd.DataFrame
     sample_group_column: str
     colors: List[Tuple[float, float, float, float]]
     fname: str
+    n_components: int
+    svd_solver: str
+    block_rows: int
+    top_variable_genes: int
 
     sample_coordinate_df: pd.DataFrame
     proportion_explained_series: pd.Series
+    loading_df: pd.DataFrame
 
     def main(
             self,
@@ -30,32 +39,57 @@ class PCA(Processor):
             sample_info_df: pd.DataFrame,
             sample_group_column: str,
             colors: List[Tuple[float, float, float, float]],
-            fname: str):
-
+            fname: str,
+            n_components: int = 4,
+            svd_solver: str = 'auto',
+            block_rows: int = 0,
+            top_variable_genes: int = 0):
+        """
+        block_rows: if > 0, compute PCA out of core over blocks of this many feature rows, e.g. of a memory-mapped matrix
+
+        top_variable_genes: if > 0, compute PCA of only this many highly variable features
+        """
         self.feature_by_sample_df = feature_by_sample_df
         self.sample_info_df = sample_info_df
         self.sample_group_column = sample_group_column
         self.colors = colors
         self.fname = fname
+        self.n_components = n_components
+        self.svd_solver = svd_solver
+        self.block_rows = block_rows
+        self.top_variable_genes = top_variable_genes
 
+        self.select_variable_genes()
         self.compute_pca()
         self.merge_group_info()
         self.make_dstdir()
         self.write_sample_coordinate()
+        self.write_loading()
         self.plot_sample_coordinate()
         self.write_proportion_explained()
+        self.write_scree()
+
+    def select_variable_genes(self):
+        n = len(self.feature_by_sample_df)
+        self.feature_by_sample_df = select_top_variable_genes(df=self.feature_by_sample_df, n=self.top_variable_genes)
+        if len(self.feature_by_sample_df) < n:
+            self.logger.info(f'For PCA "{self.fname}", keep {len(self.feature_by_sample_df)} highly variable genes out of {n}')
 
     def compute_pca(self):
-        self.sample_coordinate_df, self.proportion_explained_series = ComputePCA(self.settings).main(
-            feature_by_sample_df=self.feature_by_sample_df)
+        if self.block_rows > 0:
+            self.sample_coordinate_df, self.proportion_explained_series, self.loading_df = BlockComputePCA(self.settings).main(
+                feature_chunks=partial(iter_row_chunks, df=self.feature_by_sample_df, chunk_rows=self.block_rows),
+                n_components=self.n_components)
+        else:
+            self.sample_coordinate_df, self.proportion_explained_series, self.loading_df = ComputePCA(self.settings).main(
+                feature_by_sample_df=self.feature_by_sample_df,
+                n_components=self.n_components,
+                svd_solver=self.svd_solver)
 
     def merge_group_info(self):
-        self.sample_coordinate_df = self.sample_coordinate_df.merge(
-            right=self.sample_info_df,
-            right_index=True,
-            left_index=True,
-            how='left'
-        )
+        self.sample_coordinate_df = pd.concat(
+            [self.sample_coordinate_df, self.sample_info_df.reindex(self.sample_coordinate_df.index)],
+            axis=1)
 
     def make_dstdir(self):
         os.makedirs(f'{self.outdir}/{DSTDIR_NAME}', exist_ok=True)
@@ -65,79 +99,257 @@ class PCA(Processor):
             f'{self.outdir}/{DSTDIR_NAME}/{self.fname}-sample-coordinate.csv'
         )
 
-    def plot_sample_coordinate(self):
-        ScatterPlot(self.settings).main(
-            sample_coordinate_df=self.sample_coordinate_df,
-            x_column=self.XY_COLUMNS[0],
-            y_column=self.XY_COLUMNS[1],
-            hue_column=self.sample_group_column,
-            x_label_suffix=f' ({self.proportion_explained_series[0]*100:.2f}%)',
-            y_label_suffix=f' ({self.proportion_explained_series[1]*100:.2f}%)',
-            colors=self.colors,
-            fname=f'{self.fname}-sample-coordinate'
+    def write_loading(self):
+        self.loading_df.to_csv(
+            f'{self.outdir}/{DSTDIR_NAME}/{self.fname}-loading.csv'
         )
 
+    def plot_sample_coordinate(self):
+        # all views from the same fit
+        n = len(self.proportion_explained_series)
+        for x, y in self.PLOTTED_COMPONENT_PAIRS:
+            if y > n:
+                break
+            suffix = '' if (x, y) == (1, 2) else f'-pc{x}-pc{y}'
+            ScatterPlot(self.settings).main(
+                sample_coordinate_df=self.sample_coordinate_df,
+                x_column=f'PC {x}',
+                y_column=f'PC {y}',
+                hue_column=self.sample_group_column,
+                x_label_suffix=f' ({self.proportion_explained_series.iloc[x - 1]*100:.2f}%)',
+                y_label_suffix=f' ({self.proportion_explained_series.iloc[y - 1]*100:.2f}%)',
+                colors=self.colors,
+                fname=f'{self.fname}-sample-coordinate{suffix}'
+            )
+
     def write_proportion_explained(self):
         self.proportion_explained_series.to_csv(
             f'{self.outdir}/{DSTDIR_NAME}/{self.fname}-proportion-explained.csv',
             header=['Proportion Explained']
         )
 
+    def write_scree(self):
+        p = self.proportion_explained_series
+        df = pd.DataFrame({
+            'Component': [f'PC {i + 1}' for i in range(len(p))],
+            'Proportion Explained': p.to_numpy(),
+            'Cumulative Proportion Explained': p.cumsum().to_numpy(),
+        })
+        df.to_csv(f'{self.outdir}/{DSTDIR_NAME}/{self.fname}-scree.csv', index=False)
+
 
 class ComputePCA(Processor):
 
-    XY_COLUMNS = ('PC 1', 'PC 2')
     N_COMPONENTS = 2
+    SVD_SOLVERS = ['auto', 'full', 'randomized', 'arpack']
     RANDOM_STATE = 1  # to ensure reproducible result
 
     feature_by_sample_df: pd.DataFrame
+    n_components: int
+    svd_solver: str
 
-    sample_by_feature_df: pd.DataFrame
+    sample_by_feature: np.ndarray
     embedding: decomposition.PCA
     sample_coordinate_df: pd.DataFrame
     proportion_explained_series: pd.Series
+    loading_df: pd.DataFrame
 
-    def main(self, feature_by_sample_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
-
+    def main(
+            self,
+            feature_by_sample_df: pd.DataFrame,
+            n_components: int = N_COMPONENTS,
+            svd_solver: str = 'auto') -> Tuple[pd.DataFrame, pd.Series, pd.DataFrame]:
+        """
+        svd_solver:
+            "randomized" or "arpack" for a truncated SVD of only n_components,
+            which is much faster than the full SVD for wide matrices
+
+        Returns:
+            sample_coordinate_df: samples x components, i.e. the scores
+            proportion_explained_series: of each component
+            loading_df: features x components
+        """
         self.feature_by_sample_df = feature_by_sample_df
+        self.n_components = n_components
+        self.svd_solver = svd_solver
+
+        assert self.svd_solver in self.SVD_SOLVERS, f'Unknown SVD solver "{self.svd_solver}", choose from {self.SVD_SOLVERS}'
 
         self.transpose()
+        self.set_n_components()
         self.set_embedding()
         self.fit_transform()
         self.set_proportion_explained_serise()
+        self.set_loading()
 
-        return self.sample_coordinate_df, self.proportion_explained_series
+        return self.sample_coordinate_df, self.proportion_explained_series, self.loading_df
 
     def transpose(self):
-        self.sample_by_feature_df = self.feature_by_sample_df.transpose()
+        # a transposed view, the single copy is made by the embedding, which centers the data in place
+        values = self.feature_by_sample_df.to_numpy()
+        if self.settings.float32 or values.dtype == np.float32:
+            values = values.astype(np.float32, copy=False)
+        elif values.dtype != np.float64:
+            values = values.astype(np.float64)
+        self.sample_by_feature = values.T
+
+    def set_n_components(self):
+        n_samples, n_features = self.sample_by_feature.shape
+        max_n = min(n_samples, n_features)
+        if self.svd_solver == 'arpack':
+            max_n -= 1  # arpack needs strictly less
+        if self.n_components > max_n:
+            self.logger.info(f'Reduce the number of principal components from {self.n_components} to {max_n}')
+            self.n_components = max_n
 
     def set_embedding(self):
         self.embedding = decomposition.PCA(
-            n_components=self.N_COMPONENTS,
+            n_components=self.n_components,
             copy=True,
             whiten=False,
-            svd_solver='auto',
+            svd_solver=self.svd_solver,
             tol=0.0,
             iterated_power='auto',
             random_state=self.RANDOM_STATE)
 
     def fit_transform(self):
-        transformed = self.embedding.fit_transform(
-            self.sample_by_feature_df.to_numpy()
-        )
+        transformed = self.embedding.fit_transform(self.sample_by_feature)
 
         self.sample_coordinate_df = pd.DataFrame(
             data=transformed,
-            columns=self.XY_COLUMNS,
-            index=self.sample_by_feature_df.index
+            columns=self.get_columns(),
+            index=self.feature_by_sample_df.columns
         )
 
     def set_proportion_explained_serise(self):
         self.proportion_explained_series = pd.Series(self.embedding.explained_variance_ratio_)
 
+    def set_loading(self):
+        self.loading_df = pd.DataFrame(
+            data=self.embedding.components_.T,
+            columns=self.get_columns(),
+            index=self.feature_by_sample_df.index
+        )
+
+    def get_columns(self) -> List[str]:
+        return [f'PC {i + 1}' for i in range(self.n_components)]
+
+
+class BlockComputePCA(Processor):
+    """
+    PCA of a matrix that does not fit in memory, over blocks of feature rows in two passes:
+        1. sum the sample x sample Gram matrix of the centered blocks
+        2. project each block onto the eigenvectors of the Gram matrix for the loadings
+
+    Peak memory is bounded by the block size and the number of samples, not by the number of features.
+    The result is the same as the full SVD of ComputePCA, including the signs of the components
+    """
+
+    N_COMPONENTS = 2
+
+    feature_chunks: Callable[[], Iterator[pd.DataFrame]]
+    n_components: int
+
+    samples: pd.Index
+    n_features: int
+    gram: np.ndarray
+    eigenvalues: np.ndarray
+    eigenvectors: np.ndarray
+    total_variance: float
+    loadings: np.ndarray
+    features: List[str]
+    sample_coordinate_df: pd.DataFrame
+    proportion_explained_series: pd.Series
+    loading_df: pd.DataFrame
+
+    def main(
+            self,
+            feature_chunks: Callable[[], Iterator[pd.DataFrame]],
+            n_components: int = N_COMPONENTS) -> Tuple[pd.DataFrame, pd.Series, pd.DataFrame]:
+        """
+        feature_chunks: a function that returns a new iterator of blocks (feature rows x sample columns) for each pass
+        """
+        self.feature_chunks = feature_chunks
+        self.n_components = n_components
+
+        self.sum_gram_matrix()
+        self.set_n_components()
+        self.eigendecompose()
+        self.project_loadings()
+        self.flip_signs()
+        self.set_outputs()
+
+        return self.sample_coordinate_df, self.proportion_explained_series, self.loading_df
+
+    def sum_gram_matrix(self):
+        self.gram, self.n_features = None, 0
+        for chunk in self.feature_chunks():
+            block = center(chunk)
+            g = block.T @ block
+            self.gram = g if self.gram is None else self.gram + g
+            self.n_features += len(block)
+            self.samples = chunk.columns
+        self.logger.info(f'Block PCA of {self.n_features} features x {len(self.samples)} samples')
+
+    def set_n_components(self):
+        max_n = min(len(self.samples), self.n_features)
+        if self.n_components > max_n:
+            self.logger.info(f'Reduce the number of principal components from {self.n_components} to {max_n}')
+            self.n_components = max_n
+
+    def eigendecompose(self):
+        eigenvalues, eigenvectors = np.linalg.eigh(self.gram)  # ascending
+        order = np.argsort(eigenvalues)[::-1][:self.n_components]
+        self.eigenvalues = np.clip(eigenvalues[order], 0, None)  # tiny negative values of rank deficiency
+        self.eigenvectors = eigenvectors[:, order]
+        self.total_variance = np.trace(self.gram)
+
+    def project_loadings(self):
+        singular_values = np.sqrt(self.eigenvalues)
+        singular_values[singular_values == 0] = 1.  # null components have zero loadings anyway
+        projection = self.eigenvectors / singular_values
+
+        self.loadings = np.empty((self.n_features, self.n_components), dtype=np.float64)
+        self.features = []
+        for chunk in self.feature_chunks():
+            i = len(self.features)
+            self.loadings[i:i + len(chunk)] = center(chunk) @ projection
+            self.features += list(chunk.index)
+
+    def flip_signs(self):
+        # as sklearn.utils.extmath.svd_flip(u_based_decision=False): the largest loading of each component is positive
+        max_abs_rows = np.argmax(np.abs(self.loadings), axis=0)
+        signs = np.sign(self.loadings[max_abs_rows, range(self.n_components)])
+        signs[signs == 0] = 1.
+        self.loadings *= signs
+        self.eigenvectors *= signs
+
+    def set_outputs(self):
+        columns = [f'PC {i + 1}' for i in range(self.n_components)]
+        self.sample_coordinate_df = pd.DataFrame(
+            data=self.eigenvectors * np.sqrt(self.eigenvalues),
+            columns=columns,
+            index=self.samples)
+        self.proportion_explained_series = pd.Series(self.eigenvalues / self.total_variance)
+        self.loading_df = pd.DataFrame(
+            data=self.loadings,
+            columns=columns,
+            index=pd.Index(self.features))
+
+
+def center(chunk: pd.DataFrame) -> np.ndarray:
+    """
+    Feature rows centered across samples, as a new float64 array
+    """
+    block = chunk.to_numpy(dtype=np.float64, copy=True)
+    block -= block.mean(axis=1, keepdims=True)
+    return block
+
 
 class ScatterPlot(Processor):
 
+    LOCKS = [PYPLOT]
+
     sample_coordinate_df: pd.DataFrame
     x_column: str
     y_column: str
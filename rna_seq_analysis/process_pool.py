@@ -0,0 +1,49 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from .metrics import add_records, pop_records
+from .template import redirect_output
+
+
+def run_in_process_pool(
+        function: Callable[..., Any],
+        args_list: Sequence[Tuple],
+        logs: List[str],
+        n_workers: int,
+        initializer: Callable[..., Any] = None,
+        initargs: Tuple = ()):
+    """
+    Run function(*args) of each args in a pool of worker processes
+
+    The output of each job, including that of its commands, is written to its own log,
+    which is printed after all jobs are done, so that the outputs of jobs are not interleaved
+
+    function and initializer should be module-level, i.e. picklable, functions
+    """
+    # spawn, rather than fork, a fresh interpreter because the parent process has an embedded R session
+    with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=initializer,
+            initargs=initargs) as executor:
+        futures = [
+            executor.submit(run_in_worker, function, args, log)
+            for args, log in zip(args_list, logs)
+        ]
+        for f in futures:
+            add_records(f.result())
+
+    for log in logs:
+        with open(log) as fh:
+            print(fh.read(), end='', flush=True)
+
+
+def run_in_worker(
+        function: Callable[..., Any],
+        args: Tuple,
+        log: str) -> List[Dict[str, Any]]:
+
+    with open(log, 'w') as fh, redirect_output(fh):
+        function(*args)
+
+    return pop_records()  # stage metrics of the worker are reported by the parent process
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import rpy2.robjects as ro
+import rpy2.rinterface as ri
+from contextlib import contextmanager
+from rpy2.rinterface_lib import callbacks
+from typing import List, Set
+from .r_threads import GET_BLAS_THREADS_R_CODE, get_blas_threads_r_code
+
+
+# the embedded R session lives as long as the python process, so each library is attached only once
+attached_libraries: Set[str] = set()
+
+
+def attach_libraries(*names: str):
+    for name in names:
+        if name not in attached_libraries:
+            ro.r(f'suppressPackageStartupMessages(library({name}))')
+            attached_libraries.add(name)
+
+
+@contextmanager
+def redirect_r_console(log: str):
+    """
+    Write the console output of the embedded R session into a log file,
+    as "Rscript ... 1> log 2> log" does for the standalone R process.
+    """
+    print_ = callbacks.consolewrite_print
+    warnerror = callbacks.consolewrite_warnerror
+    with open(log, 'w') as fh:
+        callbacks.consolewrite_print = fh.write
+        callbacks.consolewrite_warnerror = fh.write
+        try:
+            yield
+        finally:
+            callbacks.consolewrite_print = print_
+            callbacks.consolewrite_warnerror = warnerror
+
+
+@contextmanager
+def limit_blas_threads(threads: int):
+    """
+    BLAS and OpenMP threads of the embedded R session are process-wide,
+    so the previous numbers are restored for later stages
+    """
+    previous = list(ro.r(GET_BLAS_THREADS_R_CODE))
+    ro.r(get_blas_threads_r_code(threads=threads))
+    try:
+        yield
+    finally:
+        if len(previous) == 2:
+            blas_threads, omp_threads = previous
+            ro.r(get_blas_threads_r_code(threads=int(blas_threads), omp_threads=int(omp_threads)))
+
+
+def df_to_r_integer_matrix(df: pd.DataFrame) -> ro.vectors.Matrix:
+    """
+    The count matrix is passed to R as one contiguous column-major int32 buffer,
+    which is memcpy-ed into an R integer vector without any text serialization.
+
+    Non-integer counts (e.g. estimated counts of salmon or RSEM) are not truncated silently,
+    but fail as DESeqDataSetFromMatrix() does in the Rscript engine
+    """
+    values = df.to_numpy()
+    if values.dtype.kind == 'f':
+        assert np.array_equal(values, np.round(values)), 'Counts are not integers, round them before the analysis'
+    if values.size > 0:
+        info = np.iinfo(np.int32)
+        assert info.min < values.min() and values.max() <= info.max, \
+            f'Counts out of the range of R integers: {values.min()} to {values.max()}'  # NA_integer_ is the int32 min
+    arr = np.asfortranarray(values, dtype=np.int32)
+    vector = ri.IntSexpVector.from_memoryview(memoryview(arr.reshape(-1, order='F')))
+    return set_dim_and_dimnames(
+        vector,
+        ro.IntVector(arr.shape),
+        ro.StrVector(df.index.astype(str)),
+        ro.StrVector(df.columns.astype(str)))
+
+
+def set_dim_and_dimnames(*args) -> ro.vectors.Matrix:
+    f = ro.r('function(x, d, rownames, colnames) { dim(x) <- d; dimnames(x) <- list(rownames, colnames); x }')
+    return f(*args)
+
+
+def r_matrix_to_df(matrix: ro.vectors.Matrix) -> pd.DataFrame:
+    dim = tuple(ro.r['dim'](matrix))
+    arr = np.array(matrix.memoryview(), copy=True).reshape(dim, order='F')
+    rownames, colnames = ro.r['dimnames'](matrix)
+    return pd.DataFrame(
+        data=arr,
+        index=list(rownames),
+        columns=list(colnames))
+
+
+def r_numeric_data_frame_to_df(r_df: ro.vectors.DataFrame) -> pd.DataFrame:
+    """
+    Convert an R data.frame of numeric columns column by column,
+    each column is copied directly from the R memory.
+    """
+    data = {}
+    for name, column in zip(r_df.names, r_df):
+        data[name] = np.array(column.memoryview(), copy=True)
+    return pd.DataFrame(
+        data=data,
+        index=list(ro.r['rownames'](r_df)))
+
+
+def to_r_factor(values: List) -> ro.vectors.FactorVector:
+    return ro.FactorVector(ro.StrVector([str(v) for v in values]))
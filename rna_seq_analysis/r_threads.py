@@ -0,0 +1,61 @@
+from typing import List, Optional
+
+
+# read by BLAS and OpenMP libraries when they are loaded, i.e. only at the start of an R process
+BLAS_THREADS_VARIABLES = [
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+]
+
+
+def get_blas_threads_env(threads: int) -> List[str]:
+    """
+    Environment variable assignments to prefix an Rscript command line
+    """
+    return [f'{v}={threads}' for v in BLAS_THREADS_VARIABLES]
+
+
+def get_blas_threads_r_code(threads: int, omp_threads: Optional[int] = None) -> str:
+    """
+    R code to limit BLAS threads of a running R session, e.g. the embedded one, where the environment variables are too late
+    RhpcBLASctl is optional, without it the BLAS library keeps its own setting
+    """
+    return f'''\
+if (requireNamespace('RhpcBLASctl', quietly=TRUE)) {{
+    RhpcBLASctl::blas_set_num_threads({threads})
+    RhpcBLASctl::omp_set_num_threads({threads if omp_threads is None else omp_threads})
+}}'''
+
+
+# c(BLAS threads, OpenMP threads) of the running R session, or an empty vector without RhpcBLASctl
+GET_BLAS_THREADS_R_CODE = '''\
+if (requireNamespace('RhpcBLASctl', quietly=TRUE)) {
+    c(RhpcBLASctl::blas_get_num_procs(), RhpcBLASctl::omp_get_max_threads())
+} else {
+    integer(0)
+}'''
+
+
+def get_deseq2_parallel_r_code(threads: int) -> str:
+    """
+    R code that defines "parallel" and "bpparam" for DESeq() and results()
+    Genes are split across forked BiocParallel workers, each with a single BLAS thread, so that workers x BLAS threads = threads
+    """
+    return f'''\
+library(BiocParallel)
+
+{get_blas_threads_r_code(threads=1)}
+
+parallel <- {'TRUE' if threads > 1 else 'FALSE'}
+bpparam <- MulticoreParam(workers={threads})'''
+
+
+def get_embedded_bpparam_r_code(threads: int) -> str:
+    """
+    R code of the BiocParallel backend in the embedded R session
+    MulticoreParam would fork the whole python process, with the threads of other stages and the console callbacks into python,
+    so socket workers, i.e. separate R processes, are used instead
+    """
+    return f'SnowParam(workers={threads})' if threads > 1 else 'SerialParam()'
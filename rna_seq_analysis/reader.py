@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from typing import List, Optional, Dict, Any
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.compute as pc
+except ImportError:  # fall back to the pandas C parser
+    pa = pv = pc = None
+
+
+COMPRESSION_EXTENSIONS = ['.gz', '.bz2', '.zst']
+TAB_SEPARATED_EXTENSIONS = ['.tsv', '.txt', '.tab']
+BLOCK_SIZE = 2**26  # large enough for the header line of very wide tables
+
+
+def get_sep(file: str) -> str:
+    for ext in COMPRESSION_EXTENSIONS:
+        if file.endswith(ext):
+            file = file[:-len(ext)]
+            break
+    for ext in TAB_SEPARATED_EXTENSIONS:
+        if file.endswith(ext):
+            return '\t'
+    return ','
+
+
+def read_count_table(file: str) -> pd.DataFrame:
+    """
+    Counts are parsed directly into int32, or float64 if the table has non-integer counts
+    """
+    try:
+        return read_typed(file=file, value_type='int32')
+    except ValueError:  # pyarrow.ArrowInvalid is also a ValueError
+        return read_typed(file=file, value_type='float64')
+
+
+def read_sample_info_table(file: str) -> pd.DataFrame:
+    return read_typed(file=file, value_type=None)
+
+
+def read_gene_info_table(file: str, columns: List[Optional[str]]) -> pd.DataFrame:
+    """
+    Only the given columns (None is ignored) are loaded
+    """
+    return read_typed(file=file, value_type=None, usecols=[c for c in columns if c is not None])
+
+
+def read_typed(
+        file: str,
+        value_type: Optional[str],
+        usecols: Optional[List[str]] = None) -> pd.DataFrame:
+
+    if pv is None:
+        return read_typed_by_pandas(file=file, value_type=value_type, usecols=usecols)
+
+    sep = get_sep(file)
+    header = read_header(file=file, sep=sep)
+    index_column = header[0]
+    value_columns = header[1:] if usecols is None else usecols
+
+    column_types = {index_column: pa.string()}
+    if value_type is not None:
+        column_types.update({c: pa.type_for_alias(value_type) for c in value_columns})
+
+    table = pv.read_csv(
+        file,  # compression is detected from the file extension
+        read_options=pv.ReadOptions(use_threads=True, block_size=BLOCK_SIZE),
+        parse_options=pv.ParseOptions(delimiter=sep),
+        convert_options=pv.ConvertOptions(
+            column_types=column_types,
+            include_columns=[index_column] + value_columns,
+            strings_can_be_null=True))  # empty strings are NaN, as in pd.read_csv
+
+    df = table.drop_columns([index_column]).to_pandas()
+    df.index = pd.Index(infer_index_type(table.column(index_column)).to_pandas())
+    df.index.name = index_column or None
+    return df
+
+
+def infer_index_type(column: 'pa.ChunkedArray') -> 'pa.ChunkedArray':
+    """
+    Numeric IDs (e.g. Entrez) become an int64 index, as pd.read_csv would infer,
+    so that the index matches the tables of later stages that are read by pd.read_csv
+    """
+    for type_ in [pa.int64(), pa.float64()]:
+        try:
+            return pc.cast(column, type_)
+        except pa.ArrowInvalid:
+            continue
+    return column
+
+
+def read_header(file: str, sep: str) -> List[str]:
+    reader = pv.open_csv(
+        file,
+        read_options=pv.ReadOptions(use_threads=False, block_size=BLOCK_SIZE),
+        parse_options=pv.ParseOptions(delimiter=sep))
+    return reader.schema.names
+
+
+def read_typed_by_pandas(
+        file: str,
+        value_type: Optional[str],
+        usecols: Optional[List[str]]) -> pd.DataFrame:
+
+    sep = get_sep(file)
+    header = pd.read_csv(file, sep=sep, nrows=0).columns.tolist()
+    index_column = header[0]
+
+    dtype: Dict[str, Any] = {}
+    if value_type is not None:
+        value_columns = header[1:] if usecols is None else usecols
+        dtype.update({c: np.dtype(value_type) for c in value_columns})
+
+    return pd.read_csv(
+        file,
+        sep=sep,
+        index_col=0,
+        dtype=dtype,
+        usecols=None if usecols is None else [index_column] + usecols)
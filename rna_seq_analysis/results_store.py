@@ -0,0 +1,135 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from .template import Processor
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # the store is skipped without pyarrow
+    pa = None
+    pc = None
+    pq = None
+
+
+DSTDIR_NAME = 'results-store'
+COMPARISONS_DIRNAME = 'comparisons'  # hive-partitioned dataset, i.e. comparison=<control>__vs__<experimental>/
+LONG_PARQUET = 'long.parquet'
+GENE_ID = 'gene_id'
+GENE_NAME = 'gene_name'
+COMPARISON = 'comparison'
+STATISTICS_COLUMNS = ['log2FoldChange', 'pvalue', 'padj', 'baseMean']
+ROW_GROUP_SIZE = 16384  # rows, the unit of reading for a gene lookup in the long table
+
+
+class ResultsStore(Processor):
+    """
+    Differential expression statistics of all comparisons, in Parquet files under results-store/:
+        comparisons/comparison=<c>__vs__<e>/part-0.parquet: one partition per comparison
+        long.parquet: gene x comparison rows sorted by gene ID, see lookup_genes()
+        wide-<statistic>.parquet: gene x comparison matrix of each statistic
+
+    Tables are built as Arrow columns, without converting gene IDs and names to python objects
+    Gene IDs are stored as strings, e.g. numeric IDs 1, 2 become '1', '2', and missing gene names as nulls
+    """
+
+    statistics_dfs: Dict[Tuple[str, str], pd.DataFrame]
+    gene_name_column: str
+
+    dstdir: str
+    comparisons: List[str]
+    tables: List['pa.Table']
+    long_table: 'pa.Table'
+
+    def main(
+            self,
+            statistics_dfs: Dict[Tuple[str, str], pd.DataFrame],
+            gene_name_column: str):
+
+        self.statistics_dfs = statistics_dfs
+        self.gene_name_column = gene_name_column
+
+        if pa is None:
+            self.logger.info('pyarrow is not installed, skip the Parquet results store')
+            return
+
+        self.make_dstdir()
+        self.set_tables()
+        self.write_comparison_partitions()
+        self.set_long_table()
+        self.write_long_parquet()
+        self.write_wide_parquets()
+
+    def make_dstdir(self):
+        self.dstdir = f'{self.outdir}/{DSTDIR_NAME}'
+        if os.path.exists(self.dstdir):  # partitions of comparisons of a previous run would be read as part of the dataset
+            shutil.rmtree(self.dstdir)
+        os.makedirs(self.dstdir)
+
+    def set_tables(self):
+        self.comparisons = [f'{c}__vs__{e}' for c, e in self.statistics_dfs.keys()]
+        self.tables = []
+        for statistics_df in self.statistics_dfs.values():
+            columns = {
+                GENE_ID: pa.array(statistics_df.index.astype(str).array, type=pa.string()),
+                GENE_NAME: pa.array(statistics_df[self.gene_name_column].to_numpy(dtype=object), type=pa.string(), from_pandas=True),
+            }
+            for column in STATISTICS_COLUMNS:
+                columns[column] = pa.array(statistics_df[column].to_numpy(dtype=np.float64))
+            self.tables.append(pa.table(columns))
+
+    def write_comparison_partitions(self):
+        for comparison, table in zip(self.comparisons, self.tables):
+            d = f'{self.dstdir}/{COMPARISONS_DIRNAME}/{COMPARISON}={comparison}'
+            os.makedirs(d)
+            pq.write_table(table, f'{d}/part-0.parquet')
+
+    def set_long_table(self):
+        tables = []
+        for i, table in enumerate(self.tables):
+            indices = pa.array(np.full(len(table), i, dtype=np.int32))
+            comparison = pa.DictionaryArray.from_arrays(indices, pa.array(self.comparisons))
+            tables.append(table.add_column(2, COMPARISON, comparison))
+        # the sort is stable, so the comparisons of each gene stay in the order of comparisons
+        self.long_table = pa.concat_tables(tables).sort_by([(GENE_ID, 'ascending')])
+
+    def write_long_parquet(self):
+        """
+        Sorted by gene ID, so that the min/max statistics of each row group locate a gene without scanning the table
+        """
+        pq.write_table(self.long_table, f'{self.dstdir}/{LONG_PARQUET}', row_group_size=ROW_GROUP_SIZE)
+        self.logger.info(f'Results store of {len(self.comparisons)} comparisons, {len(self.long_table)} rows: {self.dstdir}')
+
+    def write_wide_parquets(self):
+        gene_ids = self.long_table.column(GENE_ID).combine_chunks()
+        is_new_gene = np.ones(len(gene_ids), dtype=bool)
+        is_new_gene[1:] = pc.not_equal(gene_ids[1:], gene_ids[:-1]).to_numpy(zero_copy_only=False)
+        rows = np.cumsum(is_new_gene) - 1
+        columns = self.long_table.column(COMPARISON).combine_chunks().indices.to_numpy()
+        genes = pd.Index(gene_ids.filter(pa.array(is_new_gene)).to_pandas(), name=GENE_ID)
+
+        for statistic in STATISTICS_COLUMNS:
+            matrix = np.full((len(genes), len(self.comparisons)), np.nan)
+            matrix[rows, columns] = self.long_table.column(statistic).to_numpy()
+            wide_df = pd.DataFrame(data=matrix, index=genes, columns=self.comparisons)
+            pq.write_table(pa.Table.from_pandas(wide_df, preserve_index=True), f'{self.dstdir}/wide-{statistic}.parquet')
+
+
+def lookup_genes(
+        store_dir: str,
+        gene_ids: List[str],
+        columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Rows of the genes in all comparisons from the long table of a results store,
+    only the row groups that may contain the genes are read
+
+    Gene IDs are stored as strings, so gene_ids are matched as strings and the returned gene_id column is of strings,
+    even if the gene IDs of the count table are numeric
+    """
+    table = pq.read_table(
+        f'{store_dir}/{LONG_PARQUET}',
+        columns=columns,
+        filters=[(GENE_ID, 'in', [str(g) for g in gene_ids])])
+    return table.to_pandas()
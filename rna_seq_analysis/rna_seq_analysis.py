@@ -2,17 +2,25 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 from copy import copy
+from functools import partial
 from itertools import combinations
 from matplotlib.colors import to_rgba
-from typing import Optional, List, Tuple
-from .tpm import TPM
-from .gsea import GSEA
+from typing import Optional, List, Tuple, Dict, Any
+from .tpm import TPM, StreamingTPM, iter_row_chunks
+from .gsea import GSEA, GSEA_OUTDIR_NAME
 from .pca import PCA
-from .deseq2 import DESeq2
+from .sample_distance import SampleDistance, DSTDIR_NAME as SAMPLE_DISTANCE_DSTDIR_NAME
+from .deseq2 import DESeq2, DESeq2MultiContrast
+from .results_store import ResultsStore
+from .threshold_sweep import ThresholdSweep
 from .tools import get_files
+from .cache import StageCache
+from .process_pool import run_in_process_pool
 from .heatmap import Heatmap
-from .template import Processor
-from .batch_correction import BatchCorrection
+from .scheduler import Scheduler, Task
+from .reader import read_count_table, read_sample_info_table, read_gene_info_table
+from .template import Processor, get_comparison_settings
+from .batch_correction import BatchCorrection, BATCH_CORRECTED_CSV
 from .cluster_profiler import ClusterProfiler
 
 
@@ -26,11 +34,22 @@ class RNASeqAnalysis(Processor):
     gene_name_column: str
     gene_description_column: Optional[str]
     heatmap_read_fraction: float
+    heatmap_linkage_method: str
+    heatmap_max_rows: int
+    heatmap_formats: List[str]
+    heatmap_rasterize: bool
+    top_variable_genes: int
     sample_group_column: str
     control_group_name: Optional[str]
     experimental_group_name: Optional[str]
     sample_batch_column: Optional[str]
     skip_differential_analysis: bool
+    parallel_comparisons: bool
+    tpm_chunk_rows: int
+    pca_n_components: int
+    pca_svd_solver: str
+    pca_block_rows: int
+    sample_distance_metrics: Optional[List[str]]
     volcano_plot_label_genes: Optional[List[str]]
     gsea_input: str
     gsea_gene_name_keywords: Optional[List[str]]
@@ -40,6 +59,10 @@ class RNASeqAnalysis(Processor):
     gene_q_threshold: float
     pathway_p_threshold: float
     pathway_q_threshold: float
+    sweep_gene_p_thresholds: Optional[List[float]]
+    sweep_gene_q_thresholds: Optional[List[float]]
+    sweep_pathway_p_thresholds: Optional[List[float]]
+    sweep_pathway_q_thresholds: Optional[List[float]]
     organism: str
     enrichment_pathway_keywords: Optional[List[str]]
     show_n_pathways: int
@@ -53,7 +76,7 @@ class RNASeqAnalysis(Processor):
 
     tpm_df: pd.DataFrame
     deseq2_normalized_count_df: Optional[pd.DataFrame]
-    deseq2_statistics_df: Optional[pd.DataFrame]
+    deseq2_statistics_dfs: Optional[Dict[Tuple[str, str], pd.DataFrame]]
 
     def main(
             self,
@@ -65,11 +88,22 @@ class RNASeqAnalysis(Processor):
             gene_name_column: str,
             gene_description_column: Optional[str],
             heatmap_read_fraction: float,
+            heatmap_linkage_method: str,
+            heatmap_max_rows: int,
+            heatmap_formats: List[str],
+            heatmap_rasterize: bool,
+            top_variable_genes: int,
             sample_group_column: str,
             control_group_name: Optional[str],
             experimental_group_name: Optional[str],
             sample_batch_column: Optional[str],
             skip_differential_analysis: bool,
+            parallel_comparisons: bool,
+            tpm_chunk_rows: int,
+            pca_n_components: int,
+            pca_svd_solver: str,
+            pca_block_rows: int,
+            sample_distance_metrics: Optional[List[str]],
             volcano_plot_label_genes: Optional[List[str]],
             gsea_input: str,
             gsea_gene_name_keywords: Optional[List[str]],
@@ -79,6 +113,10 @@ class RNASeqAnalysis(Processor):
             gene_q_threshold: float,
             pathway_p_threshold: float,
             pathway_q_threshold: float,
+            sweep_gene_p_thresholds: Optional[List[float]],
+            sweep_gene_q_thresholds: Optional[List[float]],
+            sweep_pathway_p_thresholds: Optional[List[float]],
+            sweep_pathway_q_thresholds: Optional[List[float]],
             organism: str,
             enrichment_pathway_keywords: Optional[List[str]],
             show_n_pathways: int,
@@ -93,11 +131,22 @@ class RNASeqAnalysis(Processor):
         self.gene_name_column = gene_name_column
         self.gene_description_column = gene_description_column
         self.heatmap_read_fraction = heatmap_read_fraction
+        self.heatmap_linkage_method = heatmap_linkage_method
+        self.heatmap_max_rows = heatmap_max_rows
+        self.heatmap_formats = heatmap_formats
+        self.heatmap_rasterize = heatmap_rasterize
+        self.top_variable_genes = top_variable_genes
         self.sample_group_column = sample_group_column
         self.control_group_name = control_group_name
         self.experimental_group_name = experimental_group_name
         self.sample_batch_column = sample_batch_column
         self.skip_differential_analysis = skip_differential_analysis
+        self.parallel_comparisons = parallel_comparisons
+        self.tpm_chunk_rows = tpm_chunk_rows
+        self.pca_n_components = pca_n_components
+        self.pca_svd_solver = pca_svd_solver
+        self.pca_block_rows = pca_block_rows
+        self.sample_distance_metrics = sample_distance_metrics
         self.volcano_plot_label_genes = volcano_plot_label_genes
         self.gsea_input = gsea_input
         self.gsea_gene_name_keywords = gsea_gene_name_keywords
@@ -107,6 +156,10 @@ class RNASeqAnalysis(Processor):
         self.gene_q_threshold = gene_q_threshold
         self.pathway_p_threshold = pathway_p_threshold
         self.pathway_q_threshold = pathway_q_threshold
+        self.sweep_gene_p_thresholds = sweep_gene_p_thresholds
+        self.sweep_gene_q_thresholds = sweep_gene_q_thresholds
+        self.sweep_pathway_p_thresholds = sweep_pathway_p_thresholds
+        self.sweep_pathway_q_thresholds = sweep_pathway_q_thresholds
         self.organism = organism
         self.enrichment_pathway_keywords = enrichment_pathway_keywords
         self.show_n_pathways = show_n_pathways
@@ -114,14 +167,15 @@ class RNASeqAnalysis(Processor):
         self.invert_colors = invert_colors
 
         self.preprocessing()
-        self.differential_analysis()
-        self.heatmap_and_pca_for_deseq2()
+        Scheduler(self.settings).main(tasks=self.get_tasks())
         CleanUp(self.settings).main()
 
     def preprocessing(self):
-        self.count_df = read(self.count_table)
-        self.sample_info_df = read(self.sample_info_table)
-        self.gene_info_df = read(self.gene_info_table)
+        self.count_df = read_count_table(self.count_table)
+        self.sample_info_df = read_sample_info_table(self.sample_info_table)
+        self.gene_info_df = read_gene_info_table(
+            self.gene_info_table,
+            columns=[self.gene_length_column, self.gene_name_column, self.gene_description_column])
 
         for df in [self.count_df, self.sample_info_df, self.gene_info_df]:
             df.index.name = None  # make all final output files clean without index names
@@ -130,6 +184,10 @@ class RNASeqAnalysis(Processor):
             count_df=self.count_df,
             sample_info_df=self.sample_info_df)
 
+        self.gene_info_df = AlignGeneInfo(self.settings).main(
+            gene_info_df=self.gene_info_df,
+            count_df=self.count_df)
+
         self.colors = GetColors(self.settings).main(
             sample_info_df=self.sample_info_df,
             sample_group_column=self.sample_group_column,
@@ -137,73 +195,228 @@ class RNASeqAnalysis(Processor):
             invert_colors=self.invert_colors)
 
         if self.sample_batch_column is not None:
-            self.count_df = BatchCorrection(self.settings).main(
+            self.count_df = StageCache(self.settings).run(
+                processor=BatchCorrection(self.settings),
+                outputs=[BATCH_CORRECTED_CSV, 'combat-seq.log'],
                 count_df=self.count_df,
                 sample_info_df=self.sample_info_df,
                 sample_batch_column=self.sample_batch_column)
 
-        self.tpm_df = TPM(self.settings).main(
+    def get_tasks(self) -> List[Task]:
+        """
+        Stages as a DAG, e.g. the TPM heatmap and PCA do not wait for DESeq2,
+        and ClusterProfiler and GSEA of each comparison run concurrently
+        """
+        tasks = [
+            Task(name='tpm', function=self.tpm),
+            Task(name='heatmap-tpm', function=self.heatmap_tpm, dependencies=['tpm']),
+            Task(name='pca-tpm', function=self.pca_tpm, dependencies=['tpm']),
+        ]
+
+        if self.sample_distance_metrics is not None:
+            tasks.append(Task(name='sample-distance-tpm', function=self.sample_distance_tpm, dependencies=['tpm']))
+
+        self.deseq2_normalized_count_df = None
+        self.deseq2_statistics_dfs = None
+        if self.skip_differential_analysis:
+            return tasks
+
+        comparisons = self.get_comparisons()
+        tasks += [
+            Task(name='deseq2', function=partial(self.deseq2, comparisons=comparisons)),
+            Task(name='heatmap-deseq2', function=self.heatmap_deseq2, dependencies=['deseq2']),
+            Task(name='pca-deseq2', function=self.pca_deseq2, dependencies=['deseq2']),
+            Task(name='results-store', function=self.results_store, dependencies=['deseq2']),
+        ]
+        if self.sample_distance_metrics is not None:
+            tasks.append(Task(name='sample-distance-deseq2', function=self.sample_distance_deseq2, dependencies=['deseq2']))
+
+        gsea_dependencies = ['tpm'] if self.gsea_input == 'tpm' else ['deseq2']
+
+        if self.parallel_comparisons and self.threads > 1 and len(comparisons) > 1:
+            tasks.append(Task(
+                name='comparisons',
+                function=partial(self.compare_in_process_pool, comparisons=comparisons),
+                dependencies=['deseq2', 'tpm']))
+        else:
+            for c, e in comparisons:
+                tasks.append(Task(
+                    name=f'cluster-profiler {c} vs {e}',
+                    function=partial(self.cluster_profiler, control_group_name=c, experimental_group_name=e),
+                    dependencies=['deseq2']))
+                tasks.append(Task(
+                    name=f'gsea {c} vs {e}',
+                    function=partial(self.gsea, control_group_name=c, experimental_group_name=e),
+                    dependencies=gsea_dependencies))
+
+        if self.is_threshold_sweep():
+            # after all other tasks, so that the worker processes of the sweep have all threads
+            tasks.append(Task(
+                name='threshold-sweep',
+                function=self.threshold_sweep,
+                dependencies=[t.name for t in tasks]))
+
+        return tasks
+
+    def tpm(self):
+        if self.tpm_chunk_rows > 0:
+            # chunks are views of the loaded count matrix, and the TPM matrix is written to disk and memory-mapped,
+            # so the stage allocates memory of one chunk rather than a float copy of the whole matrix
+            self.tpm_df = StreamingTPM(self.settings).main(
+                count_chunks=partial(iter_row_chunks, df=self.count_df, chunk_rows=self.tpm_chunk_rows),
+                gene_info_df=self.gene_info_df,
+                gene_length_column=self.gene_length_column)
+            return
+
+        self.tpm_df = StageCache(self.settings).run(
+            processor=TPM(self.settings),
+            outputs=['tpm.csv'],
+            key_settings=['float32'],
             count_df=self.count_df,
             gene_info_df=self.gene_info_df,
             gene_length_column=self.gene_length_column)
-        
+
+    def heatmap_tpm(self):
         Heatmap(self.settings).main(
             feature_by_sample_df=self.tpm_df,
             heatmap_read_fraction=self.heatmap_read_fraction,
+            linkage_method=self.heatmap_linkage_method,
+            max_rows=self.heatmap_max_rows,
+            formats=self.heatmap_formats,
+            rasterize=self.heatmap_rasterize,
+            top_variable_genes=self.top_variable_genes,
             fname='heatmap-tpm')
 
+    def pca_tpm(self):
         PCA(self.settings).main(
             feature_by_sample_df=self.tpm_df,
             sample_info_df=self.sample_info_df,
             sample_group_column=self.sample_group_column,
             colors=self.colors,
-            fname='pca-tpm')
-
-    def differential_analysis(self):
-        if self.skip_differential_analysis:
-            self.deseq2_normalized_count_df = None
-            self.deseq2_statistics_df = None
-            return
+            fname='pca-tpm',
+            n_components=self.pca_n_components,
+            svd_solver=self.pca_svd_solver,
+            block_rows=self.pca_block_rows,
+            top_variable_genes=self.top_variable_genes)
+
+    def sample_distance_tpm(self):
+        self.sample_distance(
+            feature_by_sample_df=self.tpm_df,
+            fname='sample-distance-tpm')
 
+    def get_comparisons(self) -> List[Tuple[str, str]]:
         if self.control_group_name is None or self.experimental_group_name is None:
             comparisons = list(combinations(self.sample_info_df[self.sample_group_column].unique(), 2))
         else:
             comparisons = [(self.control_group_name, self.experimental_group_name)]
-        
+
         msg = f'Running differential expression analysis for {len(comparisons)} comparisons:'
         for control, experimental in comparisons:
             msg += f'\n  "{control}" vs "{experimental}"'
         self.logger.info(msg)
 
-        for control, experimental in comparisons:
-            self.compare(control_group_name=control, experimental_group_name=experimental)
-
-    def compare(self, control_group_name: str, experimental_group_name: str):
-        self.logger.info(f'Running differential expression analysis for "{control_group_name}" vs "{experimental_group_name}"')
-
-        c, e = control_group_name, experimental_group_name
-        new_settings = copy(self.settings)
-        new_settings.outdir = f'{self.settings.outdir}/{c}__vs__{e}'
-        new_settings.workdir = f'{self.settings.workdir}/{c}__vs__{e}'
-        for d in [new_settings.workdir, new_settings.outdir]:
-            os.makedirs(d, exist_ok=True)
+        return comparisons
 
-        self.deseq2_normalized_count_df, self.deseq2_statistics_df = DESeq2(new_settings).main(
-            count_df=self.count_df,
+    def deseq2(self, comparisons: List[Tuple[str, str]]):
+        if len(comparisons) == 1:
+            c, e = comparisons[0]
+            self.deseq2_normalized_count_df, statistics_df = DESeq2(get_comparison_settings(
+                settings=self.settings,
+                control_group_name=c,
+                experimental_group_name=e
+            )).main(
+                count_df=self.count_df,
+                sample_info_df=self.sample_info_df,
+                sample_group_column=self.sample_group_column,
+                control_group_name=c,
+                experimental_group_name=e,
+                gene_info_df=self.gene_info_df,
+                gene_name_column=self.gene_name_column,
+                gene_description_column=self.gene_description_column,
+                volcano_plot_label_genes=self.volcano_plot_label_genes,
+                gene_p_threshold=self.gene_p_threshold,
+                gene_q_threshold=self.gene_q_threshold,
+                colors=self.colors)
+            self.deseq2_statistics_dfs = {(c, e): statistics_df}
+
+        else:  # fit only once for all comparisons
+            self.deseq2_normalized_count_df, self.deseq2_statistics_dfs = DESeq2MultiContrast(self.settings).main(
+                count_df=self.count_df,
+                sample_info_df=self.sample_info_df,
+                sample_group_column=self.sample_group_column,
+                comparisons=comparisons,
+                gene_info_df=self.gene_info_df,
+                gene_name_column=self.gene_name_column,
+                gene_description_column=self.gene_description_column,
+                volcano_plot_label_genes=self.volcano_plot_label_genes,
+                gene_p_threshold=self.gene_p_threshold,
+                gene_q_threshold=self.gene_q_threshold,
+                colors=self.colors)
+
+    def results_store(self):
+        ResultsStore(self.settings).main(
+            statistics_dfs=self.deseq2_statistics_dfs,
+            gene_name_column=self.gene_name_column)
+
+    def is_threshold_sweep(self) -> bool:
+        sweeps = [
+            self.sweep_gene_p_thresholds,
+            self.sweep_gene_q_thresholds,
+            self.sweep_pathway_p_thresholds,
+            self.sweep_pathway_q_thresholds,
+        ]
+        return any(s is not None for s in sweeps)
+
+    def threshold_sweep(self):
+        # thresholds that are not swept keep their single value
+        ThresholdSweep(self.settings).main(
+            statistics_dfs=self.deseq2_statistics_dfs,
             sample_info_df=self.sample_info_df,
             sample_group_column=self.sample_group_column,
-            control_group_name=c,
-            experimental_group_name=e,
-            gene_info_df=self.gene_info_df,
+            colors=self.colors,
             gene_name_column=self.gene_name_column,
-            gene_description_column=self.gene_description_column,
             volcano_plot_label_genes=self.volcano_plot_label_genes,
-            gene_p_threshold=self.gene_p_threshold,
-            gene_q_threshold=self.gene_q_threshold,
-            colors=self.colors)
-    
+            gene_p_thresholds=self.sweep_gene_p_thresholds or [self.gene_p_threshold],
+            gene_q_thresholds=self.sweep_gene_q_thresholds or [self.gene_q_threshold],
+            pathway_p_thresholds=self.sweep_pathway_p_thresholds or [self.pathway_p_threshold],
+            pathway_q_thresholds=self.sweep_pathway_q_thresholds or [self.pathway_q_threshold],
+            organism=self.organism,
+            enrichment_pathway_keywords=self.enrichment_pathway_keywords,
+            show_n_pathways=self.show_n_pathways)
+
+    def compare_in_process_pool(self, comparisons: List[Tuple[str, str]]):
+        n_workers = min(self.threads, len(comparisons))
+        self.logger.info(f'Running {len(comparisons)} comparisons in {n_workers} worker processes')
+
+        # the threads are shared among workers, so that the total does not exceed --threads
+        worker_settings = copy(self.settings)
+        worker_settings.threads = max(1, self.threads // n_workers)
+        worker = copy(self)
+        worker.settings = worker_settings
+        worker.threads = worker_settings.threads
+
+        run_in_process_pool(
+            function=compare_in_worker,
+            args_list=comparisons,
+            logs=[f'{self.workdir}/{c}__vs__{e}.log' for c, e in comparisons],
+            n_workers=n_workers,
+            initializer=init_comparison_worker,
+            initargs=(worker,))
+
+    def compare(self, control_group_name: str, experimental_group_name: str):
+        self.logger.info(f'Running pathway analysis for "{control_group_name}" vs "{experimental_group_name}"')
+        self.cluster_profiler(control_group_name=control_group_name, experimental_group_name=experimental_group_name)
+        self.gsea(control_group_name=control_group_name, experimental_group_name=experimental_group_name)
+
+    def cluster_profiler(self, control_group_name: str, experimental_group_name: str):
+        c, e = control_group_name, experimental_group_name
+        new_settings = get_comparison_settings(
+            settings=self.settings,
+            control_group_name=c,
+            experimental_group_name=e)
+
         ClusterProfiler(new_settings).main(
-            statistics_df=self.deseq2_statistics_df,
+            statistics_df=self.deseq2_statistics_dfs[(c, e)],
             organism=self.organism,
             control_group_name=c,
             experimental_group_name=e,
@@ -213,36 +426,82 @@ class RNASeqAnalysis(Processor):
             pathway_q_threshold=self.pathway_q_threshold,
             enrichment_pathway_keywords=self.enrichment_pathway_keywords,
             show_n_pathways=self.show_n_pathways)
-        
-        if self.gene_sets_gmt is not None:
-            GSEA(new_settings).main(
-                count_df=self.tpm_df if self.gsea_input == 'tpm' else self.deseq2_normalized_count_df,
-                gene_info_df=self.gene_info_df,
-                sample_info_df=self.sample_info_df,
-                gene_name_column=self.gene_name_column,
-                sample_group_column=self.sample_group_column,
-                control_group_name=c,
-                experimental_group_name=e,
-                gene_sets_gmt=self.gene_sets_gmt,
-                gene_name_keywords=self.gsea_gene_name_keywords,
-                gene_set_name_keywords=self.gsea_gene_set_name_keywords,
-                top_n_plots=self.gsea_top_n_plots)
 
-    def heatmap_and_pca_for_deseq2(self):
-        if self.deseq2_normalized_count_df is None:
+    def gsea(self, control_group_name: str, experimental_group_name: str):
+        if self.gene_sets_gmt is None:
             return
 
+        c, e = control_group_name, experimental_group_name
+        new_settings = get_comparison_settings(
+            settings=self.settings,
+            control_group_name=c,
+            experimental_group_name=e)
+
+        StageCache(new_settings).run(
+            processor=GSEA(new_settings),
+            outputs=[GSEA_OUTDIR_NAME, 'gsea.log'],
+            key_files=['gene_sets_gmt'],
+            count_df=self.tpm_df if self.gsea_input == 'tpm' else self.deseq2_normalized_count_df,
+            gene_info_df=self.gene_info_df,
+            sample_info_df=self.sample_info_df,
+            gene_name_column=self.gene_name_column,
+            sample_group_column=self.sample_group_column,
+            control_group_name=c,
+            experimental_group_name=e,
+            gene_sets_gmt=self.gene_sets_gmt,
+            gene_name_keywords=self.gsea_gene_name_keywords,
+            gene_set_name_keywords=self.gsea_gene_set_name_keywords,
+            top_n_plots=self.gsea_top_n_plots)
+
+    def heatmap_deseq2(self):
         Heatmap(self.settings).main(
             feature_by_sample_df=self.deseq2_normalized_count_df,
             heatmap_read_fraction=self.heatmap_read_fraction,
+            linkage_method=self.heatmap_linkage_method,
+            max_rows=self.heatmap_max_rows,
+            formats=self.heatmap_formats,
+            rasterize=self.heatmap_rasterize,
+            top_variable_genes=self.top_variable_genes,
             fname='heatmap-deseq2')
 
+    def pca_deseq2(self):
         PCA(self.settings).main(
             feature_by_sample_df=self.deseq2_normalized_count_df,
             sample_info_df=self.sample_info_df,
             sample_group_column=self.sample_group_column,
             colors=self.colors,
-            fname='pca-deseq2')
+            fname='pca-deseq2',
+            n_components=self.pca_n_components,
+            svd_solver=self.pca_svd_solver,
+            block_rows=self.pca_block_rows,
+            top_variable_genes=self.top_variable_genes)
+
+    def sample_distance_deseq2(self):
+        self.sample_distance(
+            feature_by_sample_df=self.deseq2_normalized_count_df,
+            fname='sample-distance-deseq2')
+
+    def sample_distance(self, feature_by_sample_df: pd.DataFrame, fname: str):
+        StageCache(self.settings).run(
+            processor=SampleDistance(self.settings),
+            outputs=[f'{SAMPLE_DISTANCE_DSTDIR_NAME}/{fname}-{m}.csv' for m in self.sample_distance_metrics],
+            feature_by_sample_df=feature_by_sample_df,
+            fname=fname,
+            metrics=self.sample_distance_metrics)
+
+
+comparison_worker: Optional[RNASeqAnalysis] = None
+
+
+def init_comparison_worker(analysis: RNASeqAnalysis):
+    global comparison_worker
+    comparison_worker = analysis
+
+
+def compare_in_worker(control_group_name: str, experimental_group_name: str):
+    comparison_worker.compare(
+        control_group_name=control_group_name,
+        experimental_group_name=experimental_group_name)
 
 
 class SubsetSamples(Processor):
@@ -255,17 +514,40 @@ class SubsetSamples(Processor):
             count_df: pd.DataFrame,
             sample_info_df: pd.DataFrame) -> pd.DataFrame:
 
-        self.count_df = count_df.copy()
-        self.sample_info_df = sample_info_df.copy()
+        self.count_df = count_df
+        self.sample_info_df = sample_info_df
 
         for sample_id in self.sample_info_df.index:
             assert sample_id in self.count_df.columns, f'"{sample_id}" not in count_df.columns'
 
-        self.count_df = self.count_df[self.sample_info_df.index]
+        if not self.count_df.columns.equals(self.sample_info_df.index):
+            self.count_df = self.count_df[self.sample_info_df.index]
 
         return self.count_df
 
 
+class AlignGeneInfo(Processor):
+    """
+    Gene info reindexed once to the genes of the count matrix, i.e. row i of gene info is gene i of the counts,
+    so that the reindex of gene info by stages (e.g. TPM, DESeq2) is a no-op
+    """
+
+    gene_info_df: pd.DataFrame
+    count_df: pd.DataFrame
+
+    def main(
+            self,
+            gene_info_df: pd.DataFrame,
+            count_df: pd.DataFrame) -> pd.DataFrame:
+
+        self.gene_info_df = gene_info_df
+        self.count_df = count_df
+
+        # the first row of a duplicated gene ID is used, genes without info become NaN rows
+        unique_gene_info_df = self.gene_info_df[~self.gene_info_df.index.duplicated(keep='first')]
+        return unique_gene_info_df.reindex(self.count_df.index)
+
+
 class GetColors(Processor):
 
     sample_info_df: pd.DataFrame
@@ -325,11 +607,3 @@ class CleanUp(Processor):
         if not self.debug:
             self.call(f'rm -r {self.workdir}')
 
-
-def read(file: str) -> pd.DataFrame:
-    sep = ','
-    for ext in ['.tsv', '.txt', '.tab']:
-        if file.endswith(ext):
-            sep = '\t'
-            break
-    return pd.read_csv(file, sep=sep, index_col=0)
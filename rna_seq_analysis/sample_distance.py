@@ -0,0 +1,161 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import stats
+from typing import Dict, List, Optional
+from .template import Processor
+from .tpm import iter_row_chunks
+
+
+PEARSON = 'pearson'
+SPEARMAN = 'spearman'
+EUCLIDEAN = 'euclidean'
+POISSON = 'poisson'
+METRICS = [PEARSON, SPEARMAN, EUCLIDEAN, POISSON]
+DSTDIR_NAME = 'sample-distance'
+
+
+class SampleDistance(Processor):
+    """
+    Correlation and distance matrices between samples, from sample x sample Gram matrices,
+    which are summed over blocks of gene rows with BLAS matrix products, so memory is bounded by MEMORY_BUDGET_MB
+
+        pearson: correlation of log2(x + 1)
+        spearman: pearson correlation of the ranks of genes in each sample
+        euclidean: distance of log2(x + 1)
+        poisson: euclidean distance of the Anscombe transform 2 * sqrt(x + 3/8), which stabilizes the variance of counts
+    """
+
+    MEMORY_BUDGET_MB = 512
+    BUFFERS = 3  # full-width float64 buffers per block, i.e. the block and its transforms
+    RANKS_NPY = 'ranks.npy'
+
+    feature_by_sample_df: pd.DataFrame
+    fname: str
+    metrics: List[str]
+
+    n_genes: int
+    n_samples: int
+    block_rows: int
+    grams: Dict[str, np.ndarray]
+    column_sums: Dict[str, np.ndarray]
+    distance_dfs: Dict[str, pd.DataFrame]
+
+    def main(
+            self,
+            feature_by_sample_df: pd.DataFrame,
+            fname: str,
+            metrics: Optional[List[str]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        metrics: default METRICS
+
+        Returns:
+            metric -> sample x sample matrix
+        """
+        self.feature_by_sample_df = feature_by_sample_df
+        self.fname = fname
+        self.metrics = METRICS if metrics is None else metrics
+
+        for m in self.metrics:
+            assert m in METRICS, f'Unknown sample distance metric "{m}", choose from {METRICS}'
+
+        self.set_block_rows()
+        self.sum_gram_matrices()
+        self.sum_rank_gram_matrix()
+        self.set_distance_dfs()
+        self.make_dstdir()
+        self.write_csvs()
+
+        return self.distance_dfs
+
+    def set_block_rows(self):
+        self.n_genes, self.n_samples = self.feature_by_sample_df.shape
+        budget = self.MEMORY_BUDGET_MB * 2**20
+        self.block_rows = max(1, min(self.n_genes, int(budget / (self.n_samples * 8 * self.BUFFERS))))
+        self.logger.info(f'Sample distance "{self.fname}" of {self.n_samples} samples, in blocks of {self.block_rows} genes')
+
+    def sum_gram_matrices(self):
+        """
+        Euclidean distances do not change by subtracting the mean of each gene,
+        which is subtracted to avoid the cancellation error of the norms in the distance from the Gram matrix
+        """
+        self.grams, self.column_sums = {}, {}
+        for chunk in iter_row_chunks(df=self.feature_by_sample_df, chunk_rows=self.block_rows):
+            block = chunk.to_numpy(dtype=np.float64)
+            if PEARSON in self.metrics or EUCLIDEAN in self.metrics:
+                log_block = np.log2(block + 1.)
+                if PEARSON in self.metrics:
+                    self.add(PEARSON, log_block, column_sums=True)
+                if EUCLIDEAN in self.metrics:
+                    log_block -= log_block.mean(axis=1, keepdims=True)
+                    self.add(EUCLIDEAN, log_block)
+                del log_block
+            if POISSON in self.metrics:
+                anscombe_block = 2. * np.sqrt(block + 3. / 8.)
+                anscombe_block -= anscombe_block.mean(axis=1, keepdims=True)
+                self.add(POISSON, anscombe_block)
+
+    def sum_rank_gram_matrix(self):
+        """
+        Ranking needs whole sample columns, so blocks of samples are ranked into a memory-mapped matrix under workdir,
+        which is then read in blocks of genes as for the other metrics
+        """
+        if SPEARMAN not in self.metrics:
+            return
+
+        npy = f'{self.workdir}/{self.fname}-{self.RANKS_NPY}'
+        ranks = np.lib.format.open_memmap(npy, mode='w+', dtype=np.float32, shape=(self.n_genes, self.n_samples))
+        block_columns = max(1, int(self.MEMORY_BUDGET_MB * 2**20 / (self.n_genes * 8 * self.BUFFERS)))
+        for j in range(0, self.n_samples, block_columns):
+            columns = self.feature_by_sample_df.iloc[:, j:j + block_columns].to_numpy(dtype=np.float64)
+            ranks[:, j:j + block_columns] = stats.rankdata(columns, axis=0)  # ties are averaged, exact in float32
+
+        for i in range(0, self.n_genes, self.block_rows):
+            self.add(SPEARMAN, ranks[i:i + self.block_rows].astype(np.float64), column_sums=True)
+
+        del ranks
+        os.remove(npy)
+
+    def add(self, metric: str, block: np.ndarray, column_sums: bool = False):
+        gram = block.T @ block
+        self.grams[metric] = gram if metric not in self.grams else self.grams[metric] + gram
+        if column_sums:
+            s = block.sum(axis=0)
+            self.column_sums[metric] = s if metric not in self.column_sums else self.column_sums[metric] + s
+
+    def set_distance_dfs(self):
+        self.distance_dfs = {}
+        for metric in self.metrics:
+            if metric in [PEARSON, SPEARMAN]:
+                data = correlation_from_gram(gram=self.grams[metric], column_sums=self.column_sums[metric], n=self.n_genes)
+            else:
+                data = distance_from_gram(gram=self.grams[metric])
+            self.distance_dfs[metric] = pd.DataFrame(
+                data=data,
+                index=self.feature_by_sample_df.columns,
+                columns=self.feature_by_sample_df.columns)
+
+    def make_dstdir(self):
+        os.makedirs(f'{self.outdir}/{DSTDIR_NAME}', exist_ok=True)
+
+    def write_csvs(self):
+        for metric, df in self.distance_dfs.items():
+            df.to_csv(f'{self.outdir}/{DSTDIR_NAME}/{self.fname}-{metric}.csv')
+
+
+def correlation_from_gram(gram: np.ndarray, column_sums: np.ndarray, n: int) -> np.ndarray:
+    covariance = gram - np.outer(column_sums, column_sums) / n
+    sd = np.sqrt(np.clip(np.diag(covariance), 0, None))
+    with np.errstate(divide='ignore', invalid='ignore'):  # nan for constant samples, as np.corrcoef
+        correlation = covariance / np.outer(sd, sd)
+    np.clip(correlation, -1., 1., out=correlation)
+    np.fill_diagonal(correlation, 1.)
+    return correlation
+
+
+def distance_from_gram(gram: np.ndarray) -> np.ndarray:
+    norms = np.diag(gram)
+    squared = norms[:, np.newaxis] + norms[np.newaxis, :] - 2. * gram
+    np.clip(squared, 0, None, out=squared)
+    np.fill_diagonal(squared, 0.)
+    return np.sqrt(squared)
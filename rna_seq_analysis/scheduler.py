@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional
+from . import metrics
+from .template import Processor
+
+
+class Task:
+
+    name: str
+    function: Callable[[], Any]
+    dependencies: List[str]
+
+    def __init__(
+            self,
+            name: str,
+            function: Callable[[], Any],
+            dependencies: Optional[List[str]] = None):
+        self.name = name
+        self.function = function
+        self.dependencies = [] if dependencies is None else dependencies
+
+
+class Scheduler(Processor):
+    """
+    Run a DAG of tasks in a thread pool of settings.threads workers,
+    each task starts as soon as all of its dependencies are done
+
+    Tasks using shared resources, e.g. pyplot or the embedded R session,
+    are serialized by the LOCKS of their stages
+    """
+
+    tasks: Dict[str, Task]
+    results: Dict[str, Any]
+
+    def main(self, tasks: List[Task]) -> Dict[str, Any]:
+
+        self.tasks = {}
+        for task in tasks:
+            assert task.name not in self.tasks, f'Duplicate task "{task.name}"'
+            self.tasks[task.name] = task
+
+        self.check_dependencies()
+        self.run()
+
+        return self.results
+
+    def check_dependencies(self):
+        for task in self.tasks.values():
+            for d in task.dependencies:
+                assert d in self.tasks, f'Task "{task.name}" depends on unknown task "{d}"'
+
+        done = set()
+        remaining = list(self.tasks.values())
+        while remaining:
+            ready = [t for t in remaining if all(d in done for d in t.dependencies)]
+            assert len(ready) > 0, f'Circular dependencies among tasks: {[t.name for t in remaining]}'
+            done.update(t.name for t in ready)
+            remaining = [t for t in remaining if t.name not in done]
+
+    def run(self):
+        self.results = {}
+        pending = list(self.tasks.values())  # in the given order, which is kept among tasks that are ready together
+        running: Dict[Future, str] = {}
+        stack = list(metrics.get_stack())  # so that tasks are nested in this stage
+
+        with ThreadPoolExecutor(max_workers=max(1, self.threads), thread_name_prefix='task') as executor:
+            try:
+                while pending or running:
+                    ready = [t for t in pending if all(d in self.results for d in t.dependencies)]
+                    for task in ready:
+                        pending.remove(task)
+                        self.logger.debug(f'Start task "{task.name}"')
+                        running[executor.submit(run_task, task, stack)] = task.name
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        name = running.pop(future)
+                        self.results[name] = future.result()  # re-raise the exception of the failed task
+                        self.logger.debug(f'Finish task "{name}"')
+            except BaseException:
+                for future in running:
+                    future.cancel()  # tasks not yet started, the running ones are waited by the executor
+                raise
+
+
+def run_task(task: Task, stack: List[Dict[str, Any]]) -> Any:
+    metrics.inherit_stack(stack)
+    return task.function()
@@ -1,16 +1,81 @@
-import subprocess
+import os
+import functools
+import threading
 from abc import ABC
+from copy import copy
+from contextlib import contextmanager, redirect_stdout, redirect_stderr
+from typing import Optional, List, Iterator, Callable, TextIO
 from datetime import datetime
+from .metrics import measure_stage, check_call
+
+
+# shared resources that cannot be used by more than one stage at a time, e.g. when stages run concurrently in threads
+PYPLOT = 'pyplot'  # the global state of matplotlib.pyplot
+EMBEDDED_R = 'embedded-r'  # the single R session embedded by rpy2
+RESOURCE_LOCKS = {
+    PYPLOT: threading.RLock(),
+    EMBEDDED_R: threading.RLock(),
+}
+
+
+@contextmanager
+def hold_locks(names: List[str]) -> Iterator[None]:
+    locks = [RESOURCE_LOCKS[n] for n in sorted(names)]  # always in the same order to avoid deadlocks
+    for lock in locks:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(locks):
+            lock.release()
+
+
+def with_locks(main: Callable, names: List[str]) -> Callable:
+    @functools.wraps(main)
+    def wrapper(self, *args, **kwargs):
+        with hold_locks(names):
+            return main(self, *args, **kwargs)
+    return wrapper
+
+
+# the file, e.g. the log of a worker process, that receives the output of commands run by Processor.call() in this thread
+command_output = threading.local()
+
+
+@contextmanager
+def redirect_output(fh: TextIO) -> Iterator[None]:
+    """
+    redirect_stdout and redirect_stderr only replace sys.stdout and sys.stderr of python,
+    so the file handle is also given to the child processes of Processor.call(), e.g. Rscript and GSEA
+    """
+    previous = getattr(command_output, 'fh', None)
+    command_output.fh = fh
+    try:
+        with redirect_stdout(fh), redirect_stderr(fh):
+            yield
+    finally:
+        command_output.fh = previous
 
 
 class Settings:
 
+    RSCRIPT = 'rscript'
+    EMBEDDED = 'embedded'
+    R_DESEQ2 = 'r'
+    NATIVE_DESEQ2 = 'native'
+
     workdir: str
     outdir: str
     threads: int
     debug: bool
     mock: bool
     for_publication: bool
+    r_engine: str
+    cache_dir: Optional[str]
+    cache_max_gb: float
+    profile: bool
+    float32: bool
+    deseq2_engine: str
 
     def __init__(
             self,
@@ -19,7 +84,13 @@ class Settings:
             threads: int,
             debug: bool,
             mock: bool,
-            for_publication: bool):
+            for_publication: bool,
+            r_engine: str = RSCRIPT,
+            cache_dir: Optional[str] = None,
+            cache_max_gb: float = 20.,
+            profile: bool = False,
+            float32: bool = False,
+            deseq2_engine: str = R_DESEQ2):
 
         self.workdir = workdir
         self.outdir = outdir
@@ -27,6 +98,29 @@ class Settings:
         self.debug = debug
         self.mock = mock
         self.for_publication = for_publication
+        assert r_engine in [self.RSCRIPT, self.EMBEDDED]
+        self.r_engine = r_engine
+        self.cache_dir = cache_dir
+        self.cache_max_gb = cache_max_gb
+        self.profile = profile
+        self.float32 = float32
+        assert deseq2_engine in [self.R_DESEQ2, self.NATIVE_DESEQ2]
+        self.deseq2_engine = deseq2_engine
+
+
+def get_comparison_settings(
+        settings: Settings,
+        control_group_name: str,
+        experimental_group_name: str) -> Settings:
+
+    c, e = control_group_name, experimental_group_name
+    new_settings = copy(settings)
+    new_settings.outdir = f'{settings.outdir}/{c}__vs__{e}'
+    new_settings.workdir = f'{settings.workdir}/{c}__vs__{e}'
+    for d in [new_settings.workdir, new_settings.outdir]:
+        os.makedirs(d, exist_ok=True)
+    return new_settings
+
 
 class Logger:
 
@@ -42,19 +136,22 @@ class Logger:
         self.level = level
 
     def info(self, msg: str):
-        print(f'{self.name}\tINFO\t{datetime.now()}', flush=True)
-        print(msg + '\n', flush=True)
+        # one print call, so that messages of concurrent stages are not interleaved
+        print(f'{self.name}\tINFO\t{datetime.now()}\n{msg}\n', flush=True)
+
+    def warning(self, msg: str):
+        print(f'{self.name}\tWARNING\t{datetime.now()}\n{msg}\n', flush=True)
 
     def debug(self, msg: str):
         if self.level == self.INFO:
             return
-        print(f'{self.name}\tDEBUG\t{datetime.now()}', flush=True)
-        print(msg + '\n', flush=True)
+        print(f'{self.name}\tDEBUG\t{datetime.now()}\n{msg}\n', flush=True)
 
 
 class Processor(ABC):
 
     CMD_LINEBREAK = ' \\\n  '
+    LOCKS: List[str] = []  # names of RESOURCE_LOCKS held while running main()
 
     settings: Settings
     workdir: str
@@ -65,6 +162,13 @@ class Processor(ABC):
 
     logger: Logger
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'main' in cls.__dict__:  # time and memory of every stage are recorded in run-metrics.json
+            cls.main = measure_stage(cls.main)
+            if cls.LOCKS:  # waiting for the locks is not counted as the time of the stage
+                cls.main = with_locks(cls.main, names=cls.LOCKS)
+
     def __init__(self, settings: Settings):
 
         self.settings = settings
@@ -79,7 +183,10 @@ class Processor(ABC):
             level=Logger.DEBUG if self.debug else Logger.INFO
         )
 
-    def call(self, cmd: str):
+    def call(self, cmd: str, cwd: Optional[str] = None):
         self.logger.info(cmd)
         if not self.mock:
-            subprocess.check_call(cmd, shell=True)
+            fh = getattr(command_output, 'fh', None)
+            if fh is not None:
+                fh.flush()  # the logged command before its output
+            check_call(cmd, cwd=cwd, stdout=fh)
@@ -0,0 +1,262 @@
+import os
+import numpy as np
+import pandas as pd
+from copy import copy
+from itertools import product
+from typing import Any, Dict, List, Optional, Tuple
+from .deseq2 import FOLD_CHANGE_THRESHOLD, prepare_volcano_data, render_volcano_plot
+from .process_pool import run_in_process_pool
+from .template import Processor, Settings, PYPLOT
+from .cluster_profiler import ClusterProfiler, get_enrichment_names
+
+
+DSTDIR_NAME = 'threshold-sweep'
+SUMMARY_CSV = 'threshold-sweep-summary.csv'
+
+
+class ThresholdSweep(Processor):
+    """
+    Significant genes, volcano plots and ClusterProfiler enrichment for every combination of thresholds,
+    all from the statistics of one DESeq2 fit
+
+    Each volcano plot depends on one gene threshold, and enrichment on (gene q, pathway p, pathway q),
+    so each is made once for its own thresholds rather than for every combination of all four.
+    Jobs run in a process pool of settings.threads spawned workers, each with its own embedded R session,
+    so the sweep is scheduled after all other tasks of the pipeline
+    """
+
+    statistics_dfs: Dict[Tuple[str, str], pd.DataFrame]
+    sample_info_df: pd.DataFrame
+    sample_group_column: str
+    colors: List[Tuple[float, float, float, float]]
+    gene_name_column: str
+    volcano_plot_label_genes: Optional[List[str]]
+    gene_p_thresholds: List[float]
+    gene_q_thresholds: List[float]
+    pathway_p_thresholds: List[float]
+    pathway_q_thresholds: List[float]
+    organism: str
+    enrichment_pathway_keywords: Optional[List[str]]
+    show_n_pathways: int
+
+    dstdir: str
+    jobs: List[Tuple[type, Settings, Dict[str, Any]]]
+    summary_df: pd.DataFrame
+
+    def main(
+            self,
+            statistics_dfs: Dict[Tuple[str, str], pd.DataFrame],
+            sample_info_df: pd.DataFrame,
+            sample_group_column: str,
+            colors: List[Tuple[float, float, float, float]],
+            gene_name_column: str,
+            volcano_plot_label_genes: Optional[List[str]],
+            gene_p_thresholds: List[float],
+            gene_q_thresholds: List[float],
+            pathway_p_thresholds: List[float],
+            pathway_q_thresholds: List[float],
+            organism: str,
+            enrichment_pathway_keywords: Optional[List[str]],
+            show_n_pathways: int) -> pd.DataFrame:
+
+        self.statistics_dfs = statistics_dfs
+        self.sample_info_df = sample_info_df
+        self.sample_group_column = sample_group_column
+        self.colors = colors
+        self.gene_name_column = gene_name_column
+        self.volcano_plot_label_genes = volcano_plot_label_genes
+        self.gene_p_thresholds = gene_p_thresholds
+        self.gene_q_thresholds = gene_q_thresholds
+        self.pathway_p_thresholds = pathway_p_thresholds
+        self.pathway_q_thresholds = pathway_q_thresholds
+        self.organism = organism
+        self.enrichment_pathway_keywords = enrichment_pathway_keywords
+        self.show_n_pathways = show_n_pathways
+
+        self.dstdir = f'{self.outdir}/{DSTDIR_NAME}'
+        self.set_jobs()
+        self.run_jobs()
+        self.set_summary_df()
+        self.write_summary_csv()
+
+        return self.summary_df
+
+    def set_jobs(self):
+        # the order of group names should be the same as the order of colors
+        all_group_names = self.sample_info_df[self.sample_group_column].unique().tolist()
+
+        self.jobs = []
+        for c, e in self.statistics_dfs.keys():
+            statistics_df = self.statistics_dfs[(c, e)]
+            self.jobs.append((SweepVolcanoPlots, self.get_job_settings(c, e), dict(
+                statistics_df=statistics_df,
+                gene_name_column=self.gene_name_column,
+                genes_to_label=self.volcano_plot_label_genes,
+                column_to_thresholds={'pvalue': self.gene_p_thresholds, 'padj': self.gene_q_thresholds},
+                up_color=self.colors[all_group_names.index(e)],
+                down_color=self.colors[all_group_names.index(c)])))
+
+            for gene_q, pathway_p, pathway_q in product(self.gene_q_thresholds, self.pathway_p_thresholds, self.pathway_q_thresholds):
+                self.jobs.append((ClusterProfiler, self.get_job_settings(c, e, gene_q, pathway_p, pathway_q), dict(
+                    statistics_df=statistics_df,
+                    organism=self.organism,
+                    control_group_name=c,
+                    experimental_group_name=e,
+                    gene_name_column=self.gene_name_column,
+                    gene_q_threshold=gene_q,
+                    pathway_p_threshold=pathway_p,
+                    pathway_q_threshold=pathway_q,
+                    enrichment_pathway_keywords=self.enrichment_pathway_keywords,
+                    show_n_pathways=self.show_n_pathways)))
+
+    def get_job_settings(self, control: str, experimental: str, *thresholds: float) -> Settings:
+        subdir = f'{DSTDIR_NAME}/{control}__vs__{experimental}'
+        if thresholds:
+            subdir += '/' + get_enrichment_dirname(*thresholds)
+        settings = copy(self.settings)
+        settings.outdir = f'{self.outdir}/{subdir}'
+        settings.workdir = f'{self.workdir}/{subdir}'
+        settings.threads = 1
+        for d in [settings.workdir, settings.outdir]:
+            os.makedirs(d, exist_ok=True)
+        return settings
+
+    def run_jobs(self):
+        n_workers = min(self.threads, len(self.jobs))
+        self.logger.info(f'Threshold sweep of {len(self.jobs)} jobs in {n_workers} worker processes')
+
+        if n_workers <= 1:
+            for job in self.jobs:
+                run_job(*job)
+            return
+
+        run_in_process_pool(
+            function=run_job,
+            args_list=self.jobs,
+            logs=[f'{self.workdir}/{DSTDIR_NAME}-job-{i + 1}.log' for i in range(len(self.jobs))],
+            n_workers=n_workers)
+
+    def set_summary_df(self):
+        rows = []
+        for (c, e), statistics_df in self.statistics_dfs.items():
+            p_counts = count_significant_genes(statistics_df=statistics_df, p_value_column='pvalue', thresholds=self.gene_p_thresholds)
+            q_counts = count_significant_genes(statistics_df=statistics_df, p_value_column='padj', thresholds=self.gene_q_thresholds)
+            for gene_p, gene_q, pathway_p, pathway_q in product(
+                    self.gene_p_thresholds, self.gene_q_thresholds, self.pathway_p_thresholds, self.pathway_q_thresholds):
+                d = f'{self.dstdir}/{c}__vs__{e}/{get_enrichment_dirname(gene_q, pathway_p, pathway_q)}/{ClusterProfiler.DSTDIR_NAME}'
+                rows.append({
+                    'Comparison': f'{c}__vs__{e}',
+                    'Gene p Threshold': gene_p,
+                    'Gene q Threshold': gene_q,
+                    'Pathway p Threshold': pathway_p,
+                    'Pathway q Threshold': pathway_q,
+                    'Up (pvalue)': p_counts[gene_p][0],
+                    'Down (pvalue)': p_counts[gene_p][1],
+                    'Up (padj)': q_counts[gene_q][0],
+                    'Down (padj)': q_counts[gene_q][1],
+                    'Up Pathways': count_pathways(d=d, group_name=e, pathway_p_threshold=pathway_p, pathway_q_threshold=pathway_q),
+                    'Down Pathways': count_pathways(d=d, group_name=c, pathway_p_threshold=pathway_p, pathway_q_threshold=pathway_q),
+                })
+        self.summary_df = pd.DataFrame(rows)
+
+    def write_summary_csv(self):
+        self.summary_df.to_csv(f'{self.dstdir}/{SUMMARY_CSV}', index=False)
+
+
+class SweepVolcanoPlots(Processor):
+
+    LOCKS = [PYPLOT]
+
+    statistics_df: pd.DataFrame
+    gene_name_column: str
+    genes_to_label: Optional[List[str]]
+    column_to_thresholds: Dict[str, List[float]]
+    up_color: Tuple[float, float, float, float]
+    down_color: Tuple[float, float, float, float]
+
+    def main(
+            self,
+            statistics_df: pd.DataFrame,
+            gene_name_column: str,
+            genes_to_label: Optional[List[str]],
+            column_to_thresholds: Dict[str, List[float]],
+            up_color: Tuple[float, float, float, float],
+            down_color: Tuple[float, float, float, float]):
+        """
+        column_to_thresholds: p value column -> thresholds, e.g. {'pvalue': [0.01, 0.05], 'padj': [0.05, 0.1]}
+        """
+        self.statistics_df = statistics_df
+        self.gene_name_column = gene_name_column
+        self.genes_to_label = genes_to_label
+        self.column_to_thresholds = column_to_thresholds
+        self.up_color = up_color
+        self.down_color = down_color
+
+        data = prepare_volcano_data(
+            df=self.statistics_df,
+            fold_change_column='log2FoldChange',
+            p_value_columns=list(self.column_to_thresholds.keys()),
+            gene_name_column=self.gene_name_column,
+            genes_to_label=self.genes_to_label)
+
+        for column, thresholds in self.column_to_thresholds.items():
+            for threshold in thresholds:
+                render_volcano_plot(
+                    data=data,
+                    p_value_column=column,
+                    p_value_threshold=threshold,
+                    png=f'{self.outdir}/{column}-{threshold:g}-volcano-plot.png',
+                    up_color=self.up_color,
+                    down_color=self.down_color)
+
+
+def run_job(processor_class: type, settings: Settings, kwargs: Dict[str, Any]):
+    processor_class(settings).main(**kwargs)
+
+
+def get_enrichment_dirname(gene_q: float, pathway_p: float, pathway_q: float) -> str:
+    return f'gene-q-{gene_q:g}_pathway-p-{pathway_p:g}_pathway-q-{pathway_q:g}'
+
+
+def count_significant_genes(
+        statistics_df: pd.DataFrame,
+        p_value_column: str,
+        thresholds: List[float]) -> Dict[float, Tuple[int, int]]:
+    """
+    Up and down-regulated genes as in volcano plots, i.e. |log2 fold change| >= FOLD_CHANGE_THRESHOLD and p <= threshold,
+    counted for all thresholds from sorted p values
+
+    Returns:
+        threshold -> (up, down)
+    """
+    x = statistics_df['log2FoldChange'].to_numpy(dtype=np.float64)
+    p = statistics_df[p_value_column].to_numpy(dtype=np.float64)
+    candidate = np.isfinite(x) & np.isfinite(p) & (np.abs(x) >= FOLD_CHANGE_THRESHOLD)
+    up = np.sort(p[candidate & (x > 0)])
+    down = np.sort(p[candidate & (x < 0)])
+    n_up = np.searchsorted(up, thresholds, side='right')
+    n_down = np.searchsorted(down, thresholds, side='right')
+    return {t: (int(u), int(d)) for t, u, d in zip(thresholds, n_up, n_down)}
+
+
+def count_pathways(
+        d: str,
+        group_name: str,
+        pathway_p_threshold: float,
+        pathway_q_threshold: float) -> int:
+    """
+    Enriched pathways (GO and KEGG) of the genes upregulated in the group, from the CSVs written by ClusterProfiler in d
+    Rows are filtered again by the thresholds, as the result table of clusterProfiler may keep all tested pathways
+    """
+    n = 0
+    for name in get_enrichment_names(group_name=group_name):
+        csv = f'{d}/{name}.csv'
+        if not os.path.exists(csv):  # no upregulated genes or no result of the enrichment
+            continue
+        df = pd.read_csv(csv, index_col=0)
+        if 'pvalue' in df.columns:
+            df = df[df['pvalue'] <= pathway_p_threshold]
+        if 'qvalue' in df.columns:
+            df = df[df['qvalue'] <= pathway_q_threshold]
+        n += len(df)
+    return n
@@ -1,15 +1,18 @@
 import numpy as np
 import pandas as pd
+from typing import Callable, Iterator, List, Tuple
 from .template import Processor
 
 
 class TPM(Processor):
 
-    df: pd.DataFrame
+    count_df: pd.DataFrame
     gene_info_df: pd.DataFrame
     gene_length_column: str
 
-    gene_kb_lengths: pd.Series
+    gene_kb_lengths: np.ndarray
+    genes_to_keep: np.ndarray
+    df: pd.DataFrame
 
     def main(
             self,
@@ -17,38 +20,169 @@ class TPM(Processor):
             gene_info_df: pd.DataFrame,
             gene_length_column: str) -> pd.DataFrame:
 
-        self.df = count_df.copy()
+        self.count_df = count_df
         self.gene_info_df = gene_info_df
         self.gene_length_column = gene_length_column
 
         self.set_gene_lengths()
-        self.normalize_by_gene_kb_lengths()
-        self.normalize_by_million_reads_per_sample()
-        self.dropna()
+        self.set_genes_to_keep()
+        self.normalize()
         self.save_csv()
 
         return self.df
 
     def set_gene_lengths(self):
-        df = self.df.merge(
-            right=self.gene_info_df[[self.gene_length_column]],
-            left_index=True,
-            right_index=True,
-            how='left'
-        )
-        self.gene_kb_lengths = df[self.gene_length_column] / 1000
-
-    def normalize_by_gene_kb_lengths(self):
-        for c in self.df.columns:
-            self.df[c] = self.df[c] / self.gene_kb_lengths
-
-    def normalize_by_million_reads_per_sample(self):
-        million_reads_per_sample = np.sum(self.df, axis=0) / 1e+6
-        self.df = self.df / million_reads_per_sample
-
-    def dropna(self):
-        # NA due to some genes don't have gene length
-        self.df = self.df.dropna(how='any')
+        self.gene_kb_lengths = get_gene_kb_lengths(
+            gene_info_df=self.gene_info_df,
+            gene_length_column=self.gene_length_column,
+            genes=self.count_df.index)
+
+    def set_genes_to_keep(self):
+        # drop genes without gene length (or with NA counts) before, rather than after, normalization
+        self.genes_to_keep = get_genes_to_keep(
+            counts=self.count_df.to_numpy(),
+            gene_kb_lengths=self.gene_kb_lengths)
+
+    def normalize(self):
+        values = reads_per_kilobase(
+            counts=self.count_df.to_numpy(),
+            gene_kb_lengths=self.gene_kb_lengths,
+            genes_to_keep=self.genes_to_keep,
+            dtype=np.float32 if self.settings.float32 else np.float64)
+
+        million_reads_per_sample = values.sum(axis=0, dtype=np.float64) / 1e+6
+        values /= million_reads_per_sample.astype(values.dtype)
+
+        self.df = pd.DataFrame(
+            data=values,
+            index=self.count_df.index[self.genes_to_keep],
+            columns=self.count_df.columns,
+            copy=False)
 
     def save_csv(self):
         self.df.to_csv(f'{self.outdir}/tpm.csv')
+
+
+class StreamingTPM(Processor):
+    """
+    TPM computed over chunks of gene rows in two passes:
+        1. sum the reads per kilobase of each sample
+        2. normalize each chunk, and append it to tpm.csv and to a binary .npy file
+
+    The returned TPM DataFrame is memory-mapped from the .npy file, so the memory allocated by this stage,
+    in addition to the count chunks it is given, is bounded by the chunk size
+    """
+
+    TPM_NPY = 'tpm.npy'
+
+    count_chunks: Callable[[], Iterator[pd.DataFrame]]
+    gene_info_df: pd.DataFrame
+    gene_length_column: str
+
+    dtype: type
+    samples: pd.Index
+    n_genes: int
+    million_reads_per_sample: np.ndarray
+    npy: str
+    genes: List[str]
+    df: pd.DataFrame
+
+    def main(
+            self,
+            count_chunks: Callable[[], Iterator[pd.DataFrame]],
+            gene_info_df: pd.DataFrame,
+            gene_length_column: str) -> pd.DataFrame:
+        """
+        count_chunks: a function that returns a new iterator of count chunks (gene rows x sample columns) for each pass
+        """
+        self.count_chunks = count_chunks
+        self.gene_info_df = gene_info_df
+        self.gene_length_column = gene_length_column
+
+        self.dtype = np.float32 if self.settings.float32 else np.float64
+        self.sum_reads_per_kilobase()
+        self.write_tpm()
+        self.load_tpm()
+
+        return self.df
+
+    def sum_reads_per_kilobase(self):
+        sums, self.n_genes = None, 0
+        for chunk in self.count_chunks():
+            values, _ = self.reads_per_kilobase(chunk)
+            chunk_sums = values.sum(axis=0, dtype=np.float64)
+            sums = chunk_sums if sums is None else sums + chunk_sums
+            self.n_genes += len(values)
+            self.samples = chunk.columns
+        self.million_reads_per_sample = sums / 1e+6
+        self.logger.info(f'Streaming TPM of {self.n_genes} genes x {len(self.samples)} samples')
+
+    def write_tpm(self):
+        self.npy = f'{self.workdir}/{self.TPM_NPY}'
+        tpm = np.lib.format.open_memmap(self.npy, mode='w+', dtype=self.dtype, shape=(self.n_genes, len(self.samples)))
+
+        self.genes = []
+        with open(f'{self.outdir}/tpm.csv', 'w') as fh:
+            for chunk in self.count_chunks():
+                values, genes = self.reads_per_kilobase(chunk)
+                values /= self.million_reads_per_sample.astype(self.dtype)
+
+                i = len(self.genes)
+                tpm[i:i + len(values)] = values
+                pd.DataFrame(data=values, index=genes, columns=self.samples, copy=False).to_csv(fh, header=(i == 0))
+                self.genes += list(genes)
+
+        tpm.flush()
+        del tpm
+
+    def load_tpm(self):
+        self.df = pd.DataFrame(
+            data=np.load(self.npy, mmap_mode='r'),
+            index=pd.Index(self.genes),
+            columns=self.samples,
+            copy=False)
+
+    def reads_per_kilobase(self, chunk: pd.DataFrame) -> Tuple[np.ndarray, pd.Index]:
+        counts = chunk.to_numpy()
+        gene_kb_lengths = get_gene_kb_lengths(
+            gene_info_df=self.gene_info_df,
+            gene_length_column=self.gene_length_column,
+            genes=chunk.index)
+        genes_to_keep = get_genes_to_keep(counts=counts, gene_kb_lengths=gene_kb_lengths)
+        values = reads_per_kilobase(
+            counts=counts,
+            gene_kb_lengths=gene_kb_lengths,
+            genes_to_keep=genes_to_keep,
+            dtype=self.dtype)
+        return values, chunk.index[genes_to_keep]
+
+
+def get_gene_kb_lengths(
+        gene_info_df: pd.DataFrame,
+        gene_length_column: str,
+        genes: pd.Index) -> np.ndarray:
+    lengths = gene_info_df[gene_length_column].reindex(genes)  # no-op if already aligned
+    return lengths.to_numpy(dtype=np.float64) / 1000
+
+
+def get_genes_to_keep(counts: np.ndarray, gene_kb_lengths: np.ndarray) -> np.ndarray:
+    genes_to_keep = ~np.isnan(gene_kb_lengths)
+    if counts.dtype.kind == 'f':
+        genes_to_keep &= ~np.isnan(counts).any(axis=1)
+    return genes_to_keep
+
+
+def reads_per_kilobase(
+        counts: np.ndarray,
+        gene_kb_lengths: np.ndarray,
+        genes_to_keep: np.ndarray,
+        dtype: type) -> np.ndarray:
+    # the only full-size allocation, the input counts are never modified
+    values = counts.astype(dtype) if genes_to_keep.all() else counts[genes_to_keep].astype(dtype)
+    values /= gene_kb_lengths[genes_to_keep, np.newaxis].astype(dtype)
+    return values
+
+
+def iter_row_chunks(df: pd.DataFrame, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    for i in range(0, len(df), chunk_rows):
+        yield df.iloc[i:i + chunk_rows]
@@ -1,4 +1,5 @@
 import pandas as pd
+from rna_seq_analysis.template import Settings
 from rna_seq_analysis.batch_correction import BatchCorrection
 from .setup import TestCase
 
@@ -19,3 +20,13 @@ class TestBatchCorrection(TestCase):
         )
         expected = pd.read_csv(f'{self.indir}/corrected_count_df.csv', index_col=0)
         self.assertDataFrameEqual(expected, actual)
+
+    def test_embedded_r_engine(self):
+        self.settings.r_engine = Settings.EMBEDDED
+        actual = BatchCorrection(self.settings).main(
+            count_df=pd.read_csv(f'{self.indir}/count_df.csv', index_col=0),
+            sample_info_df=pd.read_csv(f'{self.indir}/sample_info_df.csv', index_col=0),
+            sample_batch_column='batch',
+        )
+        expected = pd.read_csv(f'{self.indir}/corrected_count_df.csv', index_col=0)
+        self.assertDataFrameEqual(expected, actual)
@@ -0,0 +1,86 @@
+import os
+import errno
+import pandas as pd
+from unittest.mock import patch
+from rna_seq_analysis.tpm import TPM
+from rna_seq_analysis.cache import StageCache
+from .setup import TestCase
+
+
+class TestStageCache(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.settings.cache_dir = f'{self.workdir}/cache'
+        self.count_df = pd.DataFrame(
+            data=[[10, 20], [30, 40], [50, 60]],
+            index=['gene1', 'gene2', 'gene3'],
+            columns=['sample1', 'sample2'])
+        self.gene_info_df = pd.DataFrame(
+            data={'Gene Length': [1000, 2000, 3000]},
+            index=['gene1', 'gene2', 'gene3'])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def run_tpm(self, count_df: pd.DataFrame) -> pd.DataFrame:
+        return StageCache(self.settings).run(
+            processor=TPM(self.settings),
+            outputs=['tpm.csv'],
+            key_settings=['float32'],
+            count_df=count_df,
+            gene_info_df=self.gene_info_df,
+            gene_length_column='Gene Length')
+
+    def test_reuse_result_and_outputs(self):
+        expected = self.run_tpm(count_df=self.count_df)
+        os.remove(f'{self.outdir}/tpm.csv')
+
+        actual = self.run_tpm(count_df=self.count_df)
+
+        self.assertDataFrameEqual(expected, actual)
+        self.assertTrue(os.path.exists(f'{self.outdir}/tpm.csv'))
+        self.assertEqual(1, len(os.listdir(self.settings.cache_dir)))
+
+    def test_changed_input(self):
+        self.run_tpm(count_df=self.count_df)
+        self.run_tpm(count_df=self.count_df + 1)
+        self.assertEqual(2, len(os.listdir(self.settings.cache_dir)))
+
+    def test_eviction(self):
+        self.settings.cache_max_gb = 1e-9  # smaller than any entry
+        self.run_tpm(count_df=self.count_df)
+        self.run_tpm(count_df=self.count_df + 1)
+        self.assertEqual(1, len(os.listdir(self.settings.cache_dir)))  # only the most recent entry is kept
+
+    def test_key_settings(self):
+        self.run_tpm(count_df=self.count_df)
+        self.settings.deseq2_engine = 'native'  # not a key setting of TPM
+        self.run_tpm(count_df=self.count_df)
+        self.assertEqual(1, len(os.listdir(self.settings.cache_dir)))
+
+        self.settings.float32 = True
+        self.run_tpm(count_df=self.count_df)
+        self.assertEqual(2, len(os.listdir(self.settings.cache_dir)))
+
+    def test_entry_stored_by_another_process(self):
+        def write(d: str):
+            with open(f'{d}/{StageCache.RESULT_PKL}', 'wb'):
+                pass
+
+        cache = StageCache(self.settings)
+        cache.store(key='key', write=write)
+        with patch.object(cache.logger, 'warning') as warning:
+            cache.store(key='key', write=write)  # rename fails as the entry exists
+        warning.assert_not_called()
+        self.assertEqual(['key'], os.listdir(self.settings.cache_dir))
+
+    def test_failed_write(self):
+        def write(d: str):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+
+        cache = StageCache(self.settings)
+        with patch.object(cache.logger, 'warning') as warning:
+            cache.store(key='key', write=write)
+        warning.assert_called_once()
+        self.assertEqual([], os.listdir(self.settings.cache_dir))
@@ -1,5 +1,13 @@
+import threading
+import numpy as np
 import pandas as pd
-from rna_seq_analysis.deseq2 import DESeq2, volcano_plot
+import matplotlib.pyplot as plt
+from os.path import exists
+from unittest.mock import patch
+from rna_seq_analysis.template import Settings, RESOURCE_LOCKS, EMBEDDED_R
+from rna_seq_analysis.deseq2 import DESeq2, DESeq2MultiContrast, RunDESeq2, volcano_plot, prepare_volcano_data, \
+    render_volcano_plot
+from rna_seq_analysis.native_deseq2 import NativeDESeq2, benjamini_hochberg
 from .setup import TestCase
 
 
@@ -34,6 +42,127 @@ class TestDESeq2(TestCase):
             colors=[(1.0, 0.3, 0.1, 1.0), (0.2, 0.1, 1.0, 1.0)],
         )
 
+    def test_multi_contrast(self):
+        comparisons = [('normal', 'cancer'), ('cancer', 'normal')]
+        normalized_count_df, statistics_dfs = DESeq2MultiContrast(self.settings).main(
+            count_df=pd.read_csv(f'{self.indir}/count_df.csv', index_col=0),
+            sample_info_df=pd.read_csv(f'{self.indir}/sample_info_df.csv', index_col=0),
+            sample_group_column='group',
+            comparisons=comparisons,
+            gene_info_df=pd.read_csv(f'{self.indir}/gene_info_df.csv', index_col=0),
+            gene_name_column='gene_name',
+            gene_description_column='gene_description',
+            volcano_plot_label_genes=None,
+            gene_p_threshold=0.05,
+            gene_q_threshold=0.1,
+            colors=[(1.0, 0.3, 0.1, 1.0), (0.2, 0.1, 1.0, 1.0)],
+        )
+        self.assertListEqual(comparisons, list(statistics_dfs.keys()))
+
+        a = statistics_dfs[('normal', 'cancer')]['log2FoldChange']
+        b = statistics_dfs[('cancer', 'normal')]['log2FoldChange']
+        self.assertAlmostEqual(0., (a + b.reindex(a.index)).abs().max())
+
+        self.assertTrue(exists(f'{self.outdir}/deseq2/deseq2-normalized-count.csv'))
+        for c, e in comparisons:
+            with self.subTest(comparison=f'{c}__vs__{e}'):
+                self.assertTrue(exists(f'{self.outdir}/{c}__vs__{e}/deseq2/deseq2-statistics.csv'))
+                self.assertFalse(exists(f'{self.outdir}/{c}__vs__{e}/deseq2/deseq2-normalized-count.csv'))
+
+    def test_embedded_r_engine(self):
+        kwargs = dict(
+            count_df=pd.read_csv(f'{self.indir}/count_df.csv', index_col=0),
+            sample_info_df=pd.read_csv(f'{self.indir}/sample_info_df.csv', index_col=0),
+            sample_group_column='group',
+            control_group_name='normal',
+            experimental_group_name='cancer',
+            gene_info_df=pd.read_csv(f'{self.indir}/gene_info_df.csv', index_col=0),
+            gene_name_column='gene_name',
+            gene_description_column='gene_description',
+            volcano_plot_label_genes=None,
+            gene_p_threshold=0.05,
+            gene_q_threshold=0.1,
+            colors=[(1.0, 0.3, 0.1, 1.0), (0.2, 0.1, 1.0, 1.0)],
+        )
+        expected_normalized_count_df, expected_statistics_df = DESeq2(self.settings).main(**kwargs)
+
+        self.settings.r_engine = Settings.EMBEDDED
+        actual_normalized_count_df, actual_statistics_df = DESeq2(self.settings).main(**kwargs)
+
+        self.assertDataFrameEqual(expected_normalized_count_df, actual_normalized_count_df)
+        self.assertDataFrameEqual(expected_statistics_df, actual_statistics_df)
+
+    def test_multiple_threads(self):
+        kwargs = dict(
+            count_df=pd.read_csv(f'{self.indir}/count_df.csv', index_col=0),
+            sample_info_df=pd.read_csv(f'{self.indir}/sample_info_df.csv', index_col=0),
+            sample_group_column='group',
+            contrasts=[('normal', 'cancer')],
+        )
+        expected_normalized_count_df, (expected_statistics_df, ) = RunDESeq2(self.settings).main(**kwargs)
+
+        self.settings.threads = 2
+        for r_engine in [Settings.RSCRIPT, Settings.EMBEDDED]:
+            with self.subTest(r_engine=r_engine):
+                self.settings.r_engine = r_engine
+                actual_normalized_count_df, (actual_statistics_df, ) = RunDESeq2(self.settings).main(**kwargs)
+                self.assertDataFrameEqual(expected_normalized_count_df, actual_normalized_count_df)
+                self.assertDataFrameEqual(expected_statistics_df, actual_statistics_df)
+
+    def test_native_engine(self):
+        kwargs = dict(
+            count_df=pd.read_csv(f'{self.indir}/count_df.csv', index_col=0),
+            sample_info_df=pd.read_csv(f'{self.indir}/sample_info_df.csv', index_col=0),
+            sample_group_column='group',
+            contrasts=[('normal', 'cancer')],
+        )
+        expected_normalized_count_df, (expected_statistics_df, ) = RunDESeq2(self.settings).main(**kwargs)
+        actual_normalized_count_df, (actual_statistics_df, ) = NativeDESeq2(self.settings).main(**kwargs)
+
+        self.assertDataFrameEqual(expected_normalized_count_df, actual_normalized_count_df)
+        self.assertListEqual(list(expected_statistics_df.columns), list(actual_statistics_df.columns))
+
+        expected, actual = expected_statistics_df, actual_statistics_df.reindex(expected_statistics_df.index)
+        np.testing.assert_allclose(expected['baseMean'], actual['baseMean'], rtol=1e-6)
+        expressed = expected['baseMean'] >= 10
+        np.testing.assert_allclose(
+            expected.loc[expressed, 'log2FoldChange'], actual.loc[expressed, 'log2FoldChange'], atol=0.05)
+        tested = expected['pvalue'].notna() & actual['pvalue'].notna()
+        self.assertGreater(tested.mean(), 0.99)
+        log_p = np.log10(expected.loc[tested, 'pvalue']), np.log10(actual.loc[tested, 'pvalue'])
+        self.assertGreater(np.corrcoef(*log_p)[0, 1], 0.999)
+
+        significant = expected['padj'] < 0.1, actual['padj'] < 0.1
+        jaccard = (significant[0] & significant[1]).sum() / (significant[0] | significant[1]).sum()
+        self.assertGreater(jaccard, 0.95)
+
+    def test_rscript_engine_does_not_lock_embedded_r(self):
+        embedded_r_free = []
+
+        def run_r_script(processor: RunDESeq2):
+            def try_lock():  # from another thread, as the lock is reentrant
+                acquired = RESOURCE_LOCKS[EMBEDDED_R].acquire(blocking=False)
+                if acquired:
+                    RESOURCE_LOCKS[EMBEDDED_R].release()
+                embedded_r_free.append(acquired)
+            t = threading.Thread(target=try_lock)
+            t.start()
+            t.join()
+
+        def read_deseq2_output_csvs(processor: RunDESeq2):
+            processor.normalized_count_df = processor.count_df
+            processor.statistics_dfs = []
+
+        with patch.object(RunDESeq2, 'run_r_script', run_r_script), \
+                patch.object(RunDESeq2, 'read_deseq2_output_csvs', read_deseq2_output_csvs):
+            RunDESeq2(self.settings).main(
+                count_df=pd.DataFrame({'s1': [1], 's2': [2]}, index=['g1']),
+                sample_info_df=pd.DataFrame({'group': ['a', 'b']}, index=['s1', 's2']),
+                sample_group_column='group',
+                contrasts=[('a', 'b')])
+
+        self.assertListEqual([True], embedded_r_free)
+
     def test_invalid_group_name(self):
         invalid_group_name = 'X'
         with self.assertRaises(AssertionError):
@@ -86,3 +215,81 @@ class TestDESeq2(TestCase):
             up_color=(1.0, 0.3, 0.1, 1.0),
             down_color=(0.2, 0.1, 1.0, 1.0),
         )
+
+    def test_render_dense_volcano_plots(self):
+        rng = np.random.default_rng(1)
+        n = 20000
+        df = pd.DataFrame({
+            'gene_name': [f'Gene{i}' for i in range(n)],
+            'log2FoldChange': rng.normal(0, 1, n),
+            'pvalue': rng.uniform(0, 1, n) ** 3,
+        })
+        df['padj'] = np.minimum(df['pvalue'] * 10, 1)
+        df.loc[0, 'padj'] = np.nan
+
+        data = prepare_volcano_data(
+            df=df,
+            fold_change_column='log2FoldChange',
+            p_value_columns=['pvalue', 'padj'],
+            gene_name_column='gene_name',
+            genes_to_label=['gene0', 'GENE1', 'XXXXXX'])
+        self.assertListEqual([0, 1], data['label_index'].tolist())
+
+        n_figures = len(plt.get_fignums())
+        for column in ['pvalue', 'padj']:
+            render_volcano_plot(
+                data=data,
+                p_value_column=column,
+                p_value_threshold=0.05,
+                png=f'{self.outdir}/{column}-volcano-plot.png',
+                up_color=(1.0, 0.3, 0.1, 1.0),
+                down_color=(0.2, 0.1, 1.0, 1.0))
+            self.assertTrue(exists(f'{self.outdir}/{column}-volcano-plot.png'))
+        self.assertEqual(n_figures, len(plt.get_fignums()))
+
+
+class TestNativeDESeq2(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        rng = np.random.default_rng(1)
+        n_genes, samples = 2000, [f'S{i}' for i in range(8)]
+        groups = ['A'] * 4 + ['B'] * 4
+        size_factors = np.array([0.8, 1.0, 1.2, 0.9, 1.1, 1.0, 0.7, 1.3])
+        means = np.exp(rng.uniform(1, 9, n_genes))
+        log2_fold_changes = np.where(np.arange(n_genes) < 200, rng.choice([-2., 2.], n_genes), 0.)
+        mu = means[:, np.newaxis] * size_factors * 2 ** (log2_fold_changes[:, np.newaxis] * (np.array(groups) == 'B'))
+        r = 1 / (0.05 + 1 / means[:, np.newaxis])
+        counts = rng.negative_binomial(r, r / (r + mu))
+        counts[-10:] = 0
+
+        normalized_count_df, (statistics_df, ) = NativeDESeq2(self.settings).main(
+            count_df=pd.DataFrame(counts, index=[f'G{i}' for i in range(n_genes)], columns=samples),
+            sample_info_df=pd.DataFrame({'group': groups}, index=samples),
+            sample_group_column='group',
+            contrasts=[('A', 'B')])
+
+        self.assertListEqual(['baseMean', 'log2FoldChange', 'lfcSE', 'stat', 'pvalue', 'padj'], list(statistics_df.columns))
+        self.assertTrue(statistics_df.iloc[-10:, 1:].isna().all().all())  # all-zero genes are not tested
+
+        expressed = counts > 0
+        ratios = normalized_count_df.to_numpy()[expressed] * size_factors[np.nonzero(expressed)[1]] / counts[expressed]
+        self.assertLess(np.std(np.log(ratios)), 0.05)  # size factors are recovered up to a constant
+
+        de = statistics_df.iloc[:200]
+        expressed = de['baseMean'] > 20
+        np.testing.assert_allclose(de.loc[expressed, 'log2FoldChange'], log2_fold_changes[:200][expressed], atol=1.)
+
+        null = statistics_df.iloc[200:-10]['pvalue'].dropna()
+        self.assertAlmostEqual(0.05, (null < 0.05).mean(), delta=0.02)
+        self.assertGreater((de['padj'] < 0.1).mean(), 0.8)
+
+    def test_benjamini_hochberg(self):
+        p = np.array([0.01, np.nan, 0.04, 0.03, 0.5])
+        expected = [0.04, np.nan, 0.16 / 3, 0.16 / 3, 0.5]  # p.adjust(c(0.01, NA, 0.04, 0.03, 0.5), method='BH') in R
+        np.testing.assert_allclose(expected, benjamini_hochberg(p))
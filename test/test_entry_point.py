@@ -0,0 +1,34 @@
+import os
+import sys
+import inspect
+import importlib.util
+from unittest.mock import patch
+import rna_seq_analysis
+from .setup import TestCase
+
+
+def import_entry_point():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '__main__.py')
+    spec = importlib.util.spec_from_file_location('entry_point', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestEntryPoint(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_default_arguments(self):
+        argv = ['rna_seq_analysis', '-c', 'count.csv', '-s', 'sample-info.csv', '-g', 'gene-info.csv']
+        with patch.object(sys, 'argv', argv), patch.object(rna_seq_analysis, 'main') as main:
+            import_entry_point().EntryPoint().main()
+
+        kwargs = main.call_args.kwargs
+        inspect.signature(rna_seq_analysis.main).bind(**kwargs)  # raises TypeError if any argument is missing or unknown
+        self.assertEqual('pdf,png', kwargs['heatmap_formats'])
+        self.assertFalse(kwargs['heatmap_rasterize'])
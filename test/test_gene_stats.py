@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from rna_seq_analysis import gene_stats
+from rna_seq_analysis.gene_stats import get_gene_stats, select_top_variable_genes
+from .setup import TestCase
+
+
+class TestGeneStats(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.df = pd.DataFrame(
+            data=[[0, 0, 0, 0], [1, 3, 1, 3], [0, 9, 0, 9], [5, 5, 5, 5]],
+            index=['gene1', 'gene2', 'gene3', 'gene4'],
+            columns=['sample1', 'sample2', 'sample3', 'sample4'])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_get_gene_stats(self):
+        actual = get_gene_stats(self.df)
+        log_df = np.log1p(self.df)
+        expected = pd.DataFrame({
+            'Sum': self.df.sum(axis=1).astype(float),
+            'Mean': self.df.mean(axis=1),
+            'Variance': self.df.var(axis=1),
+            'Detection Rate': [0., 1., 0.5, 1.],
+            'Log Mean': log_df.mean(axis=1),
+            'Log Variance': log_df.var(axis=1),
+        })
+        self.assertDataFrameEqual(expected, actual)
+
+    def test_cached_by_matrix(self):
+        first = get_gene_stats(self.df)
+        self.assertIs(first, get_gene_stats(self.df))
+        self.assertIsNot(first, get_gene_stats(self.df.copy()))
+
+        key = id(self.df)
+        del self.df, first
+        self.assertNotIn(key, gene_stats.cache)
+
+    def test_select_top_variable_genes(self):
+        actual = select_top_variable_genes(df=self.df, n=2)
+        self.assertListEqual(['gene2', 'gene3'], list(actual.index))
+
+        subset_df = self.df.loc[['gene1', 'gene2', 'gene4']]
+        actual = select_top_variable_genes(df=subset_df, n=1, gene_stats_df=get_gene_stats(self.df))
+        self.assertListEqual(['gene2'], list(actual.index))
+
+        self.assertIs(self.df, select_top_variable_genes(df=self.df, n=0))
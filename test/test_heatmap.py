@@ -1,6 +1,13 @@
+import threading
+import numpy as np
 import pandas as pd
-from os.path import exists
-from rna_seq_analysis.heatmap import Heatmap
+from PIL import Image
+from unittest.mock import patch
+from seaborn.matrix import ClusterGrid
+from os.path import exists, getsize
+from rna_seq_analysis.heatmap import Heatmap, FilterByCumulativeReads, CountNormalization, Clustermap, \
+    compute_row_and_column_linkages
+from rna_seq_analysis.template import RESOURCE_LOCKS, PYPLOT
 from .setup import TestCase
 
 
@@ -25,3 +32,155 @@ class TestHeatmap(TestCase):
         ]:
             with self.subTest(filename=filename):
                 self.assertTrue(exists(f'{self.outdir}/heatmap/{filename}'))
+
+
+class TestFilterByCumulativeReads(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        df = pd.DataFrame(
+            data=[[1, 1], [30, 30], [5, 5], [10, 10], [4, 4]],
+            index=['a', 'b', 'c', 'd', 'e'],
+            columns=['s1', 's2'])
+        original = df.copy()
+
+        actual = FilterByCumulativeReads(self.settings).main(df=df, heatmap_read_fraction=0.8)
+
+        # cumulative fractions of b, d, c, e, a: 0.6, 0.8, 0.9, 0.98, 1.0
+        self.assertListEqual(['b', 'd'], actual.index.tolist())
+        self.assertDataFrameEqual(original, df)
+
+
+class TestClustermap(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_max_rows(self):
+        rng = np.random.default_rng(1)
+        data = pd.DataFrame(
+            data=rng.normal(size=(200, 6)),
+            index=[f'gene{i}' for i in range(200)],
+            columns=[f'sample{i}' for i in range(6)])
+
+        Clustermap(self.settings).main(
+            data=data,
+            fname='abc',
+            linkage_method='ward',
+            max_rows=20)
+
+        plotted = pd.read_csv(f'{self.outdir}/heatmap/abc.csv', index_col=0)
+        clusters = pd.read_csv(f'{self.outdir}/heatmap/abc-row-clusters.csv', index_col=0)
+        self.assertLessEqual(len(plotted), 20)
+        self.assertListEqual(data.index.tolist(), clusters.index.tolist())
+        self.assertSetEqual(set(plotted.index), set(clusters['Cluster']))
+
+    def test_cached_linkage(self):
+        rng = np.random.default_rng(1)
+        data = pd.DataFrame(
+            data=rng.normal(size=(50, 6)),
+            index=[f'gene{i}' for i in range(50)],
+            columns=[f'sample{i}' for i in range(6)])
+
+        Clustermap(self.settings).main(data=data, fname='abc')
+        expected = pd.read_csv(f'{self.outdir}/heatmap/abc.csv', index_col=0)
+
+        with patch('rna_seq_analysis.heatmap.compute_row_and_column_linkages') as compute:
+            Clustermap(self.settings).main(data=data, fname='abc')
+            compute.assert_not_called()
+        actual = pd.read_csv(f'{self.outdir}/heatmap/abc.csv', index_col=0)
+
+        self.assertDataFrameEqual(expected, actual)
+        self.assertTrue(exists(f'{self.outdir}/heatmap/abc-linkage.npz'))
+
+    def test_pyplot_not_locked_while_clustering(self):
+        rng = np.random.default_rng(1)
+        data = pd.DataFrame(
+            data=rng.normal(size=(50, 6)),
+            index=[f'gene{i}' for i in range(50)],
+            columns=[f'sample{i}' for i in range(6)])
+
+        pyplot_free = []
+
+        def compute(**kwargs):
+            def try_lock():  # from another thread, as the lock is reentrant
+                acquired = RESOURCE_LOCKS[PYPLOT].acquire(blocking=False)
+                if acquired:
+                    RESOURCE_LOCKS[PYPLOT].release()
+                pyplot_free.append(acquired)
+            t = threading.Thread(target=try_lock)
+            t.start()
+            t.join()
+            return compute_row_and_column_linkages(**kwargs)
+
+        with patch('rna_seq_analysis.heatmap.compute_row_and_column_linkages', side_effect=compute):
+            Clustermap(self.settings).main(data=data, fname='abc')
+
+        self.assertListEqual([True], pyplot_free)
+        self.assertTrue(exists(f'{self.outdir}/heatmap/abc.png'))
+
+    def test_one_raster_render_for_all_raster_formats(self):
+        rng = np.random.default_rng(1)
+        data = pd.DataFrame(
+            data=rng.normal(size=(50, 6)),
+            index=[f'gene{i}' for i in range(50)],
+            columns=[f'sample{i}' for i in range(6)])
+
+        with patch.object(ClusterGrid, 'savefig', autospec=True, side_effect=ClusterGrid.savefig) as savefig:
+            Clustermap(self.settings).main(data=data, fname='abc', formats=['png', 'jpg', 'tif'])
+
+        self.assertEqual(1, savefig.call_count)
+        sizes = []
+        for ext in ['png', 'jpg', 'tif']:
+            with Image.open(f'{self.outdir}/heatmap/abc.{ext}') as image:
+                sizes.append(image.size)
+        self.assertEqual(1, len(set(sizes)))
+
+    def test_rasterize(self):
+        rng = np.random.default_rng(1)
+        data = pd.DataFrame(
+            data=rng.normal(size=(500, 6)),
+            index=[f'gene{i}' for i in range(500)],
+            columns=[f'sample{i}' for i in range(6)])
+
+        Clustermap(self.settings).main(data=data, fname='vector', formats=['pdf'])
+        Clustermap(self.settings).main(data=data, fname='raster', formats=['pdf'], rasterize=True)
+
+        self.assertFalse(exists(f'{self.outdir}/heatmap/raster.png'))
+        self.assertLess(
+            getsize(f'{self.outdir}/heatmap/raster.pdf'),
+            getsize(f'{self.outdir}/heatmap/vector.pdf'))
+
+
+class TestCountNormalization(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        df = pd.DataFrame(
+            data=[[0, 10], [1, 30], [3, 60]],
+            index=['gene1', 'gene2', 'gene3'],
+            columns=['sample1', 'sample2'])
+        actual = CountNormalization(self.settings).main(
+            df=df,
+            log_pseudocount=True,
+            by_sample_reads=True,
+            sample_reads_unit=100)
+        expected = pd.DataFrame(
+            data=np.log10(np.array([[0., 10.], [25., 30.], [75., 60.]]) + 1.),
+            index=['gene1', 'gene2', 'gene3'],
+            columns=['sample1', 'sample2'])
+        self.assertDataFrameEqual(expected, actual)
+        self.assertEqual(0, df.iloc[0, 0])  # input not modified
@@ -0,0 +1,72 @@
+import os
+import json
+import tracemalloc
+import numpy as np
+from rna_seq_analysis import metrics
+from rna_seq_analysis.template import Processor, redirect_output
+from .setup import TestCase
+
+
+class Inner(Processor):
+
+    def main(self) -> float:
+        self.call('exit 0')
+        return np.ones(10**6).sum()
+
+
+class Echo(Processor):
+
+    def main(self):
+        print('from python')
+        self.call('echo from child; echo from child stderr 1>&2')
+
+
+class Outer(Processor):
+
+    def main(self) -> float:
+        return Inner(self.settings).main()
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        metrics.pop_records()
+        tracemalloc.stop()
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_write_run_metrics(self):
+        Outer(self.settings).main()
+        json_path = f'{self.outdir}/{metrics.RUN_METRICS_JSON}'
+        metrics.write_run_metrics(json_path)
+
+        with open(json_path) as fh:
+            stages = json.load(fh)['stages']
+
+        self.assertListEqual(['Outer', 'Inner'], [s['stage'] for s in stages])
+        self.assertEqual('Outer', stages[1]['parent'])
+        self.assertEqual(1, len(stages[1]['commands']))
+        for s in stages:
+            self.assertNotIn('python_peak_mb', s)  # tracemalloc is off by default
+            self.assertGreater(s['max_rss_mb'], 0.)
+            self.assertGreaterEqual(s['wall_seconds'], 0.)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_profile(self):
+        self.settings.profile = True
+        Outer(self.settings).main()
+        self.assertEqual(2, len(os.listdir(f'{self.outdir}/{metrics.PROFILE_DIRNAME}')))
+        for s in metrics.pop_records():
+            self.assertGreater(s['python_peak_mb'], 7.)  # 10**6 float64
+
+    def test_redirect_output(self):
+        log = f'{self.workdir}/echo.log'
+        with open(log, 'w') as fh, redirect_output(fh):
+            Echo(self.settings).main()
+        with open(log) as fh:
+            lines = fh.read().splitlines()
+        for line in ['from python', 'from child', 'from child stderr']:
+            self.assertIn(line, lines)
+        self.assertLess(lines.index('from python'), lines.index('from child'))
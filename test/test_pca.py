@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 from os.path import exists
-from rna_seq_analysis.pca import PCA
+from functools import partial
+from rna_seq_analysis.pca import PCA, ComputePCA, BlockComputePCA
+from rna_seq_analysis.tpm import iter_row_chunks
 from .setup import TestCase
 
 
@@ -25,6 +28,61 @@ class TestPCA(TestCase):
             'abc-sample-coordinate.csv',
             'abc-sample-coordinate.pdf',
             'abc-sample-coordinate.png',
+            'abc-sample-coordinate-pc2-pc3.png',
+            'abc-sample-coordinate-pc3-pc4.png',
+            'abc-loading.csv',
+            'abc-scree.csv',
         ]:
             with self.subTest(filename=filename):
                 self.assertTrue(exists(f'{self.outdir}/pca/{filename}'))
+
+
+class TestComputePCA(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_truncated_svd(self):
+        rng = np.random.default_rng(1)
+        df = pd.DataFrame(
+            data=rng.normal(size=(1000, 12)),
+            index=[f'gene{i}' for i in range(1000)],
+            columns=[f'sample{i}' for i in range(12)])
+
+        expected, expected_proportion, _ = ComputePCA(self.settings).main(
+            feature_by_sample_df=df, n_components=4, svd_solver='full')
+
+        for svd_solver in ['randomized', 'arpack']:
+            with self.subTest(svd_solver=svd_solver):
+                actual, actual_proportion, loading_df = ComputePCA(self.settings).main(
+                    feature_by_sample_df=df, n_components=4, svd_solver=svd_solver)
+                self.assertEqual((1000, 4), loading_df.shape)
+                np.testing.assert_allclose(expected.abs(), actual.abs(), atol=1e-6)  # signs are arbitrary
+                np.testing.assert_allclose(expected_proportion, actual_proportion, atol=1e-6)
+
+
+class TestBlockComputePCA(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        rng = np.random.default_rng(1)
+        df = pd.DataFrame(
+            data=rng.poisson(lam=5, size=(1001, 8)) * rng.uniform(1, 5, size=(1001, 1)),
+            index=[f'gene{i}' for i in range(1001)],
+            columns=[f'sample{i}' for i in range(8)])
+
+        expected = ComputePCA(self.settings).main(feature_by_sample_df=df, n_components=4, svd_solver='full')
+        actual = BlockComputePCA(self.settings).main(
+            feature_chunks=partial(iter_row_chunks, df=df, chunk_rows=300),
+            n_components=4)
+
+        for e, a in zip(expected, actual):
+            np.testing.assert_allclose(e, a, atol=1e-8)
@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+from rna_seq_analysis.r_bridge import df_to_r_integer_matrix
+from .setup import TestCase
+
+
+class TestRBridge(TestCase):
+
+    def test_non_integer_counts(self):
+        df = pd.DataFrame({'sample1': [1.0, 2.5], 'sample2': [3.0, 4.0]}, index=['gene1', 'gene2'])
+        with self.assertRaises(AssertionError):
+            df_to_r_integer_matrix(df)
+
+    def test_counts_out_of_range(self):
+        df = pd.DataFrame({'sample1': [1, 2**31], 'sample2': [3, 4]}, index=['gene1', 'gene2'], dtype=np.int64)
+        with self.assertRaises(AssertionError):
+            df_to_r_integer_matrix(df)
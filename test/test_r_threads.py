@@ -0,0 +1,21 @@
+from rna_seq_analysis.r_threads import get_blas_threads_env, get_deseq2_parallel_r_code, get_embedded_bpparam_r_code
+from .setup import TestCase
+
+
+class TestRThreads(TestCase):
+
+    def test_get_blas_threads_env(self):
+        self.assertIn('OPENBLAS_NUM_THREADS=4', get_blas_threads_env(threads=4))
+
+    def test_get_deseq2_parallel_r_code(self):
+        code = get_deseq2_parallel_r_code(threads=8)
+        self.assertIn('parallel <- TRUE', code)
+        self.assertIn('MulticoreParam(workers=8)', code)
+        self.assertIn('RhpcBLASctl::blas_set_num_threads(1)', code)
+
+        code = get_deseq2_parallel_r_code(threads=1)
+        self.assertIn('parallel <- FALSE', code)
+
+    def test_get_embedded_bpparam_r_code(self):
+        self.assertEqual('SnowParam(workers=4)', get_embedded_bpparam_r_code(threads=4))
+        self.assertEqual('SerialParam()', get_embedded_bpparam_r_code(threads=1))
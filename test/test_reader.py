@@ -0,0 +1,85 @@
+import gzip
+import numpy as np
+import pandas as pd
+from rna_seq_analysis.reader import read_count_table, read_gene_info_table, get_sep
+from .setup import TestCase
+
+
+class TestReader(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+        self.count_df = pd.DataFrame(
+            data=[[10, 20], [30, 40], [50, 60]],
+            index=['gene1', 'gene2', 'gene3'],
+            columns=['sample1', 'sample2'])
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_gzipped_tsv_count_table(self):
+        file = f'{self.workdir}/count.tsv.gz'
+        with gzip.open(file, 'wt') as fh:
+            self.count_df.to_csv(fh, sep='\t')
+
+        actual = read_count_table(file)
+
+        self.assertDataFrameEqual(self.count_df, actual)
+        self.assertListEqual([np.dtype('int32')] * 2, actual.dtypes.tolist())
+
+    def test_non_integer_count_table(self):
+        file = f'{self.workdir}/count.csv'
+        (self.count_df + 0.5).to_csv(file)
+
+        actual = read_count_table(file)
+
+        self.assertDataFrameEqual(self.count_df + 0.5, actual)
+
+    def test_gene_info_table_columns(self):
+        file = f'{self.workdir}/gene-info.csv'
+        pd.DataFrame(
+            data={'gene_length': [1000, 2000], 'gene_name': ['A', 'B'], 'unused': ['x', 'y']},
+            index=['gene1', 'gene2']
+        ).to_csv(file)
+
+        actual = read_gene_info_table(file, columns=['gene_length', 'gene_name', None])
+
+        self.assertListEqual(['gene_length', 'gene_name'], actual.columns.tolist())
+        self.assertListEqual(['gene1', 'gene2'], actual.index.tolist())
+
+    def test_integer_gene_ids(self):
+        count_df = self.count_df.set_axis([7157, 672, 1956])
+        count_df.to_csv(f'{self.workdir}/count.csv')
+        pd.DataFrame(
+            data={'gene_name': ['TP53', 'BRCA1', 'EGFR']},
+            index=[7157, 672, 1956]
+        ).to_csv(f'{self.workdir}/gene-info.csv')
+
+        count_df = read_count_table(f'{self.workdir}/count.csv')
+        gene_info_df = read_gene_info_table(f'{self.workdir}/gene-info.csv', columns=['gene_name'])
+
+        # the same index as tables of later stages, e.g. DESeq2 outputs, which are read by pd.read_csv
+        expected = pd.read_csv(f'{self.workdir}/count.csv', index_col=0).index
+        self.assertTrue(expected.equals(count_df.index))
+        self.assertEqual(np.dtype('int64'), count_df.index.dtype)
+        self.assertListEqual(['TP53', 'BRCA1', 'EGFR'], gene_info_df.loc[count_df.index, 'gene_name'].tolist())
+
+    def test_empty_strings_are_nan(self):
+        file = f'{self.workdir}/gene-info.csv'
+        with open(file, 'w') as fh:
+            fh.write('gene_id,gene_name\ngene1,A\ngene2,\n')
+
+        actual = read_gene_info_table(file, columns=['gene_name'])
+
+        self.assertTrue(pd.isna(actual.loc['gene2', 'gene_name']))
+        self.assertEqual('A', actual.loc['gene1', 'gene_name'])
+
+    def test_get_sep(self):
+        for file, expected in [
+            ('count.csv', ','),
+            ('count.csv.zst', ','),
+            ('count.txt', '\t'),
+            ('count.tsv.bz2', '\t'),
+        ]:
+            with self.subTest(file=file):
+                self.assertEqual(expected, get_sep(file))
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+from rna_seq_analysis.results_store import ResultsStore, lookup_genes
+from .setup import TestCase
+
+
+class TestResultsStore(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        rng = np.random.default_rng(1)
+        genes = [f'ENSG{i:05d}' for i in range(50000)]
+        statistics_dfs = {}
+        for c, e in [('normal', 'cancer'), ('normal', 'metastasis'), ('cancer', 'metastasis')]:
+            df = pd.DataFrame(
+                data={
+                    'gene_name': [f'GENE{i}' for i in range(len(genes))],
+                    'baseMean': rng.uniform(0, 1000, len(genes)),
+                    'log2FoldChange': rng.normal(0, 1, len(genes)),
+                    'lfcSE': rng.uniform(0, 1, len(genes)),
+                    'pvalue': rng.uniform(0, 1, len(genes)),
+                    'padj': rng.uniform(0, 1, len(genes)),
+                },
+                index=genes)
+            statistics_dfs[(c, e)] = df.sample(frac=1, random_state=1)  # sorted by p values, not by genes
+
+        ResultsStore(self.settings).main(statistics_dfs=statistics_dfs, gene_name_column='gene_name')
+        store_dir = f'{self.outdir}/results-store'
+
+        df = lookup_genes(store_dir=store_dir, gene_ids=['ENSG00001', 'ENSG49999'])
+        self.assertListEqual(['ENSG00001'] * 3 + ['ENSG49999'] * 3, df['gene_id'].tolist())
+        self.assertListEqual(['normal__vs__cancer', 'normal__vs__metastasis', 'cancer__vs__metastasis'] * 2, df['comparison'].astype(str).tolist())
+        expected = statistics_dfs[('normal', 'metastasis')].loc['ENSG49999', 'log2FoldChange']
+        self.assertAlmostEqual(expected, df.loc[4, 'log2FoldChange'])
+
+        wide_df = pd.read_parquet(f'{store_dir}/wide-padj.parquet')
+        self.assertEqual((len(genes), 3), wide_df.shape)
+        self.assertAlmostEqual(statistics_dfs[('cancer', 'metastasis')].loc['ENSG00042', 'padj'], wide_df.loc['ENSG00042', 'cancer__vs__metastasis'])
+
+        dataset_df = pd.read_parquet(f'{store_dir}/comparisons')
+        self.assertEqual(3 * len(genes), len(dataset_df))
+        self.assertSetEqual({'normal__vs__cancer', 'normal__vs__metastasis', 'cancer__vs__metastasis'}, set(dataset_df['comparison'].astype(str)))
+
+    def test_overwrite(self):
+        df = pd.DataFrame({'gene_name': ['A'], 'baseMean': [1.], 'log2FoldChange': [1.], 'pvalue': [0.1], 'padj': [0.2]}, index=['G1'])
+        ResultsStore(self.settings).main(statistics_dfs={('a', 'b'): df, ('a', 'c'): df}, gene_name_column='gene_name')
+        ResultsStore(self.settings).main(statistics_dfs={('a', 'b'): df}, gene_name_column='gene_name')
+        dataset_df = pd.read_parquet(f'{self.outdir}/results-store/comparisons')
+        self.assertListEqual(['a__vs__b'], dataset_df['comparison'].astype(str).tolist())
+
+    def test_numeric_gene_ids_and_missing_names(self):
+        df = pd.DataFrame(
+            {'gene_name': ['A', np.nan, None], 'baseMean': [1., 2., 3.], 'log2FoldChange': [1., 2., 3.], 'pvalue': [0.1, 0.2, 0.3], 'padj': [0.2, 0.3, 0.4]},
+            index=[1, 2, 10])
+        ResultsStore(self.settings).main(statistics_dfs={('a', 'b'): df}, gene_name_column='gene_name')
+
+        df = lookup_genes(store_dir=f'{self.outdir}/results-store', gene_ids=[2, 10])
+        self.assertListEqual(['10', '2'], df['gene_id'].tolist())  # sorted as strings
+        self.assertTrue(df['gene_name'].isna().all())
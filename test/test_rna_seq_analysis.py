@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
+from os.path import exists
+from itertools import combinations
 from .setup import TestCase
-from rna_seq_analysis.rna_seq_analysis import RNASeqAnalysis, GetColors, SubsetSamples
+from rna_seq_analysis.rna_seq_analysis import RNASeqAnalysis, GetColors, SubsetSamples, AlignGeneInfo
 
 
 class TestRNASeqAnalysis(TestCase):
@@ -21,11 +24,22 @@ class TestRNASeqAnalysis(TestCase):
             gene_name_column='gene_name',
             gene_description_column='gene_description',
             heatmap_read_fraction=0.8,
+            heatmap_linkage_method='average',
+            heatmap_max_rows=0,
+            heatmap_formats=['pdf', 'png'],
+            heatmap_rasterize=False,
+            top_variable_genes=0,
             sample_group_column='group',
             control_group_name=None,
             experimental_group_name=None,
             sample_batch_column='batch',
             skip_differential_analysis=False,
+            parallel_comparisons=False,
+            tpm_chunk_rows=0,
+            pca_n_components=4,
+            pca_svd_solver='auto',
+            pca_block_rows=0,
+            sample_distance_metrics=['pearson', 'spearman', 'euclidean', 'poisson'],
             volcano_plot_label_genes=[
                 'FAM238B',
                 'RP1L1',
@@ -41,6 +55,10 @@ class TestRNASeqAnalysis(TestCase):
             gene_q_threshold=0.5,
             pathway_p_threshold=0.05,
             pathway_q_threshold=0.5,
+            sweep_gene_p_thresholds=None,
+            sweep_gene_q_thresholds=None,
+            sweep_pathway_p_thresholds=None,
+            sweep_pathway_q_thresholds=None,
             organism='human',
             enrichment_pathway_keywords=['signal'],
             show_n_pathways=20,
@@ -48,6 +66,70 @@ class TestRNASeqAnalysis(TestCase):
             invert_colors=True
         )
 
+    def test_parallel_comparisons(self):
+        # a third group, for more than one comparison
+        sample_info_df = pd.read_csv(f'{self.indir}/22_1209_randomize_rna_seq_data_sample_info.csv', index_col=0)
+        last_group = sample_info_df['group'].unique()[-1]
+        samples = sample_info_df.index[sample_info_df['group'] == last_group]
+        sample_info_df.loc[samples[::2], 'group'] = 'another'
+        sample_info_table = f'{self.workdir}/sample-info.csv'
+        sample_info_df.to_csv(sample_info_table)
+
+        self.settings.threads = 2
+        RNASeqAnalysis(self.settings).main(
+            count_table=f'{self.indir}/22_1209_randomize_rna_seq_data_count.csv',
+            sample_info_table=sample_info_table,
+            gene_info_table=f'{self.indir}/22_1209_randomize_rna_seq_data_gene_info.csv',
+            gene_sets_gmt=f'{self.indir}/h.all.v2023.1.Hs.symbols.gmt',
+            gene_length_column='gene_length',
+            gene_name_column='gene_name',
+            gene_description_column='gene_description',
+            heatmap_read_fraction=0.8,
+            heatmap_linkage_method='average',
+            heatmap_max_rows=0,
+            heatmap_formats=['png'],
+            heatmap_rasterize=False,
+            top_variable_genes=0,
+            sample_group_column='group',
+            control_group_name=None,
+            experimental_group_name=None,
+            sample_batch_column=None,
+            skip_differential_analysis=False,
+            parallel_comparisons=True,
+            tpm_chunk_rows=0,
+            pca_n_components=2,
+            pca_svd_solver='auto',
+            pca_block_rows=0,
+            sample_distance_metrics=None,
+            volcano_plot_label_genes=None,
+            gsea_input='deseq2',
+            gsea_gene_name_keywords=None,
+            gsea_gene_set_name_keywords=None,
+            gsea_top_n_plots=5,
+            gene_p_threshold=0.05,
+            gene_q_threshold=0.5,
+            pathway_p_threshold=0.05,
+            pathway_q_threshold=0.5,
+            sweep_gene_p_thresholds=None,
+            sweep_gene_q_thresholds=None,
+            sweep_pathway_p_thresholds=None,
+            sweep_pathway_q_thresholds=None,
+            organism='human',
+            enrichment_pathway_keywords=None,
+            show_n_pathways=20,
+            colormap='Set1',
+            invert_colors=False
+        )
+
+        for c, e in combinations(sample_info_df['group'].unique(), 2):
+            with self.subTest(comparison=f'{c}__vs__{e}'):
+                self.assertTrue(exists(f'{self.outdir}/{c}__vs__{e}/clusterProfiler'))
+                self.assertTrue(exists(f'{self.outdir}/{c}__vs__{e}/gsea'))
+                with open(f'{self.workdir}/{c}__vs__{e}.log') as fh:
+                    log = fh.read()
+                self.assertIn(f'Running pathway analysis for "{c}" vs "{e}"', log)
+                self.assertIn('GSEA', log)
+
 
 class TestSubsetSamples(TestCase):
 
@@ -73,6 +155,29 @@ class TestSubsetSamples(TestCase):
             )
 
 
+class TestAlignGeneInfo(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        count_df = pd.DataFrame(
+            data=np.array([[1, 2], [3, 4], [5, 6]], dtype=np.int32),
+            index=['gene1', 'gene2', 'gene3'],
+            columns=['sample1', 'sample2'])
+        gene_info_df = pd.DataFrame(
+            data={'Gene Name': ['G4', 'G2', 'G1', 'G2-dup']},
+            index=['gene4', 'gene2', 'gene1', 'gene2'])
+
+        actual = AlignGeneInfo(self.settings).main(gene_info_df=gene_info_df, count_df=count_df)
+
+        self.assertListEqual(['gene1', 'gene2', 'gene3'], actual.index.tolist())
+        self.assertListEqual(['G1', 'G2', None], [None if pd.isna(v) else v for v in actual['Gene Name']])
+
+
 class TestGetColors(TestCase):
 
     def setUp(self):
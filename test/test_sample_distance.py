@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from os.path import exists
+from unittest.mock import patch
+from scipy.spatial.distance import pdist, squareform
+from rna_seq_analysis.sample_distance import SampleDistance
+from .setup import TestCase
+
+
+class TestSampleDistance(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_main(self):
+        rng = np.random.default_rng(1)
+        df = pd.DataFrame(
+            data=rng.poisson(lam=rng.gamma(1, 50, size=(1001, 1)), size=(1001, 6)),
+            index=[f'gene{i}' for i in range(1001)],
+            columns=[f'sample{i}' for i in range(6)])
+
+        with patch.object(SampleDistance, 'MEMORY_BUDGET_MB', 0.01):  # many blocks
+            actual = SampleDistance(self.settings).main(feature_by_sample_df=df, fname='abc')
+
+        log_df = np.log2(df + 1)
+        anscombe = 2 * np.sqrt(df.to_numpy().T + 3 / 8)
+        expected = {
+            'pearson': log_df.corr(),
+            'spearman': df.corr(method='spearman'),
+            'euclidean': squareform(pdist(log_df.to_numpy().T)),
+            'poisson': squareform(pdist(anscombe)),
+        }
+        for metric, e in expected.items():
+            with self.subTest(metric=metric):
+                np.testing.assert_allclose(e, actual[metric], atol=1e-8)
+                self.assertTrue(exists(f'{self.outdir}/sample-distance/abc-{metric}.csv'))
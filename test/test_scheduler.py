@@ -0,0 +1,76 @@
+import time
+import threading
+from rna_seq_analysis.template import Processor, PYPLOT
+from rna_seq_analysis.scheduler import Scheduler, Task
+from .setup import TestCase
+
+
+class Plot(Processor):
+
+    LOCKS = [PYPLOT]
+
+    def main(self, log: list):
+        log.append(('start', threading.current_thread().name))
+        time.sleep(0.05)
+        log.append(('end', threading.current_thread().name))
+
+
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_dependencies(self):
+        order = []
+
+        def task(name: str):
+            def f():
+                order.append(name)
+                return name
+            return f
+
+        results = Scheduler(self.settings).main(tasks=[
+            Task(name='c', function=task('c'), dependencies=['a', 'b']),
+            Task(name='a', function=task('a')),
+            Task(name='b', function=task('b'), dependencies=['a']),
+        ])
+
+        self.assertListEqual(['a', 'b', 'c'], order)
+        self.assertDictEqual({'a': 'a', 'b': 'b', 'c': 'c'}, results)
+
+    def test_concurrent(self):
+        barrier = threading.Barrier(2, timeout=5)  # fails if the two tasks do not run at the same time
+        Scheduler(self.settings).main(tasks=[
+            Task(name='a', function=barrier.wait),
+            Task(name='b', function=barrier.wait),
+        ])
+
+    def test_locks(self):
+        log = []
+        Scheduler(self.settings).main(tasks=[
+            Task(name=f'plot-{i}', function=lambda: Plot(self.settings).main(log=log)) for i in range(3)
+        ])
+        events = [e for e, _ in log]
+        self.assertListEqual(['start', 'end'] * 3, events)  # never two plots at the same time
+
+    def test_failed_task(self):
+        def fail():
+            raise ValueError('failed')
+
+        ran = []
+        with self.assertRaises(ValueError):
+            Scheduler(self.settings).main(tasks=[
+                Task(name='a', function=fail),
+                Task(name='b', function=lambda: ran.append('b'), dependencies=['a']),
+            ])
+        self.assertListEqual([], ran)
+
+    def test_circular_dependencies(self):
+        with self.assertRaises(AssertionError):
+            Scheduler(self.settings).main(tasks=[
+                Task(name='a', function=print, dependencies=['b']),
+                Task(name='b', function=print, dependencies=['a']),
+            ])
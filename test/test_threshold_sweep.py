@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pandas as pd
+from rna_seq_analysis.threshold_sweep import SweepVolcanoPlots, count_significant_genes, count_pathways
+from .setup import TestCase
+
+
+class TestThresholdSweep(TestCase):
+
+    def setUp(self):
+        self.set_up(py_path=__file__)
+
+    def tearDown(self):
+        self.tear_down()
+
+    def test_sweep_volcano_plots(self):
+        rng = np.random.default_rng(1)
+        n = 2000
+        df = pd.DataFrame(
+            data={
+                'gene_name': [f'GENE{i}' for i in range(n)],
+                'log2FoldChange': rng.normal(0, 2, n),
+                'pvalue': rng.uniform(0, 1, n),
+                'padj': rng.uniform(0, 1, n),
+            },
+            index=[f'ENSG{i:05d}' for i in range(n)])
+        SweepVolcanoPlots(self.settings).main(
+            statistics_df=df,
+            gene_name_column='gene_name',
+            genes_to_label=['GENE1'],
+            column_to_thresholds={'pvalue': [0.01, 0.05], 'padj': [0.1]},
+            up_color=(1., 0., 0., 1.),
+            down_color=(0., 0., 1., 1.))
+        for png in ['pvalue-0.01-volcano-plot.png', 'pvalue-0.05-volcano-plot.png', 'padj-0.1-volcano-plot.png']:
+            self.assertTrue(os.path.exists(f'{self.outdir}/{png}'))
+
+    def test_count_significant_genes(self):
+        df = pd.DataFrame({
+            'log2FoldChange': [2., 1., -1.5, 0.5, -3., np.nan, 4.],
+            'padj':           [0.01, 0.05, 0.05, 0.001, 0.2, 0.01, np.nan],
+        })
+        actual = count_significant_genes(statistics_df=df, p_value_column='padj', thresholds=[0.01, 0.05, 0.2])
+        expected = {0.01: (1, 0), 0.05: (2, 1), 0.2: (2, 2)}
+        self.assertDictEqual(expected, actual)
+
+    def test_count_pathways(self):
+        df = pd.DataFrame({'ID': ['a', 'b', 'c'], 'pvalue': [0.001, 0.01, 0.04], 'qvalue': [0.01, 0.1, 0.3]})
+        df.to_csv(f'{self.outdir}/cancer - KEGG.csv')
+        df.to_csv(f'{self.outdir}/cancer - GO Biological Process.csv')
+        df.to_csv(f'{self.outdir}/normal - KEGG.csv')
+        df.to_csv(f'{self.outdir}/cancer - treated - KEGG.csv')  # of the group "cancer - treated", not "cancer"
+        df.to_csv(f'{self.outdir}/cancer - summary.csv')
+        self.assertEqual(4, count_pathways(d=self.outdir, group_name='cancer', pathway_p_threshold=0.05, pathway_q_threshold=0.2))
+        self.assertEqual(1, count_pathways(d=self.outdir, group_name='normal', pathway_p_threshold=0.005, pathway_q_threshold=0.2))
+        self.assertEqual(0, count_pathways(d=f'{self.outdir}/none', group_name='normal', pathway_p_threshold=0.05, pathway_q_threshold=0.2))
@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
-from rna_seq_analysis.tpm import TPM
+from functools import partial
+from rna_seq_analysis.tpm import TPM, StreamingTPM, iter_row_chunks
 from .setup import TestCase
 
 
@@ -19,3 +21,52 @@ class TestTPM(TestCase):
         )
         expected = pd.read_csv(f'{self.indir}/tpm.csv', index_col=0)
         self.assertDataFrameEqual(expected, actual)
+
+    def test_float32(self):
+        count_df = pd.DataFrame(
+            data=[[10, 20], [30, 40], [50, 60]],
+            index=['gene1', 'gene2', 'gene3'],
+            columns=['sample1', 'sample2'])
+        gene_info_df = pd.DataFrame(
+            data={'Gene Length': [1000., 2000., None]},
+            index=['gene1', 'gene2', 'gene3'])
+
+        expected = TPM(self.settings).main(
+            count_df=count_df,
+            gene_info_df=gene_info_df,
+            gene_length_column='Gene Length')
+
+        self.settings.float32 = True
+        actual = TPM(self.settings).main(
+            count_df=count_df,
+            gene_info_df=gene_info_df,
+            gene_length_column='Gene Length')
+
+        self.assertListEqual(['gene1', 'gene2'], actual.index.tolist())
+        self.assertTrue((actual.dtypes == 'float32').all())
+        self.assertDataFrameEqual(expected, actual.astype('float64'))
+
+    def test_streaming(self):
+        rng = np.random.default_rng(1)
+        genes = [f'gene{i}' for i in range(100)]
+        count_df = pd.DataFrame(
+            data=rng.integers(0, 1000, size=(100, 5)),
+            index=genes,
+            columns=[f'sample{i}' for i in range(5)])
+        gene_info_df = pd.DataFrame(
+            data={'Gene Length': rng.integers(500, 5000, size=100).astype(float)},
+            index=genes)
+        gene_info_df.iloc[3, 0] = np.nan
+
+        expected = TPM(self.settings).main(
+            count_df=count_df,
+            gene_info_df=gene_info_df,
+            gene_length_column='Gene Length')
+
+        actual = StreamingTPM(self.settings).main(
+            count_chunks=partial(iter_row_chunks, df=count_df, chunk_rows=7),
+            gene_info_df=gene_info_df,
+            gene_length_column='Gene Length')
+
+        self.assertDataFrameEqual(expected, actual)
+        self.assertDataFrameEqual(expected, pd.read_csv(f'{self.outdir}/tpm.csv', index_col=0))